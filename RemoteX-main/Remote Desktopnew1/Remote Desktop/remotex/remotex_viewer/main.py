@@ -11,10 +11,12 @@ import logging
 import sys
 import threading
 
+from PyQt6.QtCore import QSettings
 from PyQt6.QtGui import QColor, QIcon, QPalette
 from PyQt6.QtWidgets import QApplication
 
 import remotex_viewer.remotex as remotex
+import remotex_viewer.ui.custom_widgets as remotex_widgets
 import remotex_viewer.ui.forms as remotex_forms
 
 
@@ -24,6 +26,11 @@ def main() -> None:
                         format="%(asctime)s - %(name)s[%(thread)d] - %(levelname)s - %(message)s"
     )
 
+    # OpenGL implementation is chosen once, when the application starts
+    settings = QSettings(remotex.APP_ORGANIZATION_NAME, remotex.APP_NAME)
+    if settings.value(remotex.SETTINGS_KEY_SOFTWARE_OPENGL, False, type=bool):
+        remotex_widgets.use_software_opengl()
+
     app = QApplication(sys.argv)
 
     app.setWindowIcon(QIcon(remotex.APP_ICON))
@@ -1,18 +1,34 @@
-from .backend import Client, Session, Screen, VirtualDesktopThread, EventsThread, ConnectThread, ArcaneProtocolError, ArcaneProtocolException
+from .backend import Client, Session, Screen, VirtualDesktopThread, EventsThread, ClipboardThread, FileTransferThread, TransferJob, ConnectThread, ArcaneProtocolError, ArcaneProtocolException, UntrustedServerCertificate
 from .constants import (APP_DISPLAY_NAME, APP_ICON, APP_NAME,
                         APP_ORGANIZATION_NAME, APP_VERSION, DEFAULT_JSON,
                         SETTINGS_KEY_CLIPBOARD_MODE,
                         SETTINGS_KEY_IMAGE_QUALITY, SETTINGS_KEY_PACKET_SIZE,
                         SETTINGS_KEY_BLOCK_SIZE, SETTINGS_KEY_TRUSTED_CERTIFICATES,
+                        SETTINGS_KEY_USE_TLS, SETTINGS_KEY_TLS_CIPHER,
+                        SETTINGS_KEY_KEEPALIVE_TIMEOUT, SETTINGS_KEY_DATAGRAM_TRANSPORT,
+                        SETTINGS_KEY_TILE_ENCODING, SETTINGS_KEY_PIXEL_FORMAT,
+                        SETTINGS_KEY_OPENGL_VIEWPORT, SETTINGS_KEY_SOFTWARE_OPENGL,
+                        SETTINGS_KEY_CURSOR_PREDICTION, SETTINGS_KEY_CURSOR_SMOOTHING,
                         VD_WINDOW_ADJUST_RATIO)
 
-from .protocol import (PROTOCOL_VERSION, ArcaneProtocolCommand,
+from .protocol import (PROTOCOL_VERSION, ArcaneProtocolCommand, BlockSize,
                        ClipboardMode, InputEvent, MouseButton, MouseCursorKind,
-                       MouseState, OutputEvent, PacketSize, WorkerKind)
+                       MouseState, OutputEvent, PacketSize, PixelFormat, TileEncoding, WorkerKind)
+from .clipboard import formats_to_mime, mime_to_formats
+from .compositor import DESKTOP_REDUCTIONS, DIRTY_RECTS_MAX, DesktopCompositor
+from .cursor import CursorPredictor
+from .decoder import TileDecoder
+from .filetransfer import join_remote
+from .keepalive import LinkMonitor
+from .profiling import SPANS, StageTimer
+from .statistics import STATISTICS, STATISTICS_INTERVAL, PipelineStatistics
+from .tls import TlsCipherPreference
+from .tracing import TraceRecorder
 
 __all__ = [
     'ArcaneProtocolError',
     'ArcaneProtocolException',
+    'UntrustedServerCertificate',
     'PROTOCOL_VERSION',
     'ClipboardMode',
     'InputEvent',
@@ -21,13 +37,35 @@ __all__ = [
     'MouseState',
     'OutputEvent',
     'PacketSize',
+    'BlockSize',
+    'TileEncoding',
+    'PixelFormat',
     'ArcaneProtocolCommand',
     'WorkerKind',
+    'TlsCipherPreference',
+    'LinkMonitor',
+    'SPANS',
+    'StageTimer',
+    'PipelineStatistics',
+    'TraceRecorder',
+    'STATISTICS',
+    'STATISTICS_INTERVAL',
+    'DesktopCompositor',
+    'DESKTOP_REDUCTIONS',
+    'DIRTY_RECTS_MAX',
+    'CursorPredictor',
+    'TileDecoder',
+    'formats_to_mime',
+    'mime_to_formats',
+    'join_remote',
     'Client',
     'Screen',
     'Session',
     'VirtualDesktopThread',
     'EventsThread',
+    'ClipboardThread',
+    'FileTransferThread',
+    'TransferJob',
     'ConnectThread',
     'APP_ICON',
     'APP_NAME',
@@ -39,5 +77,16 @@ __all__ = [
     'SETTINGS_KEY_TRUSTED_CERTIFICATES',
     'SETTINGS_KEY_IMAGE_QUALITY',
     'SETTINGS_KEY_PACKET_SIZE',
+    'SETTINGS_KEY_BLOCK_SIZE',
     'SETTINGS_KEY_CLIPBOARD_MODE',
+    'SETTINGS_KEY_USE_TLS',
+    'SETTINGS_KEY_TLS_CIPHER',
+    'SETTINGS_KEY_KEEPALIVE_TIMEOUT',
+    'SETTINGS_KEY_DATAGRAM_TRANSPORT',
+    'SETTINGS_KEY_TILE_ENCODING',
+    'SETTINGS_KEY_PIXEL_FORMAT',
+    'SETTINGS_KEY_OPENGL_VIEWPORT',
+    'SETTINGS_KEY_SOFTWARE_OPENGL',
+    'SETTINGS_KEY_CURSOR_PREDICTION',
+    'SETTINGS_KEY_CURSOR_SMOOTHING',
 ]
@@ -1,21 +1,76 @@
 import socket
+import ssl
 import json
 import logging
+import os
+import random
 import struct
+import threading
 import time
 import traceback
 from abc import abstractmethod
-from typing import Optional, List
+from collections import deque
+from typing import Callable, Dict, Optional, List, Sequence, Tuple, Union
 
-from PyQt6.QtCore import QMutex, QThread, pyqtSignal, pyqtSlot, QByteArray, QSize, Qt
+from PyQt6.QtCore import QMutex, QThread, pyqtSignal, pyqtSlot, QRect, QSize, Qt
 from PyQt6.QtGui import QImage
 from PyQt6.QtCore import QSettings
 
 import remotex_viewer.remotex as remotex
 from .protocol import *
+from .transport import ChannelStream, Multiplexer
+from .keepalive import DEAD_LINK_TIMEOUT, KEEPALIVE_INTERVAL, LinkMonitor, is_pong
+from .datagram import (DATAGRAM_BUFFER_SIZE, DATAGRAM_HEADER, KIND_HELLO, NACK_DELAY, Block, TileAssembler,
+                       blocks_of)
+from . import tls
+from .profiling import SPANS
+from .compositor import DesktopCompositor
+from .decoder import TileDecoder
+from .tracing import TraceRecorder
+from .clipboard import (MAX_CLIPBOARD_SIZE, ClipboardError, ClipboardSync, allows_receive, allows_send,
+                        combine_modes, content_digest, image_to_png, parse_mode, read_transfer, send_transfer)
+from .filetransfer import (RemoteFileError, TransferError, complete_partial, discard_partial, open_partial,
+                           partial_offset, read_state, receive_chunks, send_file, yield_to_input)
 
 logger = logging.getLogger(__name__)
 
+RECV_BUFFER_SIZE = 65536
+
+# Session resume after a network drop: exponential backoff with jitter, given up before the server expires the session
+RESUME_INITIAL_DELAY = 0.25
+RESUME_MAX_DELAY = 4.0
+RESUME_TIMEOUT = 55
+
+# UDP desktop tiles
+DATAGRAM_HELLO_INTERVAL = 0.1
+DATAGRAM_POLL_INTERVAL = 0.01
+KEYFRAME_REQUEST_INTERVAL = 1.0
+
+# File transfers
+TRANSFER_RETRIES = 5  # Consecutive failed attempts (each resuming from the last verified chunk) before giving up
+TRANSFER_PROGRESS_INTERVAL = 0.1
+
+CHUNK_HEADER = struct.Struct('IIIB')
+
+MOUSE_CURSOR_SHAPES = {
+    MouseCursorKind.IDC_APPSTARTING: Qt.CursorShape.BusyCursor,
+    MouseCursorKind.IDC_ARROW: Qt.CursorShape.ArrowCursor,
+    MouseCursorKind.IDC_CROSS: Qt.CursorShape.CrossCursor,
+    MouseCursorKind.IDC_HAND: Qt.CursorShape.PointingHandCursor,
+    MouseCursorKind.IDC_HELP: Qt.CursorShape.WhatsThisCursor,
+    MouseCursorKind.IDC_IBEAM: Qt.CursorShape.IBeamCursor,
+    MouseCursorKind.IDC_ICON: Qt.CursorShape.ArrowCursor,
+    MouseCursorKind.IDC_NO: Qt.CursorShape.ForbiddenCursor,
+    MouseCursorKind.IDC_SIZE: Qt.CursorShape.SizeAllCursor,
+    MouseCursorKind.IDC_SIZEALL: Qt.CursorShape.SizeAllCursor,
+    MouseCursorKind.IDC_SIZENESW: Qt.CursorShape.SizeBDiagCursor,
+    MouseCursorKind.IDC_SIZENS: Qt.CursorShape.SizeVerCursor,
+    MouseCursorKind.IDC_SIZENWSE: Qt.CursorShape.SizeFDiagCursor,
+    MouseCursorKind.IDC_SIZEWE: Qt.CursorShape.SizeHorCursor,
+    MouseCursorKind.IDC_UPARROW: Qt.CursorShape.UpArrowCursor,
+    MouseCursorKind.IDC_WAIT: Qt.CursorShape.WaitCursor,
+}
+
 from enum import Enum, auto
 
 class ArcaneProtocolError(Enum):
@@ -32,6 +87,12 @@ class ArcaneProtocolException(Exception):
         self.reason = reason
         super().__init__(str(reason))
 
+class UntrustedServerCertificate(ArcaneProtocolException):
+    """ Server certificate is neither in the trusted certificates store nor accepted by the user for this session """
+    def __init__(self, fingerprint: str) -> None:
+        self.fingerprint = fingerprint
+        super().__init__(ArcaneProtocolError.MissingServerCertificate)
+
 class Screen:
     def __init__(self, screen_information_json: dict) -> None:
         self.id = screen_information_json.get("Id", 0)
@@ -46,39 +107,122 @@ class Screen:
         return QSize(self.width, self.height)
 
 class Client:
-    def __init__(self, server_address: str, server_port: int, password: str) -> None:
+    def __init__(self, server_address: str, server_port: int, password: str, commands: Sequence[str] = (),
+                 tls_context: Optional[ssl.SSLContext] = None,
+                 verify_certificate: Optional[Callable[[str], None]] = None) -> None:
         self.server_address = server_address
         self.server_port = server_port
         self.password = password
-        self.conn = None
-        
-        self.connect()
+        self.tls_context = tls_context
+        self.verify_certificate = verify_certificate
+        self.conn: Optional[Union[socket.socket, ChannelStream]] = None
+        self._buffer = bytearray()
 
-    def connect(self):
+        self.connect(commands)
+
+    def connect(self, commands: Sequence[str] = ()):
+        """ Connect and authenticate. Password (and optional first command lines) are pipelined with the server banner
+            to save round trips on high-latency links, server processes them in order once the banner is sent. """
         logger.info(f"Connecting to {self.server_address}:{self.server_port}...")
         self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.conn.connect((self.server_address, self.server_port))
-        
+
+        if self.tls_context is not None:
+            self.start_tls()
+
         # Handshake
+        pipelined = self.password.encode() + b'\n'
+        for command in commands:
+            pipelined += command.encode() + b'\n'
+        self.conn.sendall(pipelined)
+
         banner = self.read_line()
-        if banner != "ArcaneServer":
+        if banner != "RemotexServer":
             raise Exception("Invalid Server Banner")
-            
-        self.write_line(self.password)
+
         response = self.read_line()
         if response != "OK":
             raise Exception("Authentication Failed")
             
+        if isinstance(self.conn, ssl.SSLSocket):
+            # With TLS 1.3 the session ticket is only received with the first server data, keep the latest one
+            tls.store_session(self.server_address, self.server_port, self.conn.context, self.conn.session)
+
         logger.info("Connected and Authenticated")
 
+    def start_tls(self) -> None:
+        """ Wrap the connection with TLS, reusing a previous TLS session with that server when possible (abbreviated
+            handshake), then verify the server certificate before any secret is sent. """
+        if self.tls_context is None or not isinstance(self.conn, socket.socket):
+            return
+
+        try:
+            self.conn = self.tls_context.wrap_socket(
+                self.conn,
+                session=tls.get_session(self.server_address, self.server_port, self.tls_context)
+            )
+        except ssl.SSLError as e:
+            if tls.is_plaintext_server_error(e):
+                raise ConnectionError("Server does not speak TLS: configure a certificate on the server, or disable "
+                                      "TLS in the options if the network is trusted.") from e
+
+            raise
+
+        logger.debug(f"TLS established: {self.conn.version()}, {self.conn.cipher()}, "
+                     f"session reused: {self.conn.session_reused}")
+
+        if self.verify_certificate is not None:
+            self.verify_certificate(tls.certificate_fingerprint(self.conn.getpeercert(binary_form=True)))
+
+    def _fill_buffer(self) -> None:
+        """ Block until more data is available from the server and append it to the read buffer """
+        chunk = self.conn.recv(RECV_BUFFER_SIZE)
+        if not chunk:
+            raise EOFError("Connection closed by the remote peer")
+
+        self._buffer += chunk
+
     def read_line(self) -> str:
-        data = b""
         while True:
-            chunk = self.conn.recv(1)
-            if not chunk: break
-            data += chunk
-            if chunk == b'\n': break
-        return data.decode().strip()
+            index = self._buffer.find(b'\n')
+            if index != -1:
+                break
+
+            self._fill_buffer()
+
+        line = bytes(self._buffer[:index])
+        del self._buffer[:index + 1]
+
+        return line.decode().strip()
+
+    def recv_exact(self, size: int) -> bytes:
+        """ Read exactly `size` bytes, data already buffered by `read_line` is consumed first """
+        while len(self._buffer) < size:
+            self._fill_buffer()
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+
+        return data
+
+    def recv_into(self, view: memoryview) -> int:
+        """ Read into `view`, data already buffered by `read_line` first. Bulk data is then received in place rather
+            than through the read buffer. """
+        if self._buffer:
+            size = min(len(view), len(self._buffer))
+            view[:size] = self._buffer[:size]
+            del self._buffer[:size]
+
+            return size
+
+        return self.conn.recv_into(view)
+
+    def take_buffer(self) -> bytes:
+        """ Hand over data received but not consumed yet (e.g. to the session multiplexer) """
+        data = bytes(self._buffer)
+        self._buffer.clear()
+
+        return data
 
     def write_line(self, line: str) -> None:
         self.conn.sendall(line.encode() + b'\n')
@@ -91,46 +235,218 @@ class Client:
 
     def close(self):
         if self.conn:
+            # Shutdown first so that any thread blocked on `recv` is woken up immediately
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
             self.conn.close()
 
+class ChannelClient(Client):
+    """ Client bound to a logical channel of the session multiplexed connection, no connection nor handshake
+        is required since the session connection is already authenticated. """
+    def __init__(self, stream: ChannelStream) -> None:
+        self.conn = stream
+        self._buffer = bytearray()
+
 class Session:
-    def __init__(self, server_address: str, server_port: int, password: str) -> None:
+    def __init__(self, server_address: str, server_port: int, password: str,
+                 accepted_fingerprint: Optional[str] = None) -> None:
         self.server_address = server_address
         self.server_port = server_port
         self.password = password
+        self.accepted_fingerprint = accepted_fingerprint
+        self.server_fingerprint: Optional[str] = None
         self.session_id = None
         self.display_name = "Remote"
         self.presentation = False
         
         settings = QSettings(remotex.APP_ORGANIZATION_NAME, remotex.APP_NAME)
-        self.clipboard_mode = settings.value(remotex.SETTINGS_KEY_CLIPBOARD_MODE, ClipboardMode.Both)
+        clipboard_mode = settings.value(remotex.SETTINGS_KEY_CLIPBOARD_MODE, ClipboardMode.Both)
+        self.clipboard_mode = clipboard_mode if isinstance(clipboard_mode, ClipboardMode) else ClipboardMode.Both
+        self.server_clipboard_mode = ClipboardMode.Both  # Clipboard sharing the server allows, from the session info
+        self.file_transfer = False  # Server accepts file transfers, from the session info
         self.option_image_quality = settings.value(remotex.SETTINGS_KEY_IMAGE_QUALITY, 80)
         self.option_packet_size = settings.value(remotex.SETTINGS_KEY_PACKET_SIZE, PacketSize.Size4096)
 
+        self.tls_context: Optional[ssl.SSLContext] = None
+        if settings.value(remotex.SETTINGS_KEY_USE_TLS, True, type=bool):
+            self.tls_context = tls.client_context(
+                settings.value(remotex.SETTINGS_KEY_TLS_CIPHER, tls.TlsCipherPreference.Auto)
+            )
+
+        # QSettings may return a single value instead of a one item list depending on the platform backend
+        trusted_fingerprints = settings.value(remotex.SETTINGS_KEY_TRUSTED_CERTIFICATES, []) or []
+        if isinstance(trusted_fingerprints, str):
+            trusted_fingerprints = [trusted_fingerprints]
+
+        self.trusted_fingerprints = [str(fingerprint).upper() for fingerprint in trusted_fingerprints]
+
+        block_size = settings.value(remotex.SETTINGS_KEY_BLOCK_SIZE, BlockSize.Size64)
+        self.option_block_size = block_size if isinstance(block_size, BlockSize) else BlockSize.Size64
+        self.option_datagram_transport = settings.value(remotex.SETTINGS_KEY_DATAGRAM_TRANSPORT, False, type=bool)
+
+        tile_encoding = settings.value(remotex.SETTINGS_KEY_TILE_ENCODING, TileEncoding.Jpeg)
+        self.option_tile_encoding = tile_encoding if isinstance(tile_encoding, TileEncoding) else TileEncoding.Jpeg
+        pixel_format = settings.value(remotex.SETTINGS_KEY_PIXEL_FORMAT, PixelFormat.RGB888)
+        self.option_pixel_format = pixel_format if isinstance(pixel_format, PixelFormat) else PixelFormat.RGB888
+        self.option_opengl_viewport = settings.value(remotex.SETTINGS_KEY_OPENGL_VIEWPORT, False, type=bool)
+        self.option_cursor_prediction = settings.value(remotex.SETTINGS_KEY_CURSOR_PREDICTION, False, type=bool)
+        self.option_cursor_smoothing = settings.value(remotex.SETTINGS_KEY_CURSOR_SMOOTHING, 100, type=int)  # ms
+
+        self.link_timeout = settings.value(remotex.SETTINGS_KEY_KEEPALIVE_TIMEOUT, DEAD_LINK_TIMEOUT, type=int)
+
+        # Keepalive estimates (RTT, jitter, clock offset) of the current session connection
+        self.link = LinkMonitor(self.link_timeout)
+
+        # Desktop pipeline timeline, toggled at runtime along with the server one
+        self.tracer = TraceRecorder()
+
+        self.multiplexer: Optional[Multiplexer] = None
+        self._resume_lock = threading.Lock()
+        self._closed = threading.Event()
+
         self.request_session()
 
     def request_session(self):
-        client = Client(self.server_address, self.server_port, self.password)
+        """ Open a single connection session, Desktop and Events workers are then carried as logical channels of that
+            same connection, so they don't pay for an additional connection and authentication each. """
+        info = self.open_connection(ArcaneProtocolCommand.OpenSession.name)
+
+        self.session_id = info["SessionId"]
+        self.display_name = f"{info['Username']}@{info['MachineName']}"
+        self.server_clipboard_mode = parse_mode(info.get("Clipboard"), ClipboardMode.Both)
+        self.file_transfer = bool(info.get("FileTransfer", False))
+
+    @property
+    def effective_clipboard_mode(self) -> ClipboardMode:
+        """ Clipboard sharing both this viewer and the server allow """
+        return combine_modes(self.clipboard_mode, self.server_clipboard_mode)
+
+    @property
+    def closed(self) -> bool:
+        """ The session was closed on purpose, its connection dropping is not a lost link """
+        return self._closed.is_set()
+
+    def resume_session(self) -> None:
+        """ Bind a new connection to the existing server session, no new session nor worker negotiation is required """
+        self.open_connection(ArcaneProtocolCommand.ResumeSession.name, self.session_id)
+
+    def open_connection(self, *commands: str) -> dict:
+        """ Connect, authenticate, send `commands` and start the multiplexer on top of the new connection """
+        client = Client(self.server_address, self.server_port, self.password, commands=commands,
+                        tls_context=self.tls_context, verify_certificate=self.verify_server_certificate)
         try:
-            client.write_line("RequestSession")
-            info = client.read_json()
-            self.session_id = info["SessionId"]
-            self.display_name = f"{info['Username']}@{info['MachineName']}"
-        finally:
+            line = client.read_line()
+            if line == ArcaneProtocolCommand.ResourceNotFound.name:
+                raise ArcaneProtocolException(ArcaneProtocolError.MissingSession)
+
+            info = json.loads(line)
+        except Exception:
             client.close()
+            raise
+
+        self.link = LinkMonitor(self.link_timeout)
+
+        self.multiplexer = Multiplexer(client.conn, client.take_buffer())
+        self.multiplexer.start()
+
+        return info
+
+    def resume(self, lost_multiplexer: Optional[Multiplexer]) -> bool:
+        """ Called by workers when the session connection dropped. The first caller reconnects (exponential backoff
+            with jitter) while others wait for it, return False if the session could not be resumed or was closed. """
+        with self._resume_lock:
+            if self.multiplexer is not None and self.multiplexer is not lost_multiplexer and \
+                    not self.multiplexer.closed:
+                return True
+
+            delay = RESUME_INITIAL_DELAY
+            deadline = time.monotonic() + RESUME_TIMEOUT
+
+            while not self._closed.is_set() and time.monotonic() < deadline:
+                try:
+                    self.resume_session()
+
+                    logger.info(f"Session {self.session_id} resumed")
+
+                    return True
+                except ArcaneProtocolException as e:
+                    if e.reason in (ArcaneProtocolError.MissingSession, ArcaneProtocolError.ServerFingerprintTampered):
+                        logger.error(f"Session {self.session_id} can't be resumed: {e}")
+
+                        return False
+                except Exception as e:
+                    logger.warning(f"Session {self.session_id} resume attempt failed: {e}")
+
+                self._closed.wait(random.uniform(delay / 2, delay))
+                delay = min(delay * 2, RESUME_MAX_DELAY)
+
+            return False
+
+    def verify_server_certificate(self, fingerprint: str) -> None:
+        """ Once a certificate was trusted for this session, it is pinned: every later connection of the session must
+            present the very same certificate. """
+        if self.server_fingerprint is not None:
+            if fingerprint != self.server_fingerprint:
+                raise ArcaneProtocolException(ArcaneProtocolError.ServerFingerprintTampered)
+
+            return
+
+        if fingerprint != self.accepted_fingerprint and fingerprint not in self.trusted_fingerprints:
+            raise UntrustedServerCertificate(fingerprint)
+
+        self.server_fingerprint = fingerprint
 
     def claim_client(self, worker_kind: WorkerKind) -> Client:
-        client = Client(self.server_address, self.server_port, self.password)
-        client.write_line("AttachToSession")
-        client.write_line(self.session_id)
-        resp = client.read_line()
-        if resp != "ResourceFound":
-            raise Exception("Session not found")
-        client.write_line(worker_kind.name)
+        if self.multiplexer is None or self.multiplexer.closed:
+            raise ConnectionError("Session connection is closed")
+
+        return ChannelClient(self.multiplexer.open_channel(Channel[worker_kind.name]))
+
+    def attach_client(self, worker_kind: WorkerKind) -> Client:
+        """ Connection of its own attached to the session, for workers moving bulk data that must neither go through
+            the multiplexer nor delay its channels (file transfers are sent with sendfile). """
+        client = Client(self.server_address, self.server_port, self.password,
+                        commands=(ArcaneProtocolCommand.AttachToSession.name, self.session_id, worker_kind.name),
+                        tls_context=self.tls_context, verify_certificate=self.verify_server_certificate)
+        try:
+            if client.read_line() != ArcaneProtocolCommand.ResourceFound.name:
+                raise ArcaneProtocolException(ArcaneProtocolError.MissingSession)
+        except Exception:
+            client.close()
+            raise
+
         return client
 
+    def stop_tracing(self) -> Optional[str]:
+        """ Write the trace of the session, return its path (None when the session was not traced) """
+        return self.tracer.stop(self.session_id, self.link.report())
+
+    def close(self) -> None:
+        """ Tell the server the session is over and release the session connection """
+        self._closed.set()
+        self.stop_tracing()
+
+        if self.multiplexer is None:
+            return
+
+        if not self.multiplexer.closed:
+            try:
+                control = ChannelClient(self.multiplexer.open_channel(Channel.Control))
+                control.write_json({"Command": "CloseSession"})
+                self.multiplexer.flush()
+            except OSError:
+                pass
+
+        self.multiplexer.close()
+        self.multiplexer = None
+
 class ClientBaseThread(QThread):
     thread_finished = pyqtSignal(bool)
+    connection_lost = pyqtSignal()
+    connection_resumed = pyqtSignal()
 
     def __init__(self, session: Session, worker_kind: WorkerKind) -> None:
         super().__init__()
@@ -142,11 +458,32 @@ class ClientBaseThread(QThread):
         self.worker_kind = worker_kind
 
     def run(self) -> None:
+        """ Run the worker, if the session connection drops the session is resumed and the worker carries on over the
+            new connection instead of ending. """
         on_error = False
         try:
-            self.client = self.session.claim_client(self.worker_kind)
-            self._connected = True
-            self.client_execute()
+            while self._running:
+                multiplexer = self.session.multiplexer
+                try:
+                    self.client = self.session.claim_client(self.worker_kind)
+                    self._connected = True
+                    self.client_execute()
+                except (OSError, EOFError) as e:
+                    logger.debug(f"{self.worker_kind.name} worker connection error: {e}")
+
+                # Worker ended on purpose (or channel closed by the server), not because the link was lost
+                if not self._running or self.session.closed or (multiplexer is not None and not multiplexer.closed):
+                    break
+
+                self._connected = False
+                self.connection_lost.emit()
+
+                if not self.session.resume(multiplexer):
+                    # A session closed meanwhile is a clean stop
+                    on_error = self._running and not self.session.closed
+                    break
+
+                self.connection_resumed.emit()
         except Exception as e:
             if self._running:
                 logger.error(f"Thread error: {e}")
@@ -171,13 +508,24 @@ class ClientBaseThread(QThread):
             self._mutex.unlock()
 
 class VirtualDesktopThread(ClientBaseThread):
+    """ Desktop worker: receives the desktop tiles, decodes them on a pool (`decoder`) and composites them into
+        `compositor`, the GUI thread repaints what changed once per display refresh """
     open_cellar_door = pyqtSignal(Screen)
-    received_dirty_rect_signal = pyqtSignal(QImage, int, int)
     start_events_worker_signal = pyqtSignal()
 
     def __init__(self, session: Session) -> None:
         super().__init__(session, WorkerKind.Desktop)
         self.selected_screen: Optional[Screen] = None
+        self.compositor = DesktopCompositor()
+        self.decoder: Optional[TileDecoder] = None
+        self.reduction = 1
+        self.datagram_stats: Optional[dict] = None
+        self.timer = SPANS.timer("Desktop")
+
+        # Cumulative, sampled by the performance overlay
+        self.received_bytes = 0
+        self.received_tiles = 0
+        self.received_frames = 0
 
     def client_execute(self) -> None:
         if not self.client: return
@@ -186,100 +534,713 @@ class VirtualDesktopThread(ClientBaseThread):
         self.client.write_json({
             "ScreenName": "Primary",
             "ImageCompressionQuality": self.session.option_image_quality,
-            "PacketSize": self.session.option_packet_size.value
+            "PacketSize": self.session.option_packet_size.value,
+            "BlockSize": self.session.option_block_size.value,
+            "DatagramTransport": self.session.option_datagram_transport,
+            "TileEncoding": self.session.option_tile_encoding.name,
+            "PixelFormat": self.session.option_pixel_format.name,
         })
+
+        datagram_sock = self.open_datagram_transport() if self.session.option_datagram_transport else None
         
-        # Fake screen info for UI
-        self.selected_screen = Screen({"Name": "Primary", "Width": 1920, "Height": 1080}) # Ideally we get this from server
-        self.open_cellar_door.emit(self.selected_screen)
-        self.start_events_worker_signal.emit()
+        # After a resume the virtual desktop is kept as is, server starts over with a keyframe that repaints it
+        if self.selected_screen is None:
+            # Fake screen info for UI
+            self.selected_screen = Screen({"Name": "Primary", "Width": 1920, "Height": 1080}) # Ideally we get this from server
+            self.compositor.resize(self.selected_screen.size())
+            self.open_cellar_door.emit(self.selected_screen)
+            self.start_events_worker_signal.emit()
 
+        self.decoder = TileDecoder(self.composite_tile)
+        self.decoder.reduction = self.reduction
+        self.decoder.tracer = self.session.tracer
+        try:
+            if datagram_sock is not None:
+                self.receive_datagram_tiles(datagram_sock)
+            else:
+                self.receive_tiles()
+        finally:
+            self.decoder.close()
+
+    def receive_tiles(self) -> None:
+        timer = self.timer
+        tracer = self.session.tracer
+        frame = 0  # Frames and tiles received from this stream, numbered like the server does (tracing)
+        tile = 0
         while self._running:
             try:
-                header = self.client.conn.recv(13)
-                if len(header) < 13: break
-                chunk_size, x, y, updated = struct.unpack('IIIB', header)
-                
-                data = b""
-                while len(data) < chunk_size:
-                    packet = self.client.conn.recv(min(4096, chunk_size - len(data)))
-                    if not packet: break
-                    data += packet
-                
-                img = QImage()
-                img.loadFromData(QByteArray(data))
-                self.received_dirty_rect_signal.emit(img, x, y)
+                timer.start()
+                header = self.client.recv_exact(CHUNK_HEADER.size)
+                chunk_size, x, y, flags = CHUNK_HEADER.unpack(header)
+                timer.mark("wait")
+                tracing = tracer.enabled
+                received = time.perf_counter() if tracing else 0.0
+
+                data = self.client.recv_exact(chunk_size)
+                timer.mark("receive")
+                self.count_tile(CHUNK_HEADER.size + chunk_size, flags)
+
+                tile += 1
+                trace = None
+                if tracing:
+                    trace = {"Frame": frame + 1, "Tile": tile}
+                    tracer.span("receive", received, time.perf_counter(), {**trace, "Bytes": chunk_size})
+                if flags & ChunkFlag.EndOfFrame:
+                    frame += 1
+
+                # Decoded and composited on the pool, waits only while the decode backlog is full
+                self.decoder.submit(data, x, y, flags=flags, trace=trace)
+                timer.mark("submit")
             except Exception:
                 break
 
+    def open_datagram_transport(self) -> Optional[socket.socket]:
+        """ Negotiate UDP desktop tiles: greet the port offered by the server with its token until it confirms on the
+            desktop channel. Return None when the server refused or never heard us (tiles then stay on TCP). """
+        offer = self.client.read_json()
+        port = offer.get("DatagramPort")
+        if not port:
+            logger.info("Server refused the datagram transport, desktop tiles stay on TCP")
+            return None
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        hello = DATAGRAM_HEADER.pack(KIND_HELLO, 0, 0, 0, 0) + str(offer.get("Token", "")).encode()
+        greeted = threading.Event()
+
+        def say_hello() -> None:
+            while not greeted.is_set():
+                try:
+                    sock.sendto(hello, (self.session.server_address, port))
+                except OSError:
+                    pass
+
+                greeted.wait(DATAGRAM_HELLO_INTERVAL)
+
+        threading.Thread(target=say_hello, name="DatagramHello", daemon=True).start()
+        try:
+            accepted = self.client.read_json().get("Datagram", False)
+        finally:
+            greeted.set()
+
+        if not accepted:
+            logger.warning("Datagram transport could not be established, desktop tiles stay on TCP")
+            sock.close()
+            return None
+
+        return sock
+
+    def receive_datagram_tiles(self, sock: socket.socket) -> None:
+        """ Reassemble tiles from datagrams. Missing fragments are requested (NACK) on the desktop channel, a tile
+            given up on triggers a keyframe request, and a late tile never overwrites blocks a newer tile painted. """
+        rtt = self.session.link.rtt or 0.0
+        assembler = TileAssembler(nack_delay=max(NACK_DELAY, 2 * rtt))
+        block_versions: Dict[Block, int] = {}
+        last_keyframe_request = 0.0
+
+        stream = self.client.conn
+        timer = self.timer
+        tracer = self.session.tracer
+        frame = 0  # Frames completed, in completion order: the merge tool keys datagram tiles by their tile id
+        sock.settimeout(DATAGRAM_POLL_INTERVAL)
+        try:
+            while self._running and not stream.eof and not stream.multiplexer.closed:
+                timer.start()
+                tracing = False
+                try:
+                    data = sock.recv(DATAGRAM_BUFFER_SIZE)
+                    timer.mark("wait")
+                    tracing = tracer.enabled
+                    received = time.perf_counter() if tracing else 0.0
+                    self.received_bytes += len(data)
+                    completed = assembler.feed(data)
+                    timer.mark("receive")
+                except socket.timeout:
+                    completed = []
+
+                for tile_id, chunk in completed:
+                    chunk_size, x, y, flags = CHUNK_HEADER.unpack_from(chunk)
+                    self.count_tile(0, flags)
+
+                    trace = None
+                    if tracing:
+                        trace = {"Frame": frame + 1, "Tile": tile_id}
+                        tracer.span("receive", received, time.perf_counter(), {**trace, "Bytes": chunk_size})
+                    if flags & ChunkFlag.EndOfFrame:
+                        frame += 1
+
+                    self.decoder.submit(chunk[CHUNK_HEADER.size:CHUNK_HEADER.size + chunk_size], x, y,
+                                        (tile_id, block_versions), flags, trace)
+                if completed:
+                    timer.mark("submit")
+
+                nacks, abandoned = assembler.poll()
+                for tile_id, fragments in nacks:
+                    self.client.write_json({"Nack": tile_id, "Fragments": fragments})
+
+                now = time.monotonic()
+                if abandoned and now - last_keyframe_request >= KEYFRAME_REQUEST_INTERVAL:
+                    self.client.write_json({"Keyframe": True})
+                    last_keyframe_request = now
+
+                self.datagram_stats = assembler.report()
+        finally:
+            sock.close()
+
+    def count_tile(self, size: int, flags: int) -> None:
+        self.received_bytes += size
+        self.received_tiles += 1
+        if flags & ChunkFlag.EndOfFrame:
+            self.received_frames += 1
+
+    def statistics(self) -> dict:
+        """ Cumulative counters of the desktop pipeline, from reception to presentation (performance overlay).
+            Decoder counters start over when the session resumes. """
+        decoder = self.decoder.report() if self.decoder is not None else {}
+        compositor = self.compositor.report()
+
+        return {
+            "ReceivedBytes": self.received_bytes,
+            "ReceivedTiles": self.received_tiles,
+            "ReceivedFrames": self.received_frames,
+            "Decoded": decoder.get("Decoded", 0),
+            "Failed": decoder.get("Failed", 0),
+            "DecodeTime": decoder.get("DecodeTime", 0.0),
+            "Abandoned": (self.datagram_stats or {}).get("TilesAbandoned", 0),
+            "Composited": compositor["Composited"],
+            "CompositeTime": compositor["CompositeTime"],
+            "Presented": compositor["Presented"],
+            "Coalesced": compositor["Coalesced"],
+            "Reduction": compositor["Reduction"],
+        }
+
+    def presented_trace(self) -> Optional[dict]:
+        """ Frame and tile numbers of the latest traced tile composited """
+        return None if self.decoder is None else self.decoder.composited_trace
+
+    def composite_tile(self, img: QImage, x: int, y: int, datagram_tile: Optional[Tuple[int, Dict[Block, int]]],
+                       reduction: int) -> None:
+        """ Decoder callback, called for one tile at a time. A datagram tile (its id and the block versions) completed
+            after a newer one only paints the blocks nothing newer covered. """
+        if datagram_tile is None:
+            self.compositor.composite(img, x, y, reduction=reduction)
+            return
+
+        tile_id, block_versions = datagram_tile
+        block_size = self.session.option_block_size.value
+        blocks = blocks_of((x, y, x + img.width() * reduction, y + img.height() * reduction), block_size)
+        current = [block for block in blocks if block_versions.get(block, 0) < tile_id]
+        for block in current:
+            block_versions[block] = tile_id
+
+        if len(current) == len(blocks):
+            self.compositor.composite(img, x, y, reduction=reduction)
+        else:
+            for bx, by in current:
+                self.compositor.composite(img, x, y, QRect(bx * block_size - x, by * block_size - y, block_size,
+                                                           block_size), reduction)
+
+    def set_reduction(self, reduction: int) -> None:
+        """ Decode tiles at 1/`reduction` of their size (the view shows the desktop at that scale or smaller). When
+            more detail is needed than what the back buffer holds, the server is asked for a full frame. """
+        sharper = reduction < self.reduction
+        self.reduction = reduction
+        if self.decoder is not None:
+            self.decoder.reduction = reduction
+        self.compositor.set_reduction(reduction)
+
+        if sharper:
+            self.request_keyframe()
+
+    def request_keyframe(self) -> None:
+        if not self.client or not self._connected:
+            return
+
+        try:
+            self.client.write_json({"Keyframe": True})
+        except OSError as e:
+            logger.debug(f"Keyframe request dropped: {e}")
+
+    def request_trace(self, enabled: bool) -> None:
+        """ Ask the server to start or stop tracing the desktop stream (stopping writes its trace) """
+        if not self.client or not self._connected:
+            return
+
+        try:
+            self.client.write_json({"Trace": enabled})
+        except OSError as e:
+            logger.debug(f"Trace request dropped: {e}")
+
 class EventsThread(ClientBaseThread):
     update_mouse_cursor = pyqtSignal(Qt.CursorShape)
+    remote_cursor_moved = pyqtSignal(int, int)
     update_clipboard = pyqtSignal(str)
+    desktop_active_changed = pyqtSignal(bool)
 
     def __init__(self, session: Session) -> None:
         super().__init__(session, WorkerKind.Events)
 
     def client_execute(self) -> None:
+        """ Read server-pushed events (one JSON document per line). The read is blocking, so the thread sleeps in the
+            kernel while the server has nothing to say, `stop()` shuts the socket down to wake it up. """
         if not self.client: return
-        while self._running:
-            try:
-                # We don't expect much from server in simple mode, maybe clipboard
-                # Server sends JSON lines
-                pass # Implement reading if needed
-            except Exception:
+
+        link = self.session.link
+        stopped = threading.Event()
+        threading.Thread(target=self.send_keepalives, args=(link, stopped), name="KeepAlive", daemon=True).start()
+
+        try:
+            while self._running:
+                try:
+                    line = self.client.read_line()
+                except EOFError:
+                    break
+
+                received = time.time()
+                link.touch()
+
+                if not line:
+                    continue
+
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Malformed event received from server: {line!r}")
+                    continue
+
+                self.dispatch_event(event, link, received)
+        finally:
+            stopped.set()
+
+    def send_keepalives(self, link: LinkMonitor, stopped: threading.Event) -> None:
+        """ Ping the server periodically. A link that stays silent longer than the timeout is closed, which makes
+            workers resume the session instead of waiting for TCP to notice (minutes on a half-open link). """
+        while not stopped.wait(KEEPALIVE_INTERVAL):
+            multiplexer = self.session.multiplexer
+            if link.is_dead():
+                logger.warning(f"No data received from the server for {link.timeout}s, dropping connection")
+
+                if multiplexer is not None:
+                    multiplexer.close()
+
                 break
 
+            self.send_event({"Id": OutputEvent.KeepAlive.value, **link.ping()})
+
+    @staticmethod
+    def parse_event_id(event: dict) -> Optional[InputEvent]:
+        """ Server may identify events either by value or by name """
+        event_id = event.get("Id")
+        try:
+            if isinstance(event_id, str):
+                return InputEvent[event_id]
+
+            return InputEvent(event_id)
+        except (KeyError, ValueError):
+            return None
+
+    def dispatch_event(self, event: dict, link: LinkMonitor, received: float) -> None:
+        event_id = self.parse_event_id(event)
+        if event_id is None:
+            logger.warning(f"Unknown event received from server: {event.get('Id')}")
+            return
+
+        if event_id == InputEvent.KeepAlive:
+            if is_pong(event):
+                link.on_pong(event)
+            else:
+                self.send_event({"Id": OutputEvent.KeepAlive.value, **LinkMonitor.pong(event, received)})
+
+        elif event_id == InputEvent.MouseCursorUpdated:
+            # Shape and/or position (remote screen coordinates, servers that push it)
+            if "Cursor" in event:
+                try:
+                    cursor_kind = MouseCursorKind[event["Cursor"]]
+                except (KeyError, TypeError):
+                    cursor_kind = MouseCursorKind.IDC_ARROW
+
+                self.update_mouse_cursor.emit(MOUSE_CURSOR_SHAPES.get(cursor_kind, Qt.CursorShape.ArrowCursor))
+
+            x, y = event.get("X"), event.get("Y")
+            if isinstance(x, int) and isinstance(y, int):
+                self.remote_cursor_moved.emit(x, y)
+
+        elif event_id == InputEvent.ClipboardUpdated:
+            # Text only event of servers without the Clipboard channel
+            text = event.get("Text")
+            if isinstance(text, str) and allows_receive(self.session.effective_clipboard_mode):
+                self.update_clipboard.emit(text)
+
+        elif event_id == InputEvent.DesktopActive:
+            self.desktop_active_changed.emit(True)
+
+        elif event_id == InputEvent.DesktopInactive:
+            self.desktop_active_changed.emit(False)
+
+    def send_event(self, event: dict) -> None:
+        """ Input produced while the session connection is being resumed is dropped, replaying stale mouse moves and
+            keystrokes later would be worse than losing them. """
+        if not self.client or not self._connected:
+            return
+
+        try:
+            self.client.write_json(event)
+        except OSError as e:
+            logger.debug(f"Event dropped: {e}")
+
     @pyqtSlot(int, int, MouseState, MouseButton)
     def send_mouse_event(self, x: int, y: int, state: MouseState, button: MouseButton) -> None:
-        if self.client:
-            self.client.write_json({
-                "Id": OutputEvent.MouseClickMove.value,
-                "X": x, "Y": y,
-                "Button": button.name,
-                "Type": state.value
-            })
+        self.send_event({
+            "Id": OutputEvent.MouseClickMove.value,
+            "X": x, "Y": y,
+            "Button": button.name,
+            "Type": state.value
+        })
 
     @pyqtSlot(str)
     def send_key_event(self, keys: str, is_shortcut: bool) -> None:
-        if self.client:
-            self.client.write_json({
-                "Id": OutputEvent.Keyboard.value,
-                "IsShortcut": is_shortcut,
-                "Keys": keys
-            })
+        self.send_event({
+            "Id": OutputEvent.Keyboard.value,
+            "IsShortcut": is_shortcut,
+            "Keys": keys
+        })
 
     @pyqtSlot(int)
     def send_mouse_wheel_event(self, delta: int) -> None:
-        if self.client:
-            self.client.write_json({
-                "Id": OutputEvent.MouseWheel.value,
-                "Delta": delta
-            })
+        self.send_event({
+            "Id": OutputEvent.MouseWheel.value,
+            "Delta": delta
+        })
 
     @pyqtSlot(str)
     def send_clipboard_text(self, text: str) -> None:
-        if self.client:
-            self.client.write_json({
-                "Id": OutputEvent.ClipboardUpdated.value,
-                "Text": text
-            })
+        self.send_event({
+            "Id": OutputEvent.ClipboardUpdated.value,
+            "Text": text
+        })
+
+class ClipboardThread(ClientBaseThread):
+    """ Clipboard worker: receives the server clipboard contents and sends the local ones, both on the low priority
+        Clipboard channel. Local changes are coalesced, a content still being sent is cancelled by a newer one. """
+    update_clipboard_data = pyqtSignal(dict)
+
+    def __init__(self, session: Session) -> None:
+        super().__init__(session, WorkerKind.Clipboard)
+        self.mode = ClipboardMode.Disabled
+        self.sync = ClipboardSync()
+        self._pending: Optional[dict] = None
+        self._pending_cond = threading.Condition()
+
+    def client_execute(self) -> None:
+        if not self.client: return
+
+        self.client.write_json({"Mode": self.session.clipboard_mode.value})
+        self.mode = combine_modes(self.session.server_clipboard_mode, parse_mode(self.client.read_json().get("Mode")))
+        logger.info(f"Clipboard sharing: {self.mode.name}")
+
+        stopped = threading.Event()
+        if allows_send(self.mode):
+            threading.Thread(target=self.send_changes, args=(stopped,), name="ClipboardSender", daemon=True).start()
+
+        try:
+            while self._running:
+                try:
+                    transfer = read_transfer(self.client)
+                except EOFError:
+                    break
+
+                if transfer is None or not allows_receive(self.mode):
+                    continue
+
+                digest, formats = transfer
+                self.sync.applied(digest)
+                self.update_clipboard_data.emit(formats)
+        except (ClipboardError, ValueError) as e:
+            logger.warning(f"Clipboard transfer failed: {e}")
+        finally:
+            with self._pending_cond:
+                stopped.set()
+                self._pending_cond.notify_all()
+
+    def send_changes(self, stopped: threading.Event) -> None:
+        while True:
+            with self._pending_cond:
+                self._pending_cond.wait_for(lambda: stopped.is_set() or self._pending is not None)
+                if stopped.is_set():
+                    return
+
+                formats, self._pending = self._pending, None
+
+            # Encoded here rather than in the GUI thread, the clipboard may hold a screenshot
+            encoded = {mime: image_to_png(data) if isinstance(data, QImage) else data for mime, data in formats.items()}
+            if not encoded or sum(map(len, encoded.values())) > MAX_CLIPBOARD_SIZE:
+                continue
+
+            digest = content_digest(encoded)
+            if not self.sync.outgoing(digest):
+                continue
+
+            try:
+                send_transfer(self.client.conn, encoded, digest, superseded=lambda: self._pending is not None)
+            except OSError as e:
+                logger.debug(f"Clipboard content dropped: {e}")
+                return
+
+    def send_clipboard(self, formats: dict) -> None:
+        """ Queue a local clipboard content (mime type -> bytes or QImage), only the newest one is sent """
+        if not self._connected or not allows_send(self.mode):
+            return
+
+        with self._pending_cond:
+            self._pending = formats
+            self._pending_cond.notify_all()
+
+class TransferJob:
+    """ A queued file transfer between `local_path` and `remote_path` (a path on the server) """
+    def __init__(self, job_id: int, upload: bool, local_path: str, remote_path: str, size: int = 0) -> None:
+        self.id = job_id
+        self.upload = upload
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.size = size
+        self.transferred = 0
+        self.cancelled = False
+
+class FileTransferThread(QThread):
+    """ File transfer worker: runs the directory listings and transfers one at a time on a connection of its own
+        attached to the session. A failed transfer reconnects and resumes from its last verified chunk. """
+    thread_finished = pyqtSignal(bool)
+    directory_listed = pyqtSignal(dict)
+    transfer_progress = pyqtSignal(int, int, int)  # Job id, bytes transferred, size
+    transfer_finished = pyqtSignal(int, str)  # Job id, error message (empty on success)
+
+    def __init__(self, session: Session) -> None:
+        super().__init__()
+        self.session = session
+        self.client: Optional[Client] = None
+        self._running = True
+        self._stopped = threading.Event()
+        self._requests: deque = deque()  # TransferJob, or the path of a directory to list
+        self._cond = threading.Condition()
+        self._current: Optional[TransferJob] = None
+        self._next_id = 1
+        self._last_progress = 0.0
+
+    def run(self) -> None:
+        on_error = False
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: not self._running or bool(self._requests))
+                    if not self._running:
+                        break
+
+                    request = self._requests.popleft()
+                    self._current = request if isinstance(request, TransferJob) else None
+
+                error = self.execute(request)
+
+                with self._cond:
+                    self._current = None
+
+                if isinstance(request, TransferJob):
+                    if request.cancelled and not request.upload:
+                        discard_partial(request.local_path)
+
+                    self.transfer_finished.emit(request.id, "Cancelled" if request.cancelled else error)
+                elif error:
+                    self.directory_listed.emit({"Path": request, "Error": error})
+        except Exception as e:
+            if self._running:
+                logger.error(f"File transfer thread error: {e}")
+                traceback.print_exc()
+                on_error = True
+        finally:
+            self.stop()
+            self.thread_finished.emit(on_error)
+
+    def execute(self, request: Union[TransferJob, str]) -> str:
+        """ Run a request, reconnecting after failures, return an error message or an empty string """
+        attempts = 0
+        delay = RESUME_INITIAL_DELAY
+        while True:
+            try:
+                client = self.connect()
+                if isinstance(request, str):
+                    client.write_json({"Command": "List", "Path": request})
+                    self.directory_listed.emit(self.read_reply(client))
+                elif request.upload:
+                    self.upload(client, request)
+                else:
+                    self.download(client, request)
+
+                return ""
+            except RemoteFileError as e:
+                return str(e)
+            except ArcaneProtocolException as e:
+                self.disconnect()
+
+                return str(e)
+            except (OSError, EOFError, TransferError, ValueError, KeyError) as e:
+                self.disconnect()
+
+                if not self._running or (isinstance(request, TransferJob) and request.cancelled):
+                    return "Cancelled"
+
+                attempts += 1
+                if attempts > TRANSFER_RETRIES:
+                    return str(e)
+
+                logger.warning(f"File transfer interrupted ({e}), resuming")
+                self._stopped.wait(random.uniform(delay / 2, delay))
+                delay = min(delay * 2, RESUME_MAX_DELAY)
+
+    def connect(self) -> Client:
+        if self.client is None:
+            client = self.session.attach_client(WorkerKind.FileTransfer)
+            with self._cond:
+                if not self._running:
+                    client.close()
+                    raise ConnectionError("File transfer worker stopped")
+
+                self.client = client
+
+        return self.client
+
+    def disconnect(self) -> None:
+        with self._cond:
+            client, self.client = self.client, None
+
+        if client is not None:
+            client.close()
+
+    @staticmethod
+    def read_reply(client: Client) -> dict:
+        reply = client.read_json()
+        if "Error" in reply:
+            raise RemoteFileError(reply["Error"])
+
+        return reply
+
+    def download(self, client: Client, job: TransferJob) -> None:
+        state = read_state(job.local_path) or {}
+        client.write_json({
+            "Command": "Download",
+            "Path": job.remote_path,
+            "Offset": partial_offset(job.local_path),
+            "Size": state.get("Size"),
+            "Modified": state.get("Modified"),
+        })
+        reply = self.read_reply(client)
+
+        job.size = int(reply["Size"])
+        offset = int(reply["Offset"])
+        modified = int(reply["Modified"])
+        with open_partial(job.local_path, job.size, modified, offset) as output:
+            self.report_progress(job, offset)
+            receive_chunks(client, output, offset, job.size, lambda position: self.report_progress(job, position))
+
+        complete_partial(job.local_path, modified)
+
+    def upload(self, client: Client, job: TransferJob) -> None:
+        info = os.stat(job.local_path)
+        job.size = info.st_size
+        client.write_json({
+            "Command": "Upload",
+            "Path": job.remote_path,
+            "Size": info.st_size,
+            "Modified": int(info.st_mtime),
+        })
+        offset = int(self.read_reply(client)["Offset"])
+
+        self.report_progress(job, offset)
+        send_file(client.conn, job.local_path, offset, lambda: yield_to_input(self.session.multiplexer),
+                  lambda position: self.report_progress(job, position))
+        self.read_reply(client)
+
+    def report_progress(self, job: TransferJob, position: int) -> None:
+        job.transferred = position
+
+        now = time.monotonic()
+        if now - self._last_progress >= TRANSFER_PROGRESS_INTERVAL or position >= job.size:
+            self._last_progress = now
+            self.transfer_progress.emit(job.id, position, job.size)
+
+    def queue(self, request: Union[TransferJob, str]) -> None:
+        with self._cond:
+            self._requests.append(request)
+            self._cond.notify_all()
+
+    def download_file(self, remote_path: str, local_path: str, size: int = 0) -> TransferJob:
+        job = TransferJob(self._next_id, False, local_path, remote_path, size)
+        self._next_id += 1
+        self.queue(job)
+
+        return job
+
+    def upload_file(self, local_path: str, remote_path: str) -> TransferJob:
+        job = TransferJob(self._next_id, True, local_path, remote_path, os.path.getsize(local_path))
+        self._next_id += 1
+        self.queue(job)
+
+        return job
+
+    def list_directory(self, path: str = "") -> None:
+        """ Request a listing, received with `directory_listed` (the server transfer root when `path` is empty) """
+        self.queue(path)
+
+    def cancel(self, job_id: int) -> None:
+        """ Cancel a queued or running transfer, a running one is interrupted at once """
+        with self._cond:
+            for request in self._requests:
+                if isinstance(request, TransferJob) and request.id == job_id:
+                    self._requests.remove(request)
+                    self.transfer_finished.emit(job_id, "Cancelled")
+
+                    return
+
+            if self._current is None or self._current.id != job_id:
+                return
+
+            self._current.cancelled = True
+            client = self.client
+
+        if client is not None:
+            client.close()
+
+    @pyqtSlot()
+    def stop(self) -> None:
+        with self._cond:
+            self._running = False
+            self._stopped.set()
+            self._cond.notify_all()
+            client = self.client
+
+        if client is not None:
+            client.close()
 
 class ConnectThread(QThread):
     thread_started = pyqtSignal()
     thread_finished = pyqtSignal(object)
     session_error = pyqtSignal(str)
 
-    def __init__(self, server_address: str, server_port: int, password: str) -> None:
+    def __init__(self, server_address: str, server_port: int, password: str,
+                 accepted_fingerprint: Optional[str] = None) -> None:
         super().__init__()
         self.server_address = server_address
         self.server_port = server_port
         self.password = password
+        self.accepted_fingerprint = accepted_fingerprint
+
+        # Set when the server presented a certificate the user must review before we can connect
+        self.untrusted_fingerprint: Optional[str] = None
 
     def run(self) -> None:
         session = None
         self.thread_started.emit()
         try:
-            session = Session(self.server_address, self.server_port, self.password)
+            session = Session(self.server_address, self.server_port, self.password, self.accepted_fingerprint)
+        except UntrustedServerCertificate as e:
+            self.untrusted_fingerprint = e.fingerprint
         except Exception as e:
             logger.error(f"Connection error: {e}")
             self.session_error.emit(str(e))
@@ -0,0 +1,261 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Clipboard sharing over the Clipboard channel, the lowest priority channel of the session connection: a large image
+    never delays input or desktop frames.
+
+        Hello: {"Mode": <viewer ClipboardMode>}, answered by the server with {"Mode": <effective mode>}
+        Transfer: {"Digest": <content digest>, "Formats": [[<mime type>, <size>], ...]} then CHUNK_HEADER
+                  (length, flags) + data chunks of at most CHUNK_SIZE content bytes, each compressed independently
+                  when worth it, up to a FLAG_END chunk (or a FLAG_CANCELLED one when a newer content superseded it).
+
+    Modes are expressed from the viewer point of view (Send: viewer to server) and enforced by both ends. Each end
+    remembers the digest of what the other holds (`ClipboardSync`), so duplicates and echoes are never sent back.
+"""
+
+import hashlib
+import json
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QMimeData
+from PyQt6.QtGui import QImage
+
+from .protocol import ClipboardMode
+
+FORMAT_TEXT = "text/plain"
+FORMAT_HTML = "text/html"
+FORMAT_RTF = "text/rtf"
+FORMAT_PNG = "image/png"
+
+# Qt exposes RTF under a platform specific mime type on Windows
+RTF_MIME_TYPES = (FORMAT_RTF, 'application/x-qt-windows-mime;value="Rich Text Format"')
+
+CHUNK_HEADER = struct.Struct("!IB")
+CHUNK_SIZE = 65536
+FLAG_COMPRESSED = 0x1
+FLAG_END = 0x2
+FLAG_CANCELLED = 0x4
+
+COMPRESSION_LEVEL = 6
+UNCOMPRESSED_FORMATS = (FORMAT_PNG,)  # Already compressed
+MAX_CLIPBOARD_SIZE = 67108864  # Larger contents are not shared
+ECHO_WINDOW = 1.0  # Seconds during which a local change right after applying remote content is taken for its echo
+
+
+class ClipboardError(Exception):
+    pass
+
+
+def allows_send(mode: ClipboardMode) -> bool:
+    """ Viewer clipboard may be sent to the server """
+    return mode in (ClipboardMode.Send, ClipboardMode.Both)
+
+
+def allows_receive(mode: ClipboardMode) -> bool:
+    """ Server clipboard may be sent to the viewer """
+    return mode in (ClipboardMode.Receive, ClipboardMode.Both)
+
+
+def combine_modes(first: ClipboardMode, second: ClipboardMode) -> ClipboardMode:
+    send = allows_send(first) and allows_send(second)
+    receive = allows_receive(first) and allows_receive(second)
+    if send and receive:
+        return ClipboardMode.Both
+    if send:
+        return ClipboardMode.Send
+    if receive:
+        return ClipboardMode.Receive
+
+    return ClipboardMode.Disabled
+
+
+def parse_mode(value: Any, default: ClipboardMode = ClipboardMode.Disabled) -> ClipboardMode:
+    try:
+        return ClipboardMode(value)
+    except ValueError:
+        return default
+
+
+def content_digest(formats: Dict[str, bytes]) -> str:
+    digest = hashlib.sha256()
+    for mime in sorted(formats):
+        data = formats[mime]
+        digest.update(mime.encode() + b"\0" + len(data).to_bytes(8, "big"))
+        digest.update(data)
+
+    return digest.hexdigest()[:32]
+
+
+def image_to_png(image: QImage) -> bytes:
+    """ Encode an image as PNG, safe outside of the GUI thread (QImage, unlike QPixmap, is not bound to it) """
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "PNG")
+    buffer.close()
+
+    return bytes(data.data())
+
+
+def mime_to_formats(mime: QMimeData) -> Dict[str, Any]:
+    """ Shared formats of a local clipboard content. Images are returned as QImage, the clipboard worker encodes them
+        so that the GUI thread never waits for a PNG encoder. """
+    formats: Dict[str, Any] = {}
+    if mime.hasText():
+        formats[FORMAT_TEXT] = mime.text().encode()
+    if mime.hasHtml():
+        formats[FORMAT_HTML] = mime.html().encode()
+    for rtf_mime in RTF_MIME_TYPES:
+        if mime.hasFormat(rtf_mime):
+            formats[FORMAT_RTF] = bytes(mime.data(rtf_mime).data()).split(b"\0", 1)[0]
+            break
+    if mime.hasImage():
+        image = mime.imageData()
+        if isinstance(image, QImage) and not image.isNull():
+            formats[FORMAT_PNG] = image
+
+    return formats
+
+
+def formats_to_mime(formats: Dict[str, bytes]) -> QMimeData:
+    mime = QMimeData()
+    if FORMAT_TEXT in formats:
+        mime.setText(formats[FORMAT_TEXT].decode("utf-8", "replace"))
+    if FORMAT_HTML in formats:
+        mime.setHtml(formats[FORMAT_HTML].decode("utf-8", "replace"))
+    if FORMAT_RTF in formats:
+        for rtf_mime in RTF_MIME_TYPES:
+            mime.setData(rtf_mime, QByteArray(formats[FORMAT_RTF]))
+    if FORMAT_PNG in formats:
+        image = QImage.fromData(formats[FORMAT_PNG], "PNG")
+        if not image.isNull():
+            mime.setImageData(image)
+
+    return mime
+
+
+def send_transfer(stream: Any, formats: Dict[str, bytes], digest: str,
+                  superseded: Optional[Callable[[], bool]] = None) -> bool:
+    """ Send a clipboard content on the Clipboard channel, return False when `superseded()` turned true meanwhile """
+    header = {"Digest": digest, "Formats": [[mime, len(data)] for mime, data in formats.items()]}
+    stream.sendall(json.dumps(header).encode() + b"\n")
+
+    for mime, data in formats.items():
+        view = memoryview(data)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            if superseded is not None and superseded():
+                stream.sendall(CHUNK_HEADER.pack(0, FLAG_CANCELLED))
+                return False
+
+            chunk = bytes(view[offset:offset + CHUNK_SIZE])
+            flags = 0
+            if mime not in UNCOMPRESSED_FORMATS:
+                compressed = zlib.compress(chunk, COMPRESSION_LEVEL)
+                if len(compressed) < len(chunk):
+                    chunk, flags = compressed, FLAG_COMPRESSED
+
+            stream.sendall(CHUNK_HEADER.pack(len(chunk), flags) + chunk)
+
+    stream.sendall(CHUNK_HEADER.pack(0, FLAG_END))
+
+    return True
+
+
+def read_transfer(client: Any) -> Optional[Tuple[str, Dict[str, bytes]]]:
+    """ (digest, formats) of the next transfer read from a channel client (`read_line`, `recv_exact`), None when it
+        was cancelled or refused (too large) """
+    header = json.loads(client.read_line())
+    entries = [(str(mime), int(size)) for mime, size in header.get("Formats", [])]
+    total = sum(size for _, size in entries)
+    refused = total > MAX_CLIPBOARD_SIZE or any(size < 0 for _, size in entries)
+
+    data = bytearray()
+    while True:
+        length, flags = CHUNK_HEADER.unpack(client.recv_exact(CHUNK_HEADER.size))
+        if flags & FLAG_CANCELLED:
+            return None
+        if flags & FLAG_END:
+            break
+
+        chunk = client.recv_exact(length)
+        if refused:
+            continue  # Drained, the channel stays usable
+
+        if flags & FLAG_COMPRESSED:
+            decompressor = zlib.decompressobj()
+            chunk = decompressor.decompress(chunk, CHUNK_SIZE)
+            if decompressor.unconsumed_tail:
+                raise ClipboardError("Clipboard chunk larger than announced")
+
+        if len(data) + len(chunk) > total:
+            raise ClipboardError("Clipboard content larger than announced")
+
+        data += chunk
+
+    if refused:
+        return None
+
+    if len(data) != total:
+        raise ClipboardError("Clipboard content shorter than announced")
+
+    formats: Dict[str, bytes] = {}
+    offset = 0
+    for mime, size in entries:
+        formats[mime] = bytes(data[offset:offset + size])
+        offset += size
+
+    digest = content_digest(formats)
+    if digest != header.get("Digest"):
+        raise ClipboardError("Clipboard content digest mismatch")
+
+    return digest, formats
+
+
+class ClipboardSync:
+    """ What the server is known to hold. Qt may normalize a content it was given (re-encoded image, HTML rewritten)
+        and the platform reports the change asynchronously, so the first local change within ECHO_WINDOW after an
+        applied content is taken for its echo. """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._remote: Set[str] = set()
+        self._echo_deadline = 0.0
+        self.sent = 0
+        self.received = 0
+        self.suppressed = 0
+
+    def outgoing(self, digest: str) -> bool:
+        """ True when a local content should be sent, False for a duplicate or the echo of a received content """
+        with self._lock:
+            if digest in self._remote:
+                self._echo_deadline = 0.0
+                self.suppressed += 1
+                return False
+
+            if time.monotonic() < self._echo_deadline:
+                self._echo_deadline = 0.0
+                self._remote.add(digest)
+                self.suppressed += 1
+                return False
+
+            self._remote = {digest}
+            self.sent += 1
+
+            return True
+
+    def applied(self, digest: str, expect_echo: bool = True) -> None:
+        """ A server content was written to the local clipboard """
+        with self._lock:
+            self._remote = {digest}
+            self.received += 1
+            if expect_echo:
+                self._echo_deadline = time.monotonic() + ECHO_WINDOW
+
+    def report(self) -> dict:
+        return {"Sent": self.sent, "Received": self.received, "Suppressed": self.suppressed}
@@ -0,0 +1,195 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Back buffer of the remote desktop. The desktop thread composites decoded tiles into it as they arrive, the GUI
+    thread only learns, once per display refresh, the union of what changed since its last refresh and repaints that
+    area straight from the buffer: the GUI thread cost no longer depends on the number of tiles.
+
+    The union is kept as a few rectangles (DIRTY_RECTS_MAX, overlapping or touching ones are merged) rather than their
+    bounding rectangle, so that a caret blinking in a corner and a clock in the other one don't repaint the whole view.
+
+    The hand-off is latest-frame-wins and bounded: however long the GUI thread stalls (window drag, modal dialog), what
+    it has to catch up with is the back buffer and at most DIRTY_RECTS_MAX rectangles. A tile composited before the
+    next refresh is presented along with the others: `report()` counts every dirty rectangle merged that way as the
+    merge happens, collapses included.
+
+    When the view shows the desktop scaled down, tiles are decoded at 1/2, 1/4 or 1/8 of their size (JPEG DCT scaling)
+    and the back buffer is kept at that `reduction`: coordinates given to and taken from the compositor are always
+    remote desktop ones, only the buffer is smaller.
+"""
+
+import threading
+import time
+from typing import Callable, List, Optional
+
+from PyQt6.QtCore import QPoint, QRect, QRectF, QSize, Qt
+from PyQt6.QtGui import QImage, QPainter
+
+DIRTY_RECTS_MAX = 16  # Beyond, the dirty rectangles collapse to their bounding rectangle
+DESKTOP_REDUCTIONS = (1, 2, 4, 8)  # Scale denominators JPEG decoders support
+
+
+def reduced_size(size: QSize, reduction: int) -> QSize:
+    return QSize(-(-size.width() // reduction), -(-size.height() // reduction))
+
+
+def reduced_rect(rect: QRect, reduction: int) -> QRectF:
+    return QRectF(rect.x() / reduction, rect.y() / reduction, rect.width() / reduction, rect.height() / reduction)
+
+
+class DesktopCompositor:
+    """ Remote desktop back buffer, written by the desktop thread and read by the GUI thread (QImage, unlike QPixmap,
+        may be painted on outside of the GUI thread) """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._image = QImage()
+        self._desktop_size = QSize()
+        self.reduction = 1
+        self._dirty: List[QRect] = []
+        self.composited = 0  # Tiles composited
+        self.presented = 0  # Refreshes that had something to repaint
+        self.coalesced = 0  # Dirty rectangles merged into another one before being presented
+        self.superseded = 0  # Pending dirty rectangles entirely painted over before being presented
+        self.collapsed = 0  # Times the pending rectangles collapsed to their bounding rectangle
+        self.composite_time = 0.0  # Seconds spent painting tiles into the buffer
+
+    def size(self) -> QSize:
+        """ Remote desktop size """
+        with self._lock:
+            return QSize(self._desktop_size)
+
+    def resize(self, size: QSize) -> None:
+        """ (Re)allocate the buffer, black, the whole desktop is dirty """
+        with self._lock:
+            if self._desktop_size == size:
+                return
+
+            self._desktop_size = QSize(size)
+            self._image = QImage(reduced_size(size, self.reduction), QImage.Format.Format_RGB32)
+            self._image.fill(Qt.GlobalColor.black)
+            self._dirty = [QRect(QPoint(0, 0), size)]
+
+    def set_reduction(self, reduction: int) -> None:
+        """ Keep the buffer at 1/`reduction` of the desktop size. The current content is rescaled to stand in until
+            tiles decoded at the new reduction replace it. """
+        with self._lock:
+            if reduction == self.reduction:
+                return
+
+            self.reduction = reduction
+            if self._desktop_size.isEmpty():
+                return
+
+            image = QImage(reduced_size(self._desktop_size, reduction), QImage.Format.Format_RGB32)
+            painter = QPainter(image)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawImage(QRectF(image.rect()), self._image, QRectF(self._image.rect()))
+            painter.end()
+
+            self._image = image
+            self._dirty = [QRect(QPoint(0, 0), self._desktop_size)]
+
+    def composite(self, image: QImage, x: int, y: int, source: Optional[QRect] = None, reduction: int = 1) -> None:
+        """ Paint a decoded tile (or its `source` part) at (x, y) of the remote desktop. `reduction` is the one the
+            tile was decoded at, `source` is in remote desktop coordinates relative to the tile. """
+        if source is None:
+            source = QRect(0, 0, image.width() * reduction, image.height() * reduction)
+        target = QRect(x + source.x(), y + source.y(), source.width(), source.height())
+
+        with self._lock:
+            target = target.intersected(QRect(QPoint(0, 0), self._desktop_size))
+            if target.isEmpty():
+                return
+
+            started = time.perf_counter()
+            painter = QPainter(self._image)
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+            if reduction == self.reduction:
+                # Aligned tiles: a plain copy
+                painter.drawImage(reduced_rect(target, reduction), image,
+                                  reduced_rect(target.translated(-x, -y), reduction))
+            else:
+                # Decoded before the reduction changed
+                painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+                painter.drawImage(reduced_rect(target, self.reduction), image,
+                                  reduced_rect(target.translated(-x, -y), reduction))
+            painter.end()
+
+            self._add_dirty(target)
+            self.composite_time += time.perf_counter() - started
+            self.composited += 1
+
+    def _add_dirty(self, rect: QRect) -> None:
+        merged = True
+        while merged:
+            merged = False
+            for index, dirty in enumerate(self._dirty):
+                if dirty.intersects(rect.adjusted(-1, -1, 1, 1)):
+                    if rect.contains(dirty):
+                        self.superseded += 1
+
+                    rect = rect.united(self._dirty.pop(index))
+                    self.coalesced += 1
+                    merged = True
+                    break
+
+        self._dirty.append(rect)
+        if len(self._dirty) > DIRTY_RECTS_MAX:
+            bounding = QRect()
+            for dirty in self._dirty:
+                bounding = bounding.united(dirty)
+            self.coalesced += len(self._dirty) - 1
+            self._dirty = [bounding]
+            self.collapsed += 1
+
+    def take_dirty(self) -> List[QRect]:
+        """ Areas composited since the previous call, disjoint rectangles (none when nothing changed) """
+        with self._lock:
+            dirty, self._dirty = self._dirty, []
+
+            if dirty:
+                self.presented += 1
+
+        return dirty
+
+    def draw(self, painter: QPainter, rect: QRect) -> None:
+        """ Paint the `rect` area of the remote desktop at the same coordinates on `painter` """
+        with self._lock:
+            rect = rect.intersected(QRect(QPoint(0, 0), self._desktop_size))
+            if rect.isEmpty():
+                return
+
+            if self.reduction == 1:
+                painter.drawImage(rect, self._image, rect)
+            else:
+                painter.drawImage(QRectF(rect), self._image, reduced_rect(rect, self.reduction))
+
+    def read(self, rects: List[QRect], callback: Callable[[QImage, int, List[QRect]], None]) -> None:
+        """ Call `callback(buffer, reduction, buffer_rects)` with the back buffer locked, `buffer_rects` are the
+            `rects` areas of the remote desktop in buffer coordinates (texture uploads) """
+        with self._lock:
+            if self._image.isNull():
+                return
+
+            buffer_rects = [
+                reduced_rect(rect, self.reduction).toAlignedRect().intersected(self._image.rect()) for rect in rects
+            ]
+            callback(self._image, self.reduction, [rect for rect in buffer_rects if not rect.isEmpty()])
+
+    def report(self) -> dict:
+        """ Hand-off counters, and the memory it holds (the back buffer) """
+        with self._lock:
+            return {
+                "Composited": self.composited,
+                "Presented": self.presented,
+                "Coalesced": self.coalesced,
+                "Superseded": self.superseded,
+                "Collapsed": self.collapsed,
+                "CompositeTime": self.composite_time,
+                "PendingRects": len(self._dirty),
+                "Reduction": self.reduction,
+                "HeldBytes": self._image.sizeInBytes(),
+            }
@@ -36,5 +36,15 @@ SETTINGS_KEY_TRUSTED_CERTIFICATES = "trusted_certificates"
 SETTINGS_KEY_IMAGE_QUALITY = "image_quality"
 SETTINGS_KEY_PACKET_SIZE = "packet_size"
 SETTINGS_KEY_BLOCK_SIZE = "block_size"
+SETTINGS_KEY_USE_TLS = "use_tls"
+SETTINGS_KEY_TLS_CIPHER = "tls_cipher"
+SETTINGS_KEY_KEEPALIVE_TIMEOUT = "keepalive_timeout"
+SETTINGS_KEY_DATAGRAM_TRANSPORT = "datagram_transport"
+SETTINGS_KEY_TILE_ENCODING = "tile_encoding"
+SETTINGS_KEY_PIXEL_FORMAT = "pixel_format"
+SETTINGS_KEY_OPENGL_VIEWPORT = "opengl_viewport"
+SETTINGS_KEY_SOFTWARE_OPENGL = "software_opengl"
+SETTINGS_KEY_CURSOR_PREDICTION = "cursor_prediction"
+SETTINGS_KEY_CURSOR_SMOOTHING = "cursor_smoothing"
 
 SETTINGS_KEY_CLIPBOARD_MODE = "clipboard_mode"
@@ -0,0 +1,90 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Local cursor prediction. The viewer draws the remote cursor itself, at the position the user's hand is moving it
+    to, instead of waiting for the server to report where it went: on a high RTT link the cursor no longer lags behind
+    the hand.
+
+    The server pushes the cursor position (MouseCursorUpdated, remote screen coordinates) whenever it changes. Most of
+    these reports are late echoes of moves the viewer sent, they confirm the prediction and are ignored. A report that
+    matches none of the recent moves means the remote cursor went elsewhere (moved by an application, held at the
+    screen edge...): the drawn cursor glides there, `smoothing` being the time constant of that move, and stays there
+    until the hand moves again.
+"""
+
+import math
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+CURSOR_SMOOTHING = 0.1  # Seconds, time constant of a correction (0 jumps to the server position)
+CURSOR_TOLERANCE = 1  # Pixels between a reported position and a sent move still taken for its echo
+MAX_PENDING_MOVES = 256  # Moves sent and not echoed yet, the oldest are forgotten
+CONVERGED_DISTANCE = 0.5  # Pixels
+
+
+class CursorPredictor:
+    """ Position to draw the remote cursor at, in remote screen coordinates. Not thread safe, used by the GUI thread
+        only. """
+
+    def __init__(self, smoothing: float = CURSOR_SMOOTHING) -> None:
+        self.smoothing = smoothing
+
+        self.position: Optional[Tuple[float, float]] = None  # Drawn
+        self.target: Optional[Tuple[float, float]] = None  # Hand, or server position after a correction
+        self._updated = 0.0
+        self._pending: Deque[Tuple[int, int]] = deque(maxlen=MAX_PENDING_MOVES)
+
+        self.confirmed = 0  # Server reports that were echoes of sent moves
+        self.corrections = 0  # Server reports the drawn cursor had to move to
+
+    def moved(self, x: int, y: int, now: float) -> None:
+        """ Hand moved the cursor to (x, y), a move event with these coordinates is sent to the server """
+        self._pending.append((x, y))
+        self.position = self.target = (x, y)
+        self._updated = now
+
+    def reconcile(self, x: int, y: int, now: float) -> None:
+        """ Server reported its cursor at (x, y) """
+        for index, (sent_x, sent_y) in enumerate(self._pending):
+            if abs(sent_x - x) <= CURSOR_TOLERANCE and abs(sent_y - y) <= CURSOR_TOLERANCE:
+                # Echo of a move: older ones will never be reported, the prediction still holds
+                for _ in range(index + 1):
+                    self._pending.popleft()
+                self.confirmed += 1
+
+                return
+
+        self._pending.clear()
+        self.corrections += 1
+
+        self.step(now)
+        self.target = (x, y)
+        if self.position is None:
+            self.position = self.target
+
+    def step(self, now: float) -> bool:
+        """ Move the drawn cursor toward its target as of `now`, True while it has not reached it """
+        elapsed, self._updated = now - self._updated, now
+        if self.position is None or self.target is None:
+            return False
+
+        x, y = self.position
+        target_x, target_y = self.target
+        if self.smoothing <= 0 or math.hypot(target_x - x, target_y - y) <= CONVERGED_DISTANCE:
+            self.position = self.target
+
+            return False
+
+        factor = 1 - math.exp(-max(elapsed, 0.0) / self.smoothing)
+        self.position = (x + (target_x - x) * factor, y + (target_y - y) * factor)
+
+        return True
+
+    def report(self) -> dict:
+        return {
+            "Confirmed": self.confirmed,
+            "Corrections": self.corrections,
+            "PendingMoves": len(self._pending),
+        }
@@ -0,0 +1,341 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Optional UDP transport for desktop tiles. Over lossy links a lost TCP segment stalls every tile queued behind it
+    (head-of-line blocking), over UDP only the tile the datagram belonged to is late.
+
+    A tile is the usual desktop chunk (chunk header + JPEG) split in fragments of at most MAX_DATAGRAM_PAYLOAD bytes,
+    each prefixed with DATAGRAM_HEADER (kind, sequence, tile id, index, count). Every FEC_GROUP_SIZE fragments of a tile
+    are followed by a XOR parity datagram that recovers any single lost fragment of the group. What parity can't repair
+    is requested again by the viewer (NACK, on the reliable desktop channel), unless the tile became stale meanwhile: a
+    tile whose every block was sent again since is never re-sent, the sender answers with a SKIP datagram instead.
+
+    Control, events and the negotiation itself stay on the reliable (TCP) connection.
+"""
+
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+DATAGRAM_HEADER = struct.Struct("!BIIHH")
+
+KIND_TILE = 0x1
+KIND_PARITY = 0x2
+KIND_SKIP = 0x3
+KIND_HELLO = 0x4
+
+# Fits in a single IPv4/IPv6 packet on every usual path (VPN overhead included), avoids IP fragmentation
+MAX_DATAGRAM_PAYLOAD = 1200
+
+FEC_GROUP_SIZE = 8
+PARITY_LENGTH = struct.Struct("!H")
+
+DEFAULT_PACING_RATE = 12500000  # Bytes per second (100 Mbit/s)
+PACING_BURST = 0.005  # Seconds of traffic that may leave back-to-back
+
+RETRANSMIT_HISTORY = 512  # Tiles kept for NACKs
+
+# Receiver side
+NACK_DELAY = 0.03  # Seconds a tile may stay incomplete before its missing fragments are requested
+MAX_NACKS = 3  # Then the tile is abandoned (and a keyframe requested)
+DATAGRAM_BUFFER_SIZE = 65536
+
+
+Box = Tuple[int, int, int, int]
+Block = Tuple[int, int]
+
+
+def blocks_of(box: Box, block_size: int) -> List[Block]:
+    """ Grid blocks covered by a region (left, top, right, bottom), regions are aligned on the block grid """
+    left, top, right, bottom = box
+    return [
+        (bx, by)
+        for by in range(top // block_size, -(-bottom // block_size))
+        for bx in range(left // block_size, -(-right // block_size))
+    ]
+
+
+def xor_parity(fragments: Sequence[bytes]) -> bytes:
+    """ XOR of the fragments (zero padded to the longest one) prefixed with the XOR of their lengths """
+    size = max(len(fragment) for fragment in fragments)
+    parity = 0
+    length = 0
+    for fragment in fragments:
+        parity ^= int.from_bytes(fragment.ljust(size, b"\0"), "big")
+        length ^= len(fragment)
+    return PARITY_LENGTH.pack(length) + parity.to_bytes(size, "big")
+
+
+def recover_fragment(parity: bytes, fragments: Sequence[bytes]) -> bytes:
+    """ Rebuild the single fragment missing from `fragments` (the group members received) with the group parity """
+    length, = PARITY_LENGTH.unpack_from(parity)
+    data = parity[PARITY_LENGTH.size:]
+    size = len(data)
+    value = int.from_bytes(data, "big")
+    for fragment in fragments:
+        value ^= int.from_bytes(fragment.ljust(size, b"\0"), "big")
+        length ^= len(fragment)
+    return value.to_bytes(size, "big")[:length]
+
+
+class Pacer:
+    """ Spread datagrams at `rate` bytes per second so that a whole frame is not dropped by the first queue on the
+        path """
+
+    def __init__(self, rate: float = DEFAULT_PACING_RATE) -> None:
+        self.rate = rate
+        self.next_send = time.monotonic()
+
+    def wait(self, size: int) -> None:
+        now = time.monotonic()
+        if self.next_send - now > PACING_BURST:
+            time.sleep(self.next_send - now)
+        self.next_send = max(self.next_send, now - PACING_BURST) + size / self.rate
+
+
+class TileSender:
+    def __init__(self, sock: socket.socket, address: Tuple[str, int], block_size: int,
+                 pacing_rate: float = DEFAULT_PACING_RATE, fec_group_size: int = FEC_GROUP_SIZE) -> None:
+        self.sock = sock
+        self.address = address
+        self.block_size = block_size
+        self.fec_group_size = fec_group_size
+        self.pacer = Pacer(pacing_rate)
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # Tiles and NACK answers share the same paced stream
+
+        self.sequence = 0
+        self.tile_id = 0
+        self.history: "OrderedDict[int, Tuple[List[Block], List[bytes]]]" = OrderedDict()
+        self.block_versions: Dict[Block, int] = {}  # Id of the last tile that covered each block
+
+        self.datagrams_sent = 0
+        self.bytes_sent = 0
+        self.fragments_resent = 0
+        self.tiles_skipped = 0
+
+    def send_tile(self, chunk: bytes, box: Box) -> int:
+        """ Send a desktop chunk (header + image) covering `box`, return the number of bytes put on the wire """
+        fragments = [chunk[i:i + MAX_DATAGRAM_PAYLOAD] for i in range(0, len(chunk), MAX_DATAGRAM_PAYLOAD)] or [b""]
+        count = len(fragments)
+        blocks = blocks_of(box, self.block_size)
+
+        with self.lock:
+            self.tile_id += 1
+            tile_id = self.tile_id
+
+            for block in blocks:
+                self.block_versions[block] = tile_id
+
+            self.history[tile_id] = (blocks, fragments)
+            while len(self.history) > RETRANSMIT_HISTORY:
+                self.history.popitem(last=False)
+
+        sent = 0
+        for index, fragment in enumerate(fragments):
+            sent += self._send(KIND_TILE, tile_id, index, count, fragment)
+
+        if self.fec_group_size > 1 and count > 1:
+            for group, start in enumerate(range(0, count, self.fec_group_size)):
+                members = fragments[start:start + self.fec_group_size]
+                if len(members) > 1:
+                    sent += self._send(KIND_PARITY, tile_id, group, count, xor_parity(members))
+
+        return sent
+
+    def is_stale(self, tile_id: int, blocks: Iterable[Block]) -> bool:
+        return all(self.block_versions.get(block, 0) > tile_id for block in blocks)
+
+    def resend(self, tile_id: int, indexes: Sequence[int]) -> int:
+        """ Answer a NACK: send the missing fragments again (all of them when `indexes` is empty), or a SKIP when the
+            tile is stale (or forgotten) """
+        with self.lock:
+            entry = self.history.get(tile_id)
+            stale = entry is None or self.is_stale(tile_id, entry[0])
+
+        if stale:
+            self.tiles_skipped += 1
+            return self._send(KIND_SKIP, tile_id, 0, 0, b"")
+
+        fragments = entry[1]
+        sent = 0
+        for index in indexes or range(len(fragments)):
+            if 0 <= index < len(fragments):
+                sent += self._send(KIND_TILE, tile_id, index, len(fragments), fragments[index])
+                self.fragments_resent += 1
+        return sent
+
+    def _send(self, kind: int, tile_id: int, index: int, count: int, payload: bytes) -> int:
+        with self.send_lock:
+            self.sequence += 1
+            datagram = DATAGRAM_HEADER.pack(kind, self.sequence, tile_id, index, count) + payload
+
+            self.pacer.wait(len(datagram))
+            self.sock.sendto(datagram, self.address)
+            self.datagrams_sent += 1
+            self.bytes_sent += len(datagram)
+        return len(datagram)
+
+    def report(self) -> dict:
+        return {
+            "DatagramsSent": self.datagrams_sent,
+            "BytesSent": self.bytes_sent,
+            "FragmentsResent": self.fragments_resent,
+            "TilesSkipped": self.tiles_skipped,
+        }
+
+
+class PendingTile:
+    def __init__(self, count: int, now: float) -> None:
+        self.count = count
+        self.fragments: Dict[int, bytes] = {}
+        self.parities: Dict[int, bytes] = {}
+        self.first_seen = now
+        self.last_nack = now
+        self.nacks = 0
+
+
+class TileAssembler:
+    """ Receiver side: reassemble tiles from datagrams, repair with parity, schedule NACKs and give up on late tiles """
+
+    def __init__(self, fec_group_size: int = FEC_GROUP_SIZE, nack_delay: float = NACK_DELAY,
+                 max_nacks: int = MAX_NACKS) -> None:
+        self.fec_group_size = fec_group_size
+        self.nack_delay = nack_delay
+        self.max_nacks = max_nacks
+        self.pending: Dict[int, PendingTile] = {}
+        self.done: Set[int] = set()
+        self.highest_done = 0
+        self.highest_tile = 0
+
+        self.first_sequence: Optional[int] = None
+        self.highest_sequence = 0
+        self.datagrams_received = 0
+        self.fragments_recovered = 0
+        self.tiles_completed = 0
+        self.tiles_skipped = 0
+        self.tiles_abandoned = 0
+
+    def feed(self, datagram: bytes, now: Optional[float] = None) -> List[Tuple[int, bytes]]:
+        """ Process one datagram, return the list of (tile id, chunk) it completed """
+        if now is None:
+            now = time.monotonic()
+
+        if len(datagram) < DATAGRAM_HEADER.size:
+            return []
+
+        kind, sequence, tile_id, index, count = DATAGRAM_HEADER.unpack_from(datagram)
+        payload = datagram[DATAGRAM_HEADER.size:]
+
+        self.datagrams_received += 1
+        if self.first_sequence is None:
+            self.first_sequence = sequence
+        self.highest_sequence = max(self.highest_sequence, sequence)
+
+        if kind == KIND_SKIP:
+            if self.pending.pop(tile_id, None) is not None:
+                self.tiles_skipped += 1
+            self._forget(tile_id)
+            return []
+
+        if kind not in (KIND_TILE, KIND_PARITY) or tile_id in self.done or count == 0:
+            return []
+
+        # Tiles that lost every datagram are only noticed through the gap they leave in tile ids, they are requested
+        # as a whole (count unknown yet)
+        for missing_id in range(max(self.highest_tile + 1, tile_id - RETRANSMIT_HISTORY), tile_id):
+            if missing_id not in self.done and missing_id not in self.pending:
+                self.pending[missing_id] = PendingTile(0, now)
+        self.highest_tile = max(self.highest_tile, tile_id)
+
+        tile = self.pending.get(tile_id)
+        if tile is None:
+            tile = self.pending[tile_id] = PendingTile(count, now)
+        elif tile.count == 0:
+            tile.count = count
+
+        if kind == KIND_TILE:
+            if index >= count:
+                return []
+            tile.fragments[index] = payload
+            group = index // max(1, self.fec_group_size)
+        else:
+            tile.parities[index] = payload
+            group = index
+
+        self._repair(tile, group)
+
+        if len(tile.fragments) < tile.count:
+            return []
+
+        del self.pending[tile_id]
+        self._forget(tile_id)
+        self.tiles_completed += 1
+        return [(tile_id, b"".join(tile.fragments[i] for i in range(tile.count)))]
+
+    def _repair(self, tile: PendingTile, group: int) -> None:
+        parity = tile.parities.get(group)
+        if parity is None or self.fec_group_size <= 1:
+            return
+
+        start = group * self.fec_group_size
+        members = range(start, min(start + self.fec_group_size, tile.count))
+        missing = [index for index in members if index not in tile.fragments]
+        if len(missing) != 1:
+            return
+
+        tile.fragments[missing[0]] = recover_fragment(parity, [tile.fragments[index] for index in members
+                                                               if index != missing[0]])
+        self.fragments_recovered += 1
+
+    def _forget(self, tile_id: int) -> None:
+        self.done.add(tile_id)
+        # Tile ids only grow, ids far behind can't show up anymore (except as duplicates) and are dropped
+        self.highest_done = max(self.highest_done, tile_id)
+        if len(self.done) > 4 * RETRANSMIT_HISTORY:
+            self.done = {done for done in self.done if done > self.highest_done - 2 * RETRANSMIT_HISTORY}
+
+    def poll(self, now: Optional[float] = None) -> Tuple[List[Tuple[int, List[int]]], List[int]]:
+        """ Return (nacks, abandoned): missing fragments per tile id to request, and tiles given up on """
+        if now is None:
+            now = time.monotonic()
+
+        nacks: List[Tuple[int, List[int]]] = []
+        abandoned: List[int] = []
+        for tile_id, tile in list(self.pending.items()):
+            if now - tile.last_nack < self.nack_delay:
+                continue
+
+            if tile.nacks >= self.max_nacks:
+                del self.pending[tile_id]
+                self._forget(tile_id)
+                self.tiles_abandoned += 1
+                abandoned.append(tile_id)
+                continue
+
+            tile.nacks += 1
+            tile.last_nack = now
+            nacks.append((tile_id, [index for index in range(tile.count) if index not in tile.fragments]))
+
+        return nacks, abandoned
+
+    def loss_rate(self) -> float:
+        if self.first_sequence is None:
+            return 0.0
+        expected = self.highest_sequence - self.first_sequence + 1
+        return max(0.0, 1 - self.datagrams_received / expected)
+
+    def report(self) -> dict:
+        return {
+            "DatagramsReceived": self.datagrams_received,
+            "LossRate": round(self.loss_rate(), 4),
+            "FragmentsRecovered": self.fragments_recovered,
+            "TilesCompleted": self.tiles_completed,
+            "TilesSkipped": self.tiles_skipped,
+            "TilesAbandoned": self.tiles_abandoned,
+        }
@@ -0,0 +1,278 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Concurrent tile decoding. The desktop thread only reads the size of a tile (image header) and hands it to a pool of
+    DECODE_WORKERS threads, QImageReader releases the GIL while decoding. Decoded tiles are composited as soon as no
+    tile received before them and overlapping them is still pending, so overlapping tiles always land in the order
+    they were received while disjoint ones never wait for each other.
+
+    JPEG tiles are decoded at 1/`reduction` of their size when it is above 1 (libjpeg DCT scaling, much cheaper than
+    a full decode followed by a downscale), the compositor keeps its back buffer at the same reduction.
+
+    Raw pixel tiles (ChunkFlag.Pixels) skip image decoding altogether: the QImage is built over the received buffer
+    (or the buffer zlib inflated it to, allocated once at its final size) and decoded on the desktop thread, it costs
+    less than a hand-off to the pool. They still wait for older overlapping tiles.
+
+    Image headers are parsed here rather than with QImageReader: a reader holds the Qt image plugins lock while it
+    reads from its (Python) QBuffer, which needs the GIL, so any other image plugins call made with the GIL held
+    (QImageReader.size() for instance) deadlocks against it. Pool threads only call QImageReader.read().
+
+    At most DECODE_BACKLOG tiles per worker are held (queued, decoding or waiting for their turn), beyond that the
+    desktop thread waits: the compressed stream backs up in the socket instead of in memory.
+"""
+
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QRect, QSize
+from PyQt6.QtGui import QImage, QImageReader
+
+from .profiling import SPANS
+from .protocol import ChunkFlag, PixelFormat
+from .tracing import TraceRecorder
+
+DECODE_WORKERS = max(1, min(os.cpu_count() or 1, 8))  # A single core decodes inline, with no thread hop
+DECODE_BACKLOG = 4  # Tiles held per worker before the desktop thread waits
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOI = b"\xff\xd8"
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+# Raw tiles: Width(2), Height(2), PixelFormat(1), Compressed(1) then the pixels, row after row
+PIXELS_HEADER = struct.Struct("!HHBB")
+PIXEL_FORMATS = {
+    PixelFormat.RGB888.value: (QImage.Format.Format_RGB888, 3),
+    PixelFormat.RGB565.value: (QImage.Format.Format_RGB16, 2),
+    PixelFormat.ARGB32.value: (QImage.Format.Format_RGB32, 4),  # Alpha is always 0xFF
+}
+
+# decoded image, x, y, context given to submit(), reduction the image was decoded at
+CompositeCallback = Callable[[QImage, int, int, Any, int], None]
+
+
+def read_image(data: bytes, scaled_size: Optional[QSize] = None) -> QImage:
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+
+    reader = QImageReader(buffer)
+    if scaled_size is not None:
+        reader.setScaledSize(scaled_size)
+
+    return reader.read()
+
+
+def read_pixels(data: bytes) -> Tuple[QImage, Any]:
+    """ Image over the pixels of a raw tile, and the buffer it uses (it must outlive the image). A truncated or corrupt
+        tile gives a null image, counted as a failed decode. """
+    try:
+        width, height, pixel_format, compressed = PIXELS_HEADER.unpack_from(data)
+        image_format, depth = PIXEL_FORMATS.get(pixel_format, (QImage.Format.Format_Invalid, 0))
+        size = width * height * depth
+
+        pixels: Any = memoryview(data)[PIXELS_HEADER.size:]
+        if compressed:
+            pixels = zlib.decompress(pixels, bufsize=size)
+    except (struct.error, zlib.error):
+        return QImage(), None
+
+    if not depth or len(pixels) < size:
+        return QImage(), None
+
+    return QImage(pixels, width, height, width * depth, image_format), pixels
+
+
+def image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """ (width, height) of a JPEG or PNG image read from its header, None for other formats """
+    if data.startswith(PNG_SIGNATURE) and len(data) >= 24:
+        return struct.unpack_from("!II", data, 16)
+
+    if not data.startswith(JPEG_SOI):
+        return None
+
+    position = len(JPEG_SOI)
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+
+        marker = data[position + 1]
+        if marker == 0xFF:  # Fill byte
+            position += 1
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from("!HH", data, position + 5)
+            return width, height
+        elif marker in JPEG_STANDALONE_MARKERS:
+            position += 2
+        else:
+            position += 2 + struct.unpack_from("!H", data, position + 2)[0]
+
+    return None
+
+
+class DecodeJob:
+    def __init__(self, data: bytes, x: int, y: int, context: Any, reduction: int, pixels: bool,
+                 trace: Optional[dict] = None) -> None:
+        self.data: Optional[bytes] = data
+        self.x = x
+        self.y = y
+        self.context = context
+        self.pixels = pixels
+        self.trace = trace  # Frame and tile numbers when the session is traced
+        self.image: Optional[QImage] = None
+        self.buffer: Any = None  # Memory of a raw tile image
+        self.done = False
+        self.held = False
+
+        # Unknown size: the tile orders against every other one
+        size: Optional[Tuple[int, int]] = None
+        if not pixels:
+            size = image_size(data)
+        elif len(data) >= PIXELS_HEADER.size:
+            width, height, _, _ = PIXELS_HEADER.unpack_from(data)
+            size = width, height
+        self.rect = QRect(x, y, size[0], size[1]) if size is not None else None
+
+        self.reduction = reduction if size is not None and not pixels and data.startswith(JPEG_SOI) else 1
+        self.scaled_size: Optional[QSize] = None
+        if self.reduction > 1 and size is not None:
+            self.scaled_size = QSize(-(-size[0] // self.reduction), -(-size[1] // self.reduction))
+
+    def overlaps(self, rect: Optional[QRect]) -> bool:
+        return self.rect is None or rect is None or self.rect.intersects(rect)
+
+
+class TileDecoder:
+    """ Decode tiles on a thread pool, `composite` is called for each of them (from a pool thread, one call at a time)
+        in an order that respects overlaps """
+
+    def __init__(self, composite: CompositeCallback, workers: int = DECODE_WORKERS) -> None:
+        self.composite = composite
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="TileDecoder") if workers > 1 else None
+        self._lock = threading.Lock()
+        self._jobs: Deque[DecodeJob] = deque()
+        self._slots = threading.Semaphore(workers * DECODE_BACKLOG)
+        self.reduction = 1  # Applied to the tiles submitted from now on
+        self.tracer: Optional[TraceRecorder] = None
+        self.composited_trace: Optional[dict] = None  # Latest traced tile composited
+
+        # Decode time per reduction, measured where tiles are decoded (the desktop thread only submits them)
+        self.timer = SPANS.timer("Decoder")
+
+        self.decoded = 0
+        self.failed = 0
+        self.reordered = 0  # Tiles decoded ahead of an overlapping older one, held back until it was composited
+        self.decode_time = 0.0
+
+    def submit(self, data: bytes, x: int, y: int, context: Any = None, flags: ChunkFlag = ChunkFlag(0),
+               trace: Optional[dict] = None) -> None:
+        """ Queue an encoded tile (chunk payload and header flags), wait while the backlog is full. The decode and
+            composite stages of a tile with `trace` (frame and tile numbers) are traced. """
+        job = DecodeJob(data, x, y, context, self.reduction, bool(flags & ChunkFlag.Pixels), trace)
+        if self._pool is None:
+            self.account(job, self.decode(job))
+            self.complete([job])
+            return
+
+        self._slots.acquire()
+        with self._lock:
+            self._jobs.append(job)
+
+        if job.pixels:
+            self.decode_and_complete(job)
+            return
+
+        try:
+            self._pool.submit(self.decode_and_complete, job)
+        except RuntimeError:
+            # Pool closed
+            self._slots.release()
+
+    def decode(self, job: DecodeJob) -> float:
+        started = time.perf_counter()
+        if job.data is None:
+            job.image = QImage()
+        elif job.pixels:
+            job.image, job.buffer = read_pixels(job.data)
+        else:
+            job.image = read_image(job.data, job.scaled_size)
+        job.data = None
+        job.done = True
+
+        finished = time.perf_counter()
+        if job.trace is not None and self.tracer is not None:
+            self.tracer.span("decode", started, finished, job.trace)
+
+        return finished - started
+
+    def account(self, job: DecodeJob, elapsed: float) -> None:
+        """ Decode time of `job`, called under the lock (or without a pool) """
+        self.decode_time += elapsed
+        self.timer.add("decode" if job.reduction == 1 else f"decode 1/{job.reduction}", elapsed)
+
+    def decode_and_complete(self, job: DecodeJob) -> None:
+        elapsed = self.decode(job)
+
+        with self._lock:
+            self.account(job, elapsed)
+            ready: List[DecodeJob] = []
+            remaining: Deque[DecodeJob] = deque()
+            pending: List[Optional[QRect]] = []
+            for queued in self._jobs:
+                if queued.done and not any(queued.overlaps(rect) for rect in pending):
+                    ready.append(queued)
+                else:
+                    if queued.done and not queued.held:
+                        queued.held = True
+                        self.reordered += 1
+                    pending.append(queued.rect)
+                    remaining.append(queued)
+            self._jobs = remaining
+
+            # Still under the lock, a tile released later can't be composited before these
+            self.complete(ready)
+
+        for _ in ready:
+            self._slots.release()
+
+    def complete(self, jobs: List[DecodeJob]) -> None:
+        for job in jobs:
+            if job.image is None or job.image.isNull():
+                self.failed += 1
+                continue
+
+            self.decoded += 1
+            if job.trace is None or self.tracer is None:
+                self.composite(job.image, job.x, job.y, job.context, job.reduction)
+            else:
+                started = time.perf_counter()
+                self.composite(job.image, job.x, job.y, job.context, job.reduction)
+                self.tracer.span("composite", started, time.perf_counter(), job.trace)
+                self.composited_trace = job.trace
+            job.image = job.buffer = None
+
+    def close(self) -> None:
+        """ Composite what is still queued and stop the workers """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "Workers": self.workers,
+                "Decoded": self.decoded,
+                "Failed": self.failed,
+                "Reordered": self.reordered,
+                "Pending": len(self._jobs),
+                "Reduction": self.reduction,
+                "DecodeTime": round(self.decode_time, 3),
+            }
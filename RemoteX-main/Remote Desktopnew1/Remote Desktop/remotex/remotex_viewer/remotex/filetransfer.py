@@ -0,0 +1,223 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    File transfers on a connection of their own, attached to the session (AttachToSession <id> FileTransfer), so that
+    file data never goes through the multiplexer and can be sent with sendfile.
+
+        List: {"Command": "List", "Path": p} -> {"Path", "Parent", "Separator", "Entries": [{"Name", "Size",
+              "Directory", "Modified"}, ...]}
+        Download: {"Command": "Download", "Path", "Offset", "Size", "Modified"} -> {"Size", "Modified", "Offset"} then
+                  chunks from the server (Offset is 0 when the remote file changed since the partial download)
+        Upload: {"Command": "Upload", "Path", "Size", "Modified"} -> {"Offset"} then chunks from the viewer, answered
+                by {"Done": true}
+        Errors: {"Error": message}
+
+    Chunk: CHUNK_HEADER (file offset, length, CRC-32) + data, a zero length chunk ends the file. The receiver keeps
+    verified chunks in <path>.part and the identity of the source in <path>.part.json, so an interrupted transfer
+    resumes from its last verified chunk.
+"""
+
+import json
+import mmap
+import os
+import socket
+import ssl
+import struct
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, BinaryIO, Callable, Optional
+
+from .protocol import Channel
+
+CHUNK_HEADER = struct.Struct("!QII")
+CHUNK_SIZE = 4194304
+
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+YIELD_INTERVAL = 0.002
+YIELD_MAX = 0.1  # Seconds a chunk may wait for input to be sent, transfers always progress
+
+
+class TransferError(Exception):
+    pass
+
+
+class RemoteFileError(TransferError):
+    """ Request refused by the server (missing file, access denied...), retrying it is pointless """
+
+
+def uses_sendfile(sock: Any) -> bool:
+    # Encrypted data must go through OpenSSL in user space
+    return hasattr(os, "sendfile") and isinstance(sock, socket.socket) and not isinstance(sock, ssl.SSLSocket)
+
+
+def yield_to_input(multiplexer: Any) -> None:
+    """ Wait (bounded) while input events are queued on the session connection """
+    deadline = time.monotonic() + YIELD_MAX
+    while multiplexer is not None and not multiplexer.closed and time.monotonic() < deadline:
+        queued = multiplexer.queued_bytes()
+        if not queued[Channel.Events] and not queued[Channel.Control]:
+            break
+
+        time.sleep(YIELD_INTERVAL)
+
+
+def recv_exact_into(client: Any, view: memoryview) -> None:
+    received = 0
+    while received < len(view):
+        count = client.recv_into(view[received:])
+        if not count:
+            raise EOFError("Transfer connection closed")
+        received += count
+
+
+def send_file(sock: Any, path: str, offset: int = 0, yield_to: Optional[Callable[[], None]] = None,
+              progress: Optional[Callable[[int], None]] = None) -> int:
+    """ Send `path` from `offset` (a chunk boundary) as checksummed chunks, then the end of file chunk. Data is read
+        from a memory map and sent with sendfile on plain TCP, the checksum of a chunk is computed while the previous
+        one is sent (zlib releases the GIL). """
+    with open(path, "rb") as f, ThreadPoolExecutor(1) as checksums:
+        size = os.fstat(f.fileno()).st_size
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        zero_copy = uses_sendfile(sock)
+
+        def checksum(position: int) -> int:
+            # A file truncated while mapped can't be read past its new end
+            if os.fstat(f.fileno()).st_size < size:
+                raise TransferError("File truncated during the transfer")
+
+            with memoryview(mapped)[position:position + CHUNK_SIZE] as view:
+                return zlib.crc32(view)
+
+        try:
+            position = offset
+            upcoming = checksums.submit(checksum, position) if position < size else None
+            while upcoming is not None:
+                if yield_to is not None:
+                    yield_to()
+
+                length = min(CHUNK_SIZE, size - position)
+                header = CHUNK_HEADER.pack(position, length, upcoming.result())
+                upcoming = checksums.submit(checksum, position + length) if position + length < size else None
+
+                sock.sendall(header)
+                if zero_copy:
+                    sock.sendfile(f, position, length)
+                else:
+                    with memoryview(mapped)[position:position + length] as view:
+                        sock.sendall(view)
+
+                position += length
+                if progress is not None:
+                    progress(position)
+
+            sock.sendall(CHUNK_HEADER.pack(position, 0, 0))
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+                wait([upcoming])
+            if mapped is not None:
+                mapped.close()
+
+    return size - offset
+
+
+def receive_chunks(client: Any, output: BinaryIO, offset: int, size: int,
+                   progress: Optional[Callable[[int], None]] = None) -> int:
+    """ Write verified chunks to `output` (positioned at `offset`) until the end of file chunk, return the end offset.
+        A chunk is verified and written while the next one is received, in the other of two buffers. """
+    buffers = [memoryview(bytearray(CHUNK_SIZE)) for _ in range(2)]
+    header = memoryview(bytearray(CHUNK_HEADER.size))
+
+    def store(view: memoryview, position: int, checksum: int) -> None:
+        if zlib.crc32(view) != checksum:
+            raise TransferError(f"Checksum mismatch at {position}")
+
+        output.write(view)
+        if progress is not None:
+            progress(position + len(view))
+
+    with ThreadPoolExecutor(1) as writer:
+        pending: Optional[Future] = None
+        position = offset
+        while True:
+            recv_exact_into(client, header)
+            chunk_offset, length, checksum = CHUNK_HEADER.unpack(header)
+            if length == 0:
+                if pending is not None:
+                    pending.result()
+                if position != size:
+                    raise TransferError(f"Transfer ended at {position} of {size} bytes")
+
+                return position
+
+            if chunk_offset != position or length > CHUNK_SIZE or position + length > size:
+                raise TransferError(f"Unexpected chunk at {chunk_offset} ({length} bytes)")
+
+            view = buffers[(position // CHUNK_SIZE) % 2][:length]
+            recv_exact_into(client, view)
+
+            if pending is not None:
+                pending.result()
+            pending = writer.submit(store, view, position, checksum)
+            position += length
+
+
+def read_state(path: str) -> Optional[dict]:
+    """ Identity (Size, Modified) of the source a partial transfer to `path` was made of """
+    try:
+        with open(path + STATE_SUFFIX) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    return state if isinstance(state, dict) else None
+
+
+def partial_offset(path: str) -> int:
+    """ Verified bytes kept by an interrupted transfer to `path`, rounded down to a chunk boundary """
+    if read_state(path) is None or not os.path.isfile(path + PART_SUFFIX):
+        return 0
+
+    return os.path.getsize(path + PART_SUFFIX) // CHUNK_SIZE * CHUNK_SIZE
+
+
+def open_partial(path: str, size: int, modified: int, offset: int) -> BinaryIO:
+    """ Part file of `path` positioned at `offset`, a new one when the transfer starts from scratch """
+    if offset and read_state(path) == {"Size": size, "Modified": modified}:
+        output = open(path + PART_SUFFIX, "r+b")
+        output.truncate(offset)
+        output.seek(offset)
+
+        return output
+
+    if offset:
+        raise TransferError("Partial file does not match the source")
+
+    output = open(path + PART_SUFFIX, "wb")
+    with open(path + STATE_SUFFIX, "w") as f:
+        json.dump({"Size": size, "Modified": modified}, f)
+
+    return output
+
+
+def complete_partial(path: str, modified: int) -> None:
+    os.replace(path + PART_SUFFIX, path)
+    discard_partial(path)
+    os.utime(path, (modified, modified))
+
+
+def discard_partial(path: str) -> None:
+    for suffix in (PART_SUFFIX, STATE_SUFFIX):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+
+def join_remote(directory: str, name: str, separator: str) -> str:
+    return directory.rstrip(separator) + separator + name if directory else name
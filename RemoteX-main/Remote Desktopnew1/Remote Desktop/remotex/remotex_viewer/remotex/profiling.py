@@ -0,0 +1,104 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Per-stage timing of the viewer hot path (receive, decode, composite), the counterpart of the server stage spans.
+
+    Off by default, a disabled timer costs one attribute check per stage. Set REMOTEX_SPANS=1 in the environment to
+    enable them: a summary of every live timer (calls and average duration per stage) is then logged every
+    SPANS_REPORT_INTERVAL seconds.
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Dict, Optional, Tuple
+
+SPANS_ENVIRONMENT_VARIABLE = "REMOTEX_SPANS"
+SPANS_REPORT_INTERVAL = 10.0  # Seconds between two logged summaries
+
+logger = logging.getLogger(__name__)
+
+
+class Spans:
+    """ Global toggle and registry of the stage timers. Timers are only weakly referenced, they go away with the
+        worker (or window) that owns them. """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._timers: "weakref.WeakSet[StageTimer]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._last_report = time.monotonic()
+
+    def timer(self, name: str) -> "StageTimer":
+        timer = StageTimer(self, name)
+        with self._lock:
+            self._timers.add(timer)
+        return timer
+
+    def report(self) -> Dict[str, Dict[str, Tuple[int, float]]]:
+        """ {timer: {stage: (count, total seconds)}} of the live timers """
+        with self._lock:
+            timers = list(self._timers)
+        return {timer.name: timer.report() for timer in timers}
+
+    def maybe_log(self, now: float) -> None:
+        if now - self._last_report < SPANS_REPORT_INTERVAL:
+            return
+
+        with self._lock:
+            if now - self._last_report < SPANS_REPORT_INTERVAL:
+                return
+            self._last_report = now
+
+        for name, stages in sorted(self.report().items()):
+            summary = ", ".join(
+                f"{stage} {count}x {total / count * 1000:.2f} ms" for stage, (count, total) in stages.items() if count
+            )
+            logger.info(f"Stage spans {name}: {summary}")
+
+
+class StageTimer:
+    """ `start()` at the top of an iteration, then `mark(stage)` at the end of each stage: the time elapsed since the
+        previous mark is accounted to `stage`. A timer is meant to be used by a single thread. """
+
+    def __init__(self, spans: Spans, name: str) -> None:
+        self.spans = spans
+        self.name = name
+        self.totals: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.last: Optional[float] = None
+
+    def start(self) -> None:
+        if not self.spans.enabled:
+            self.last = None
+            return
+
+        self.last = time.perf_counter()
+        self.spans.maybe_log(time.monotonic())
+
+    def mark(self, stage: str) -> None:
+        if self.last is None:
+            return
+
+        now = time.perf_counter()
+        self.totals[stage] = self.totals.get(stage, 0.0) + now - self.last
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+        self.last = now
+
+    def add(self, stage: str, seconds: float) -> None:
+        """ Account `seconds` measured elsewhere to `stage` (work done on a pool), calls must not overlap """
+        if not self.spans.enabled:
+            return
+
+        self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def report(self) -> Dict[str, Tuple[int, float]]:
+        return {stage: (self.counts.get(stage, 0), total) for stage, total in list(self.totals.items())}
+
+
+SPANS = Spans(enabled=os.environ.get(SPANS_ENVIRONMENT_VARIABLE, "") not in ("", "0"))
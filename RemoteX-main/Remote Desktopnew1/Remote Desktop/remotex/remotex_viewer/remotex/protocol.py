@@ -4,7 +4,7 @@
     More information about the LICENSE on the LICENSE file in the root directory of the project.
 """
 
-from enum import Enum, auto
+from enum import Enum, IntFlag, auto
 
 PROTOCOL_VERSION = '5.0.2'
 
@@ -12,6 +12,8 @@ PROTOCOL_VERSION = '5.0.2'
 class WorkerKind(Enum):
     Desktop = 0x1
     Events = 0x2
+    Clipboard = 0x3
+    FileTransfer = 0x4
 
 
 class ClipboardMode(Enum):
@@ -29,13 +31,39 @@ class ArcaneProtocolCommand(Enum):
     BadRequest = 0x5
     ResourceFound = 0x6
     ResourceNotFound = 0x7
+    OpenSession = 0x8
+    ResumeSession = 0x9
+
+
+class Channel(Enum):
+    """ Logical channels carried by a multiplexed session connection """
+    Control = 0x0
+    Desktop = 0x1
+    Events = 0x2
+    Clipboard = 0x3
+
+
+# Lower value is sent first, input must never wait behind a desktop frame
+CHANNEL_PRIORITY = {
+    Channel.Events: 0,
+    Channel.Control: 1,
+    Channel.Desktop: 2,
+    Channel.Clipboard: 3,
+}
+
+
+class ChunkFlag(IntFlag):
+    """ Flags of the desktop chunk header (Size, X, Y, Flags) """
+    EndOfFrame = 0x1  # Last chunk of a captured frame
+    Keyframe = 0x2  # Chunk belongs to a full screen refresh
+    Pixels = 0x4  # Raw pixels (PIXELS_HEADER + pixels, maybe zlib compressed) instead of a JPEG image
 
 
 class OutputEvent(Enum):
     Keyboard = 0x1
     MouseClickMove = 0x2
     MouseWheel = 0x3
-    KeepAlive = 0x4  # Not used but actually defined by the protocol
+    KeepAlive = 0x4
     ClipboardUpdated = 0x5
 
 
@@ -93,4 +121,39 @@ class PacketSize(Enum):
         return f"{self.value} bytes"
 
 
+class TileEncoding(Enum):
+    """ Encoding of the desktop tiles. Raw and zlib compressed pixels cost far less CPU on both ends than JPEG but far
+        more bandwidth, they are meant for LAN sessions. """
+    Jpeg = 0x1
+    Raw = 0x2
+    Zlib = 0x3
+
+    @property
+    def display_name(self) -> str:
+        return {TileEncoding.Jpeg: "JPEG", TileEncoding.Raw: "Raw Pixels", TileEncoding.Zlib: "Zlib Pixels"}[self]
+
+
+class PixelFormat(Enum):
+    """ Pixel layout of Raw and Zlib tiles, multi-byte pixels are little endian words """
+    RGB888 = 0x1
+    RGB565 = 0x2
+    ARGB32 = 0x3
+
+    @property
+    def display_name(self) -> str:
+        return {PixelFormat.RGB888: "24 bits (RGB888)", PixelFormat.RGB565: "16 bits (RGB565)",
+                PixelFormat.ARGB32: "32 bits (ARGB32)"}[self]
+
+
+class BlockSize(Enum):
+    """ Size of the tiles the server compares to detect screen updates, smaller tiles send less unchanged pixels but
+        cost more images (headers and JPEG overhead) per update. """
+    Size32 = 32
+    Size64 = 64
+    Size96 = 96
+    Size128 = 128
+    Size256 = 256
 
+    @property
+    def display_name(self) -> str:
+        return f"{self.value}x{self.value}"
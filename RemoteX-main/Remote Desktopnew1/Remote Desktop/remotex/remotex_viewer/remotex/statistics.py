@@ -0,0 +1,59 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Live statistics of the desktop pipeline for the performance overlay. Stages only keep cumulative counters (bytes and
+    tiles received, decode and composite time...), rates are derived here from two consecutive samples, once per
+    STATISTICS_INTERVAL, so that measuring costs the hot path nothing.
+"""
+
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+STATISTICS_INTERVAL = 1.0  # Seconds between two samples
+STATISTICS_HISTORY = 60  # Samples kept for the sparklines
+
+# Derived statistics, in display order
+STATISTICS = ("Fps", "Frames", "Bitrate", "FrameBytes", "DecodeTime", "CompositeTime", "Rtt", "Coalesced", "Dropped")
+
+
+class PipelineStatistics:
+    """ Per second statistics computed from the cumulative counters of `VirtualDesktopThread.statistics()`, with their
+        recent history. A counter that went backwards (workers restarted by a session resume) counts from zero. """
+
+    def __init__(self, history: int = STATISTICS_HISTORY) -> None:
+        self.history: Dict[str, Deque[float]] = {name: deque(maxlen=history) for name in STATISTICS}
+        self.latest: Dict[str, float] = {name: 0.0 for name in STATISTICS}
+        self._previous: Optional[Tuple[float, dict]] = None
+
+    def sample(self, counters: dict, rtt: Optional[float], now: float) -> Dict[str, float]:
+        """ Add a sample of the `counters`, `rtt` in ms """
+        previous, self._previous = self._previous, (now, counters)
+        if previous is None or now <= previous[0]:
+            return self.latest
+
+        elapsed = now - previous[0]
+
+        def delta(name: str) -> float:
+            value, before = counters.get(name, 0), previous[1].get(name, 0)
+
+            return value - before if value >= before else value
+
+        frames = delta("ReceivedFrames")
+        received = delta("ReceivedBytes")
+        self.latest = {
+            "Fps": delta("Presented") / elapsed,  # Refreshes of the view
+            "Frames": frames / elapsed,  # Frames received from the server
+            "Bitrate": received * 8 / elapsed,
+            "FrameBytes": received / frames if frames else 0.0,
+            "DecodeTime": delta("DecodeTime") * 1000 / frames if frames else 0.0,  # ms per frame, all workers
+            "CompositeTime": delta("CompositeTime") * 1000 / frames if frames else 0.0,  # ms per frame
+            "Rtt": rtt or 0.0,
+            "Coalesced": delta("Coalesced") / elapsed,  # Dirty rectangles merged before being presented, per second
+            "Dropped": (delta("Failed") + delta("Abandoned")) / elapsed,  # Tiles lost, per second
+        }
+        for name, value in self.latest.items():
+            self.history[name].append(value)
+
+        return self.latest
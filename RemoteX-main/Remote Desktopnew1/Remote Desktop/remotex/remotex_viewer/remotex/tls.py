@@ -0,0 +1,117 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Server certificates are self-signed, trust is therefore not delegated to a CA but established by pinning the
+    certificate fingerprint (Trusted Certificates store). Client contexts are shared process-wide so that TLS sessions
+    (tickets) obtained from a server can be reused by any later connection to the same server, which skips the full
+    handshake on reconnect.
+"""
+
+import hashlib
+import os
+import ssl
+import threading
+from enum import Enum, auto
+from typing import Dict, Optional, Tuple
+
+
+class TlsCipherPreference(Enum):
+    Auto = auto()
+    AesGcm = auto()
+    ChaCha20 = auto()
+
+    @property
+    def display_name(self) -> str:
+        return {
+            TlsCipherPreference.Auto: "Auto (Hardware Detection)",
+            TlsCipherPreference.AesGcm: "AES-GCM",
+            TlsCipherPreference.ChaCha20: "ChaCha20-Poly1305",
+        }[self]
+
+
+# Only applies to TLS 1.2, TLS 1.3 suites are all AEAD and negotiated by OpenSSL (AES-GCM first, then ChaCha20)
+TLS_CIPHERS = {
+    TlsCipherPreference.AesGcm: "ECDHE+AESGCM:ECDHE+CHACHA20",
+    TlsCipherPreference.ChaCha20: "ECDHE+CHACHA20:ECDHE+AESGCM",
+}
+
+# Handshake failures of a server answering in plaintext (its banner) rather than with a TLS record
+PLAINTEXT_SERVER_ERRORS = ("WRONG_VERSION_NUMBER", "RECORD_LAYER_FAILURE", "UNKNOWN_PROTOCOL", "PACKET_LENGTH_TOO_LONG")
+
+_contexts: Dict[TlsCipherPreference, ssl.SSLContext] = {}
+_sessions: Dict[Tuple[str, int, int], ssl.SSLSession] = {}
+_lock = threading.Lock()
+
+
+def has_aes_acceleration() -> bool:
+    """ Detect AES instructions (AES-NI / ARMv8 Crypto Extensions). When it can't be detected (no /proc/cpuinfo), we
+        assume it is available since every x86-64 CPU of the last decade and Apple Silicon have it. """
+    if not os.path.isfile("/proc/cpuinfo"):
+        return True
+
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip().lower() in ("flags", "features"):
+                    return "aes" in value.split()
+    except OSError:
+        pass
+
+    return True
+
+
+def resolve_cipher_preference(preference: TlsCipherPreference) -> TlsCipherPreference:
+    if preference != TlsCipherPreference.Auto:
+        return preference
+
+    return TlsCipherPreference.AesGcm if has_aes_acceleration() else TlsCipherPreference.ChaCha20
+
+
+def client_context(preference: TlsCipherPreference = TlsCipherPreference.Auto) -> ssl.SSLContext:
+    preference = resolve_cipher_preference(preference)
+
+    with _lock:
+        context = _contexts.get(preference)
+        if context is None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+
+            # Certificate is verified by its fingerprint (see `Session.verify_server_certificate`)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+
+            context.minimum_version = ssl.TLSVersion.TLSv1_2
+            context.set_ciphers(TLS_CIPHERS[preference])
+
+            _contexts[preference] = context
+
+        return context
+
+
+def is_plaintext_server_error(error: ssl.SSLError) -> bool:
+    return error.reason in PLAINTEXT_SERVER_ERRORS
+
+
+def certificate_fingerprint(certificate: Optional[bytes]) -> str:
+    """ SHA-1 fingerprint of a DER encoded certificate, as displayed and stored by the Trusted Certificates store """
+    if not certificate:
+        return ""
+
+    return hashlib.sha1(certificate).hexdigest().upper()
+
+
+def get_session(server_address: str, server_port: int, context: ssl.SSLContext) -> Optional[ssl.SSLSession]:
+    """ A TLS session may only be resumed with the context that created it """
+    with _lock:
+        return _sessions.get((server_address, server_port, id(context)))
+
+
+def store_session(server_address: str, server_port: int, context: ssl.SSLContext,
+                  session: Optional[ssl.SSLSession]) -> None:
+    if session is None:
+        return
+
+    with _lock:
+        _sessions[(server_address, server_port, id(context))] = session
@@ -0,0 +1,117 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Timeline of the desktop pipeline in the Chrome trace event format (chrome://tracing, ui.perfetto.dev), the
+    counterpart of the server session trace.
+
+    While the session is traced (toggled at runtime from the desktop window, the server is asked to trace along), the
+    viewer records a complete event per stage and tile: receive, decode, composite, then present per display refresh.
+    Events carry the frame number and the tile sequence number of the desktop stream, counted from 1 by each desktop
+    worker like the server does (the datagram tile id on UDP), so that tools/trace_merge.py can line a frame up across
+    both traces. Timestamps are wall clock microseconds, the keepalive clock offset estimate is saved along.
+
+    Events are held in memory and written to TRACE_DIRECTORY (REMOTEX_TRACE_DIRECTORY in the environment) when
+    tracing stops or the session closes. A disabled recorder costs one attribute check per tile.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+TRACE_DIRECTORY = os.environ.get("REMOTEX_TRACE_DIRECTORY", "traces")
+MAX_TRACE_EVENTS = 500000  # Events held per trace, later ones are dropped
+TRACE_PROCESS_ID = 2  # Server traces use 1
+TRACE_PROCESS_NAME = "Remotex Viewer"
+
+logger = logging.getLogger(__name__)
+
+
+class TraceRecorder:
+    """ Trace events of one session, recorded from any thread while `enabled` """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.events: List[dict] = []
+        self.threads: Dict[int, str] = {}
+        self.dropped = 0
+        self.started: Optional[float] = None
+        self._epoch = 0.0
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        """ Start a new trace, False when one is already running """
+        with self._lock:
+            if self.enabled:
+                return False
+
+            self.events = []
+            self.threads = {}
+            self.dropped = 0
+            self.started = time.time()
+            self._epoch = self.started - time.perf_counter()  # Spans are measured with perf_counter
+            self.enabled = True
+
+            return True
+
+    def span(self, name: str, start: float, end: float, args: Optional[dict] = None) -> None:
+        """ Complete event of the calling thread, `start` and `end` are perf_counter times """
+        thread = threading.get_ident()
+        event = {
+            "name": name, "ph": "X", "pid": TRACE_PROCESS_ID, "tid": thread,
+            "ts": round((start + self._epoch) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+        }
+        if args:
+            event["args"] = args
+
+        with self._lock:
+            if not self.enabled:
+                return
+
+            if len(self.events) >= MAX_TRACE_EVENTS:
+                self.dropped += 1
+                return
+
+            if thread not in self.threads:
+                self.threads[thread] = threading.current_thread().name
+            self.events.append(event)
+
+    def stop(self, session_id: Optional[str], link: dict) -> Optional[str]:
+        """ Stop tracing and write the trace, `link` is the keepalive report of the session. Return the path of the
+            trace, None when the session was not traced. """
+        with self._lock:
+            if not self.enabled:
+                return None
+
+            self.enabled = False
+            events, self.events = self.events, []
+            threads = self.threads
+
+        metadata = [{"name": "process_name", "ph": "M", "pid": TRACE_PROCESS_ID, "args": {"name": TRACE_PROCESS_NAME}}]
+        metadata += [
+            {"name": "thread_name", "ph": "M", "pid": TRACE_PROCESS_ID, "tid": thread, "args": {"name": name}}
+            for thread, name in threads.items()
+        ]
+
+        os.makedirs(TRACE_DIRECTORY, exist_ok=True)
+        path = os.path.join(TRACE_DIRECTORY, f"{session_id}-{time.strftime('%Y%m%d-%H%M%S')}-viewer.json")
+        with open(path, "w") as file:
+            json.dump({
+                "traceEvents": metadata + events,
+                "displayTimeUnit": "ms",
+                "otherData": {
+                    "Side": "Viewer",
+                    "SessionId": session_id,
+                    "Started": self.started,
+                    "Link": link,  # ClockOffset: server clock minus viewer clock, in ms
+                    "DroppedEvents": self.dropped,
+                },
+            }, file)
+
+        logger.info(f"Trace written to {path}")
+
+        return path
@@ -3,8 +3,20 @@
 
 __license__ = "Apache License 2.0"
 
+from .cursor_item import CursorItem
+from .desktop_item import DesktopItem
+from .desktop_viewport import DesktopViewport, opengl_available, use_software_opengl
+from .performance_overlay import PerformanceOverlay
 from .tangeant_universe import TangentUniverse
+from .transfer_panel import TransferPanel
 
 __all__ = [
+    'CursorItem',
+    'DesktopItem',
+    'DesktopViewport',
+    'opengl_available',
+    'use_software_opengl',
+    'PerformanceOverlay',
     'TangentUniverse',
+    'TransferPanel',
 ]
@@ -0,0 +1,90 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+"""
+
+from typing import Dict, Optional
+
+from PyQt6.QtCore import QPointF, QRectF, Qt
+from PyQt6.QtGui import QPainter, QPainterPath, QPen, QPolygonF, QTransform
+from PyQt6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem, QWidget
+
+
+def polygon_path(*points: tuple) -> QPainterPath:
+    path = QPainterPath()
+    path.addPolygon(QPolygonF([QPointF(x, y) for x, y in points]))
+    path.closeSubpath()
+
+    return path
+
+
+def rect_path(x: float, y: float, width: float, height: float) -> QPainterPath:
+    path = QPainterPath()
+    path.addRect(QRectF(x, y, width, height))
+
+    return path
+
+
+def ring_path(outer: float, inner: float) -> QPainterPath:
+    path = QPainterPath()
+    path.addEllipse(QPointF(0, 0), outer, outer)
+    hole = QPainterPath()
+    hole.addEllipse(QPointF(0, 0), inner, inner)
+
+    return path.subtracted(hole)
+
+
+def rotated(path: QPainterPath, angle: float) -> QPainterPath:
+    return QTransform().rotate(angle).map(path)
+
+
+# Glyphs drawn for the cursor shapes pushed by the server, the hot spot is (0, 0): the arrow tip, the center of others
+ARROW = polygon_path((0, 0), (0, 16), (4, 12), (7, 18), (9, 17), (6, 11), (11, 11))
+DOUBLE_ARROW = polygon_path((-9, 0), (-5, -4), (-5, -1), (5, -1), (5, -4), (9, 0), (5, 4), (5, 1), (-5, 1), (-5, 4))
+CURSOR_GLYPHS: Dict[Qt.CursorShape, QPainterPath] = {
+    Qt.CursorShape.ArrowCursor: ARROW,
+    Qt.CursorShape.IBeamCursor: rect_path(-1, -8, 2, 16).united(rect_path(-3, -9, 6, 2)).united(rect_path(-3, 7, 6, 2)),
+    Qt.CursorShape.CrossCursor: rect_path(-9, -1, 18, 2).united(rect_path(-1, -9, 2, 18)),
+    Qt.CursorShape.SizeHorCursor: DOUBLE_ARROW,
+    Qt.CursorShape.SizeVerCursor: rotated(DOUBLE_ARROW, 90),
+    Qt.CursorShape.SizeFDiagCursor: rotated(DOUBLE_ARROW, 45),
+    Qt.CursorShape.SizeBDiagCursor: rotated(DOUBLE_ARROW, -45),
+    Qt.CursorShape.SizeAllCursor: DOUBLE_ARROW.united(rotated(DOUBLE_ARROW, 90)),
+    Qt.CursorShape.ForbiddenCursor: ring_path(8, 6).united(rotated(rect_path(-7, -1, 14, 2), 45)),
+    Qt.CursorShape.WaitCursor: ring_path(8, 4),
+    Qt.CursorShape.BusyCursor: ARROW.united(ring_path(5, 3).translated(14, 18)),
+}
+
+
+class CursorItem(QGraphicsItem):
+    """ Remote cursor drawn by the viewer (local cursor prediction), at the same size whatever the view scale """
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.glyph = ARROW
+
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIgnoresTransformations)
+        self.setZValue(1)
+
+    def set_shape(self, shape: Qt.CursorShape) -> None:
+        """ Shapes without a glyph of their own are drawn as an arrow """
+        glyph = CURSOR_GLYPHS.get(shape, ARROW)
+        if glyph is self.glyph:
+            return
+
+        self.prepareGeometryChange()
+        self.glyph = glyph
+
+    def boundingRect(self) -> QRectF:
+        return self.glyph.boundingRect().adjusted(-1, -1, 1, 1)
+
+    def paint(self, painter: Optional[QPainter], option: Optional[QStyleOptionGraphicsItem],
+              widget: Optional[QWidget] = None) -> None:
+        if painter is None:
+            return
+
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(QPen(Qt.GlobalColor.black, 1))
+        painter.setBrush(Qt.GlobalColor.white)
+        painter.drawPath(self.glyph)
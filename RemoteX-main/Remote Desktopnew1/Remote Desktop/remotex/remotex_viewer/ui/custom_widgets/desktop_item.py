@@ -0,0 +1,64 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+"""
+
+import time
+from typing import List, Optional
+
+from PyQt6.QtCore import QRect, QRectF
+from PyQt6.QtGui import QPainter
+from PyQt6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem, QWidget
+
+import remotex_viewer.remotex as remotex
+from .desktop_viewport import DesktopViewport
+
+
+class DesktopItem(QGraphicsItem):
+    """ Remote desktop scene item, painted straight from the desktop thread back buffer. Only the exposed area is
+        painted, so invalidating a dirty rect (`update(rect)`) never costs a full desktop upload. On an OpenGL viewport
+        the item is drawn from a texture instead, only the invalidated areas are uploaded to it. """
+    def __init__(self, compositor: remotex.DesktopCompositor, tracer: Optional[remotex.TraceRecorder] = None) -> None:
+        super().__init__()
+
+        self.compositor = compositor
+        self.desktop_size = compositor.size()
+        self.tracer = tracer  # Paints are traced while the session is
+
+        # Areas invalidated since the previous paint
+        self.dirty_rects: List[QRect] = []
+
+        # Exposed rect is otherwise always the whole bounding rect
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(0, 0, self.desktop_size.width(), self.desktop_size.height())
+
+    def invalidate(self, rect: QRect) -> None:
+        """ Repaint the `rect` area of the remote desktop """
+        if len(self.dirty_rects) < remotex.DIRTY_RECTS_MAX:
+            self.dirty_rects.append(rect)
+        else:
+            # Not painted for a while (hidden window)
+            self.dirty_rects = [self.boundingRect().toAlignedRect()]
+
+        self.update(QRectF(rect))
+
+    def paint(self, painter: Optional[QPainter], option: Optional[QStyleOptionGraphicsItem],
+              widget: Optional[QWidget] = None) -> None:
+        dirty_rects, self.dirty_rects = self.dirty_rects, []
+
+        if painter is None or option is None:
+            return
+
+        tracer = self.tracer if self.tracer is not None and self.tracer.enabled else None
+        started = time.perf_counter() if tracer is not None else 0.0
+
+        if isinstance(widget, DesktopViewport):
+            widget.draw_desktop(painter, self.compositor, self.boundingRect(), dirty_rects)
+        else:
+            self.compositor.draw(painter, option.exposedRect.toAlignedRect())
+
+        if tracer is not None:
+            tracer.span("paint", started, time.perf_counter())
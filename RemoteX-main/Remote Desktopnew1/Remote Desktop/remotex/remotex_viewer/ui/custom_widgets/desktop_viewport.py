@@ -0,0 +1,214 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+
+    Optional OpenGL viewport of the Tangent Universe. The remote desktop back buffer is kept as a texture: only the
+    areas the desktop thread composited since the previous refresh are uploaded (glTexSubImage2D), and the texture is
+    scaled to the view by the GPU (linear filtering). What a refresh costs then depends on the dirty area and on the
+    view size, not on the remote resolution.
+
+    Machines without a usable GPU driver get Mesa llvmpipe (software rasterization), `use_software_opengl()` forces it
+    and must be called before the QApplication is created. When no OpenGL context can be created at all, the view keeps
+    its raster viewport.
+"""
+
+import logging
+import os
+from typing import List, Optional
+
+from PyQt6.QtCore import QCoreApplication, QRect, QRectF, Qt
+from PyQt6.QtGui import QImage, QOffscreenSurface, QOpenGLContext, QPainter, QVector2D
+from PyQt6.QtOpenGL import (QOpenGLFunctions_2_0, QOpenGLPixelTransferOptions, QOpenGLShader, QOpenGLShaderProgram,
+                            QOpenGLTexture, QOpenGLVersionFunctionsFactory, QOpenGLVersionProfile)
+from PyQt6.QtOpenGLWidgets import QOpenGLWidget
+
+import remotex_viewer.remotex as remotex
+
+logger = logging.getLogger(__name__)
+
+GL_TRIANGLE_STRIP = 0x0005
+GL_RENDERER = 0x1F01
+
+VERTEX_SHADER = """
+attribute highp vec2 vertex;
+attribute highp vec2 texture_coordinate;
+varying highp vec2 coordinate;
+
+void main() {
+    coordinate = texture_coordinate;
+    gl_Position = vec4(vertex, 0.0, 1.0);
+}
+"""
+
+FRAGMENT_SHADER = """
+varying highp vec2 coordinate;
+uniform sampler2D desktop;
+
+void main() {
+    gl_FragColor = vec4(texture2D(desktop, coordinate).rgb, 1.0);
+}
+"""
+
+
+def use_software_opengl() -> None:
+    """ Render OpenGL with Mesa llvmpipe (Linux) or the bundled software OpenGL (Windows) even when a GPU driver is
+        available, must be called before the QApplication is created """
+    os.environ["LIBGL_ALWAYS_SOFTWARE"] = "1"
+    os.environ.setdefault("GALLIUM_DRIVER", "llvmpipe")
+    QCoreApplication.setAttribute(Qt.ApplicationAttribute.AA_UseSoftwareOpenGL)
+
+
+def opengl_functions(context: QOpenGLContext) -> Optional[QOpenGLFunctions_2_0]:
+    """ OpenGL 2.0 functions of the current `context`, None when it does not provide them (OpenGL ES) """
+    profile = QOpenGLVersionProfile()
+    profile.setVersion(2, 0)
+
+    functions = QOpenGLVersionFunctionsFactory.get(profile, context)
+    if not isinstance(functions, QOpenGLFunctions_2_0) or not functions.initializeOpenGLFunctions():
+        return None
+
+    return functions
+
+
+def opengl_available() -> bool:
+    """ Whether an OpenGL context the viewport can render with is available """
+    surface = QOffscreenSurface()
+    surface.create()
+
+    context = QOpenGLContext()
+    if not context.create() or not context.makeCurrent(surface):
+        return False
+
+    try:
+        return opengl_functions(context) is not None
+    finally:
+        context.doneCurrent()
+
+
+class DesktopViewport(QOpenGLWidget):
+    """ Tangent Universe viewport rendering the remote desktop with OpenGL. The view still paints the scene with a
+        QPainter (OpenGL paint engine), the desktop item hands its area over to `draw_desktop`. """
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.functions: Optional[QOpenGLFunctions_2_0] = None
+        self.program: Optional[QOpenGLShaderProgram] = None
+        self.texture: Optional[QOpenGLTexture] = None
+        self.reduction = 1
+        self.uploaded = 0  # Pixels uploaded to the texture
+
+    def initialize_resources(self) -> bool:
+        context = self.context()
+        if context is None:
+            return False
+
+        self.functions = opengl_functions(context)
+        if self.functions is None:
+            logger.error("OpenGL 2.0 functions are not available, the remote desktop can't be rendered.")
+
+            return False
+
+        self.program = QOpenGLShaderProgram()
+        self.program.addShaderFromSourceCode(QOpenGLShader.ShaderTypeBit.Vertex, VERTEX_SHADER)
+        self.program.addShaderFromSourceCode(QOpenGLShader.ShaderTypeBit.Fragment, FRAGMENT_SHADER)
+        self.program.bindAttributeLocation("vertex", 0)
+        self.program.bindAttributeLocation("texture_coordinate", 1)
+        if not self.program.link():
+            logger.error(f"Unable to link the desktop shader program: {self.program.log()}")
+
+            self.program = None
+
+            return False
+
+        context.aboutToBeDestroyed.connect(self.release_resources)
+
+        logger.info(f"OpenGL viewport renderer: {self.functions.glGetString(GL_RENDERER)}")
+
+        return True
+
+    def release_resources(self) -> None:
+        """ Context about to be destroyed (viewport closed or moved to another window) """
+        self.makeCurrent()
+
+        if self.texture is not None:
+            self.texture.destroy()
+
+        self.texture = None
+        self.program = None
+        self.functions = None
+
+        self.doneCurrent()
+
+    def upload(self, image: QImage, reduction: int, rects: List[QRect]) -> None:
+        """ Copy the `rects` areas of the back buffer to the texture, the whole buffer when its size changed """
+        self.reduction = reduction
+
+        if self.texture is None or self.texture.width() != image.width() or self.texture.height() != image.height():
+            if self.texture is not None:
+                self.texture.destroy()
+
+            self.texture = QOpenGLTexture(QOpenGLTexture.Target.Target2D)
+            self.texture.setFormat(QOpenGLTexture.TextureFormat.RGBA8_UNorm)
+            self.texture.setSize(image.width(), image.height())
+            self.texture.setMinMagFilters(QOpenGLTexture.Filter.Linear, QOpenGLTexture.Filter.Linear)
+            self.texture.setWrapMode(QOpenGLTexture.WrapMode.ClampToEdge)
+            self.texture.allocateStorage(QOpenGLTexture.PixelFormat.BGRA, QOpenGLTexture.PixelType.UInt8)
+
+            rects = [image.rect()]
+
+        # Sub rectangles are read in place: Format_RGB32 pixels are BGRA bytes in memory
+        options = QOpenGLPixelTransferOptions()
+        options.setRowLength(image.bytesPerLine() // 4)
+        options.setAlignment(4)
+
+        pixels = image.constBits()
+        for rect in rects:
+            options.setSkipPixels(rect.x())
+            options.setSkipRows(rect.y())
+            self.texture.setData(rect.x(), rect.y(), 0, rect.width(), rect.height(), 1,
+                                 QOpenGLTexture.PixelFormat.BGRA, QOpenGLTexture.PixelType.UInt8, pixels, options)
+            self.uploaded += rect.width() * rect.height()
+
+    def draw_desktop(self, painter: QPainter, compositor: remotex.DesktopCompositor, desktop_rect: QRectF,
+                     dirty_rects: List[QRect]) -> None:
+        """ Upload what changed in the back buffer then draw it, scaled to where `painter` maps `desktop_rect` """
+        painter.beginNativePainting()
+        try:
+            if self.program is None and not self.initialize_resources():
+                return
+
+            compositor.read(dirty_rects, self.upload)
+            if self.texture is None or self.program is None or self.functions is None:
+                return
+
+            # Normalized device coordinates of the desktop, and the texture area it covers
+            target = painter.transform().mapRect(desktop_rect)
+            left = target.left() * 2 / self.width() - 1
+            right = target.right() * 2 / self.width() - 1
+            top = 1 - target.top() * 2 / self.height()
+            bottom = 1 - target.bottom() * 2 / self.height()
+            s = min(desktop_rect.width() / (self.reduction * self.texture.width()), 1.0)
+            t = min(desktop_rect.height() / (self.reduction * self.texture.height()), 1.0)
+
+            ratio = self.devicePixelRatioF()
+            self.functions.glViewport(0, 0, round(self.width() * ratio), round(self.height() * ratio))
+
+            self.program.bind()
+            self.texture.bind(0)
+            self.program.setUniformValue("desktop", 0)
+
+            self.program.enableAttributeArray(0)
+            self.program.enableAttributeArray(1)
+            self.program.setAttributeArray(0, [QVector2D(left, top), QVector2D(left, bottom), QVector2D(right, top),
+                                               QVector2D(right, bottom)])
+            self.program.setAttributeArray(1, [QVector2D(0, 0), QVector2D(0, t), QVector2D(s, 0), QVector2D(s, t)])
+
+            self.functions.glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+
+            self.program.disableAttributeArray(0)
+            self.program.disableAttributeArray(1)
+            self.texture.release(0)
+            self.program.release()
+        finally:
+            painter.endNativePainting()
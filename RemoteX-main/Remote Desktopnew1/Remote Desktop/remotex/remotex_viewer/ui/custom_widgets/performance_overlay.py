@@ -0,0 +1,127 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+"""
+
+from typing import Callable, Optional, Sequence, Tuple
+
+from PyQt6.QtCore import QPointF, QRectF, Qt
+from PyQt6.QtGui import QColor, QFont, QFontMetrics, QPainter, QPaintEvent, QPen, QPixmap, QPolygonF
+from PyQt6.QtWidgets import QWidget
+
+import remotex_viewer.remotex as remotex
+
+OVERLAY_MARGIN = 8  # Pixels between the overlay and the view corner
+OVERLAY_PADDING = 6
+SPARKLINE_WIDTH = 90
+SPARKLINE_COLOR = QColor(110, 200, 255)
+OVERLAY_BACKGROUND = QColor(0, 0, 0, 170)
+
+
+def format_bitrate(value: float) -> str:
+    for unit, scale in (("Gbit/s", 1e9), ("Mbit/s", 1e6), ("kbit/s", 1e3)):
+        if value >= scale:
+            return f"{value / scale:.1f} {unit}"
+
+    return f"{value:.0f} bit/s"
+
+
+def format_bytes(value: float) -> str:
+    for unit, scale in (("MiB", 1 << 20), ("KiB", 1 << 10)):
+        if value >= scale:
+            return f"{value / scale:.1f} {unit}"
+
+    return f"{value:.0f} B"
+
+
+# Statistic, label and format of the overlay rows
+OVERLAY_ROWS: Sequence[Tuple[str, str, Callable[[float], str]]] = (
+    ("Fps", "FPS", lambda value: f"{value:.0f}"),
+    ("Frames", "Frames/s", lambda value: f"{value:.0f}"),
+    ("Bitrate", "Bitrate", format_bitrate),
+    ("FrameBytes", "Frame Size", format_bytes),
+    ("DecodeTime", "Decode", lambda value: f"{value:.1f} ms"),
+    ("CompositeTime", "Composite", lambda value: f"{value:.1f} ms"),
+    ("Rtt", "RTT", lambda value: f"{value:.1f} ms"),
+    ("Coalesced", "Coalesced/s", lambda value: f"{value:.0f}"),
+    ("Dropped", "Dropped/s", lambda value: f"{value:.0f}"),
+)
+
+
+class PerformanceOverlay(QWidget):
+    """ Desktop pipeline statistics drawn over the top left corner of the view. The overlay is rendered to a pixmap
+        once per sample, a view refresh only costs blitting it. """
+    def __init__(self, parent: QWidget) -> None:
+        super().__init__(parent)
+
+        self.pixmap = QPixmap()
+
+        self.overlay_font = QFont("Monospace")
+        self.overlay_font.setStyleHint(QFont.StyleHint.TypeWriter)
+        self.overlay_font.setPointSize(8)
+
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.hide()
+
+    def render_statistics(self, statistics: remotex.PipelineStatistics, title: str) -> None:
+        """ Render the latest `statistics` and their history below `title` (codec, quality...) """
+        metrics = QFontMetrics(self.overlay_font)
+        row_height = metrics.height()
+        label_width = max(metrics.horizontalAdvance(label) for _, label, _ in OVERLAY_ROWS) + OVERLAY_PADDING
+        value_width = metrics.horizontalAdvance("0000.0 Mbit/s") + OVERLAY_PADDING
+        width = max(label_width + value_width + SPARKLINE_WIDTH, metrics.horizontalAdvance(title)) + 2 * OVERLAY_PADDING
+        height = (len(OVERLAY_ROWS) + 1) * row_height + 2 * OVERLAY_PADDING
+
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(round(width * ratio), round(height * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.GlobalColor.transparent)
+
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(OVERLAY_BACKGROUND)
+        painter.drawRoundedRect(QRectF(0, 0, width, height), 4, 4)
+
+        painter.setFont(self.overlay_font)
+        painter.setPen(Qt.GlobalColor.white)
+        painter.drawText(OVERLAY_PADDING, OVERLAY_PADDING + metrics.ascent(), title)
+
+        sparkline_pen = QPen(SPARKLINE_COLOR, 1)
+        for row, (name, label, text) in enumerate(OVERLAY_ROWS, start=1):
+            top = OVERLAY_PADDING + row * row_height
+            painter.setPen(Qt.GlobalColor.lightGray)
+            painter.drawText(OVERLAY_PADDING, top + metrics.ascent(), label)
+            painter.setPen(Qt.GlobalColor.white)
+            painter.drawText(OVERLAY_PADDING + label_width, top + metrics.ascent(), text(statistics.latest[name]))
+
+            history = statistics.history[name]
+            if len(history) < 2:
+                continue
+
+            # Scaled to the highest value of the history, drawn from the right edge
+            peak = max(history) or 1.0
+            left = width - OVERLAY_PADDING - SPARKLINE_WIDTH
+            step = SPARKLINE_WIDTH / max((history.maxlen or len(history)) - 1, 1)
+            start = left + SPARKLINE_WIDTH - step * (len(history) - 1)
+            painter.setPen(sparkline_pen)
+            painter.drawPolyline(QPolygonF([
+                QPointF(start + index * step, top + row_height - 2 - (row_height - 4) * value / peak)
+                for index, value in enumerate(history)
+            ]))
+
+        painter.end()
+
+        self.pixmap = pixmap
+        self.setGeometry(OVERLAY_MARGIN, OVERLAY_MARGIN, width, height)
+        self.update()
+
+    def paintEvent(self, event: Optional[QPaintEvent]) -> None:
+        if self.pixmap.isNull():
+            return
+
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.pixmap)
+        painter.end()
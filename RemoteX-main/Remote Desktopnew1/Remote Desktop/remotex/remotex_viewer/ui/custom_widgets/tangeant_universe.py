@@ -9,13 +9,16 @@
 """
 
 import logging
+import time
 from typing import Optional, Tuple, Union
 
-from PyQt6.QtCore import Qt, pyqtSlot
-from PyQt6.QtGui import QClipboard, QKeyEvent, QMouseEvent, QWheelEvent
+from PyQt6.QtCore import QEvent, QPointF, Qt, QTimer, pyqtSignal, pyqtSlot
+from PyQt6.QtGui import QClipboard, QKeyEvent, QMouseEvent, QResizeEvent, QWheelEvent
 from PyQt6.QtWidgets import QApplication, QGraphicsScene, QGraphicsView
 
 import remotex_viewer.remotex as remotex
+from .cursor_item import CursorItem
+from .desktop_viewport import DesktopViewport, opengl_available
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +29,8 @@ class TangentUniverse(QGraphicsView):
     diverging veil? When the cosmic mirror distorts, do you walk the ordained spiral or the fragmented loop of the
     twilight realm?`"""
 
+    resized = pyqtSignal()
+
     def __init__(self) -> None:
         super().__init__()
 
@@ -35,6 +40,7 @@ class TangentUniverse(QGraphicsView):
         self.setMouseTracking(True)
 
         self.events_thread: Optional[remotex.EventsThread] = None
+        self.clipboard_thread: Optional[remotex.ClipboardThread] = None
         self.desktop_screen: Optional[remotex.Screen] = None
 
         # instead of doing a simple ``setScene(QGraphicsScene())``, we will keep a reference to the scene to be updated
@@ -46,17 +52,67 @@ class TangentUniverse(QGraphicsView):
         if self.clipboard is not None:
             self.clipboard.dataChanged.connect(self.clipboard_data_changed)
 
+        # Local cursor prediction (disabled unless `set_cursor_prediction` is called)
+        self.cursor_predictor: Optional[remotex.CursorPredictor] = None
+        self.cursor_item: Optional[CursorItem] = None
+
+        self.cursor_timer = QTimer(self)
+        self.cursor_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.cursor_timer.setInterval(16)
+        self.cursor_timer.timeout.connect(self.step_cursor)
+
+    def resizeEvent(self, event: Optional[QResizeEvent]) -> None:
+        """ View size changed (window resized, panel docked...), the scene transform must be fitted again """
+        super().resizeEvent(event)
+        self.resized.emit()
+
+    def use_opengl_viewport(self) -> bool:
+        """ Render the scene with OpenGL (GPU scaling, only dirty areas uploaded), False when no OpenGL context is
+            available: the raster viewport is kept """
+        if not opengl_available():
+            logger.warning("OpenGL is not available, the remote desktop is rendered without it.")
+
+            return False
+
+        self.setViewport(DesktopViewport())
+
+        # OpenGL viewports repaint entirely, drawing the whole texture costs no more than drawing a part of it
+        self.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.FullViewportUpdate)
+
+        return True
+
+    def set_cursor_prediction(self, smoothing: float) -> None:
+        """ Draw the remote cursor where the hand moves it instead of the local cursor, corrections reported by the
+            server are smoothed over `smoothing` seconds """
+        self.cursor_predictor = remotex.CursorPredictor(smoothing)
+        self.setCursor(Qt.CursorShape.BlankCursor)
+
     def reset_scene(self) -> None:
         if self.desktop_scene is not None:
             self.desktop_scene.clear()
 
+            # Deleted with the rest of the scene
+            self.cursor_item = None
+            if self.cursor_predictor is not None:
+                self.cursor_item = CursorItem()
+                self.cursor_item.hide()
+                self.desktop_scene.addItem(self.cursor_item)
+
     def set_event_thread(self, events_thread: remotex.EventsThread) -> None:
         """ Set the events thread """
         self.events_thread = events_thread
 
         self.events_thread.update_mouse_cursor.connect(self.update_mouse_cursor)
+        self.events_thread.remote_cursor_moved.connect(self.remote_cursor_moved)
         self.events_thread.update_clipboard.connect(self.update_clipboard)
 
+    def set_clipboard_thread(self, clipboard_thread: Optional[remotex.ClipboardThread]) -> None:
+        """ Set the clipboard thread, None when clipboard sharing is disabled """
+        self.clipboard_thread = clipboard_thread
+
+        if self.clipboard_thread is not None:
+            self.clipboard_thread.update_clipboard_data.connect(self.update_clipboard_data)
+
     def set_screen(self, screen: remotex.Screen) -> None:
         """ Set the captured screen original information """
         self.desktop_screen = screen
@@ -76,6 +132,31 @@ class TangentUniverse(QGraphicsView):
         return (self.desktop_screen.x + (x * x_ratio),
                 self.desktop_screen.y + (y * y_ratio))
 
+    def remote_to_scene(self, x: float, y: float) -> QPointF:
+        """ Scene position of a remote screen position (reverse of `fix_mouse_position`) """
+        if self.desktop_screen is None or not self.desktop_screen.width or not self.desktop_screen.height:
+            return QPointF(x, y)
+
+        scene_rect = self.sceneRect()
+
+        return QPointF((x - self.desktop_screen.x) * scene_rect.width() / self.desktop_screen.width,
+                       (y - self.desktop_screen.y) * scene_rect.height() / self.desktop_screen.height)
+
+    def place_cursor(self) -> None:
+        """ Move the drawn cursor to the predicted position """
+        if self.cursor_predictor is None or self.cursor_item is None or self.cursor_predictor.position is None:
+            return
+
+        self.cursor_item.setPos(self.remote_to_scene(*self.cursor_predictor.position))
+        self.cursor_item.show()
+
+    def step_cursor(self) -> None:
+        """ Smoothing timer tick, runs only while the drawn cursor moves toward a server reported position """
+        if self.cursor_predictor is None or not self.cursor_predictor.step(time.monotonic()):
+            self.cursor_timer.stop()
+
+        self.place_cursor()
+
     def send_mouse_event(self, x: Union[int, float], y: Union[int, float], state: remotex.MouseState,
                          button: remotex.MouseButton) -> None:
         x = int(x)
@@ -147,16 +228,28 @@ class TangentUniverse(QGraphicsView):
 
         self.send_mouse_event(x, y, remotex.MouseState.Move, remotex.MouseButton.Void)
 
+        # Drawn at the hand position right away, the server reports the same position one round trip later
+        if self.cursor_predictor is not None:
+            self.cursor_predictor.moved(int(x), int(y), time.monotonic())
+            self.cursor_timer.stop()
+            self.place_cursor()
+
+    def leaveEvent(self, event: Optional[QEvent]) -> None:
+        super().leaveEvent(event)
+
+        if self.cursor_item is not None:
+            self.cursor_item.hide()
+
     def clipboard_data_changed(self) -> None:
-        """ Handle clipboard data changed event """
-        if self.events_thread is None or self.clipboard is None:
+        """ Handle clipboard data changed event, the clipboard thread drops duplicates and echoes of server contents """
+        if self.clipboard_thread is None or self.clipboard is None:
             return
 
-        text = self.clipboard.text(QClipboard.Mode.Clipboard)
+        mime = self.clipboard.mimeData(QClipboard.Mode.Clipboard)
+        if mime is None:
+            return
 
-        self.events_thread.send_clipboard_text(
-            text
-        )
+        self.clipboard_thread.send_clipboard(remotex.mime_to_formats(mime))
 
     @staticmethod
     def parse_f_keys(event: QKeyEvent) -> Optional[str]:
@@ -307,9 +400,28 @@ class TangentUniverse(QGraphicsView):
 
     @pyqtSlot(Qt.CursorShape)
     def update_mouse_cursor(self, cursor: Qt.CursorShape) -> None:
-        self.setCursor(cursor)
+        if self.cursor_predictor is None:
+            self.setCursor(cursor)
+        elif self.cursor_item is not None:
+            self.cursor_item.set_shape(cursor)
+
+    @pyqtSlot(int, int)
+    def remote_cursor_moved(self, x: int, y: int) -> None:
+        """ Server reported its cursor position, the drawn cursor moves there unless it is the echo of a move """
+        if self.cursor_predictor is None:
+            return
+
+        self.cursor_predictor.reconcile(x, y, time.monotonic())
+        self.step_cursor()
+        if self.cursor_predictor.position != self.cursor_predictor.target:
+            self.cursor_timer.start()
 
     @pyqtSlot(str)
     def update_clipboard(self, text: str) -> None:
         if self.clipboard is not None:
             self.clipboard.setText(text)
+
+    @pyqtSlot(dict)
+    def update_clipboard_data(self, formats: dict) -> None:
+        if self.clipboard is not None:
+            self.clipboard.setMimeData(remotex.formats_to_mime(formats), QClipboard.Mode.Clipboard)
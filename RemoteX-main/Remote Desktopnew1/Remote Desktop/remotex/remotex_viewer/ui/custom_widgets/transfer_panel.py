@@ -0,0 +1,263 @@
+"""
+
+    License: Apache License 2.0
+    More information about the LICENSE on the LICENSE file in the root directory of the project.
+"""
+
+import os
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from PyQt6.QtCore import Qt, pyqtSlot
+from PyQt6.QtWidgets import (QDockWidget, QFileDialog, QHBoxLayout, QHeaderView, QLineEdit, QProgressBar,
+                             QPushButton, QTableWidget, QTableWidgetItem, QTreeWidget, QTreeWidgetItem, QVBoxLayout,
+                             QWidget)
+
+import remotex_viewer.remotex as remotex
+
+TRANSFER_COLUMN_FILE = 0
+TRANSFER_COLUMN_DIRECTION = 1
+TRANSFER_COLUMN_PROGRESS = 2
+TRANSFER_COLUMN_STATUS = 3
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} TB"
+
+
+class TransferPanel(QDockWidget):
+    """ Remote file browser and transfer queue, driven by the session file transfer thread """
+    def __init__(self, parent: Optional[QWidget] = None) -> None:
+        super().__init__("File Transfer", parent)
+
+        self.transfer_thread: Optional[remotex.FileTransferThread] = None
+        self.remote_path = ""
+        self.remote_parent: Optional[str] = None
+        self.remote_separator = os.sep
+        self.local_directory = os.path.expanduser("~")
+
+        self.rows: Dict[int, int] = {}  # Job id -> transfers table row
+        self.started: Dict[int, Tuple[float, int]] = {}  # Job id -> time and offset of its first progress report
+        self.uploads: Set[int] = set()
+
+        core_widget = QWidget()
+        core_layout = QVBoxLayout()
+        core_widget.setLayout(core_layout)
+        self.setWidget(core_widget)
+
+        # Remote Location
+        location_layout = QHBoxLayout()
+        core_layout.addLayout(location_layout)
+
+        self.up_button = QPushButton("Up")
+        self.up_button.clicked.connect(self.browse_parent)
+        location_layout.addWidget(self.up_button)
+
+        self.location_edit = QLineEdit()
+        self.location_edit.returnPressed.connect(lambda: self.browse(self.location_edit.text()))
+        location_layout.addWidget(self.location_edit)
+
+        self.refresh_button = QPushButton("Refresh")
+        self.refresh_button.clicked.connect(lambda: self.browse(self.remote_path))
+        location_layout.addWidget(self.refresh_button)
+
+        # Remote Files
+        self.files_tree = QTreeWidget()
+        self.files_tree.setHeaderLabels(["Name", "Size", "Modified"])
+        self.files_tree.setRootIsDecorated(False)
+        self.files_tree.setSelectionMode(QTreeWidget.SelectionMode.ExtendedSelection)
+        self.files_tree.itemDoubleClicked.connect(self.file_double_clicked)
+        self.files_tree.header().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        core_layout.addWidget(self.files_tree)
+
+        # Action Buttons
+        action_buttons_layout = QHBoxLayout()
+        core_layout.addLayout(action_buttons_layout)
+
+        self.upload_button = QPushButton("Upload...")
+        self.upload_button.clicked.connect(self.upload_files)
+        action_buttons_layout.addWidget(self.upload_button)
+
+        self.download_button = QPushButton("Download")
+        self.download_button.clicked.connect(self.download_selection)
+        action_buttons_layout.addWidget(self.download_button)
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_selection)
+        action_buttons_layout.addWidget(self.cancel_button)
+
+        # Transfers
+        self.transfers_table = QTableWidget(0, 4)
+        self.transfers_table.setHorizontalHeaderLabels(["File", "", "Progress", "Status"])
+        self.transfers_table.verticalHeader().setVisible(False)
+        self.transfers_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.transfers_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.transfers_table.horizontalHeader().setSectionResizeMode(
+            TRANSFER_COLUMN_FILE, QHeaderView.ResizeMode.Stretch
+        )
+        core_layout.addWidget(self.transfers_table)
+
+        self.set_enabled(False)
+
+    def set_transfer_thread(self, transfer_thread: Optional[remotex.FileTransferThread]) -> None:
+        """ Set the file transfer thread, None when file transfer is not available """
+        self.transfer_thread = transfer_thread
+        self.set_enabled(transfer_thread is not None)
+
+        if self.transfer_thread is None:
+            return
+
+        self.transfer_thread.directory_listed.connect(self.directory_listed)
+        self.transfer_thread.transfer_progress.connect(self.transfer_progress)
+        self.transfer_thread.transfer_finished.connect(self.transfer_finished)
+
+        self.browse(self.remote_path)
+
+    def set_enabled(self, enabled: bool) -> None:
+        for widget in (self.up_button, self.location_edit, self.refresh_button, self.files_tree, self.upload_button,
+                       self.download_button):
+            widget.setEnabled(enabled)
+
+    def browse(self, path: str) -> None:
+        if self.transfer_thread is not None:
+            self.transfer_thread.list_directory(path)
+
+    def browse_parent(self) -> None:
+        if self.remote_parent is not None:
+            self.browse(self.remote_parent)
+
+    @pyqtSlot(dict)
+    def directory_listed(self, listing: dict) -> None:
+        if "Error" in listing:
+            self.setWindowTitle(f"File Transfer - {listing['Error']}")
+
+            return
+
+        self.setWindowTitle("File Transfer")
+        self.remote_path = listing["Path"]
+        self.remote_parent = listing.get("Parent")
+        self.remote_separator = listing.get("Separator", self.remote_separator)
+        self.location_edit.setText(self.remote_path)
+        self.up_button.setEnabled(self.remote_parent is not None)
+
+        self.files_tree.clear()
+        for entry in listing.get("Entries", []):
+            item = QTreeWidgetItem([
+                f"{entry['Name']}{self.remote_separator}" if entry["Directory"] else entry["Name"],
+                "" if entry["Directory"] else format_size(entry["Size"]),
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["Modified"])),
+            ])
+            item.setData(0, Qt.ItemDataRole.UserRole, entry)
+            item.setTextAlignment(1, Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+            self.files_tree.addTopLevelItem(item)
+
+    def remote_entry_path(self, entry: dict) -> str:
+        return remotex.join_remote(self.remote_path, entry["Name"], self.remote_separator)
+
+    def file_double_clicked(self, item: QTreeWidgetItem, _column: int) -> None:
+        entry = item.data(0, Qt.ItemDataRole.UserRole)
+        if entry["Directory"]:
+            self.browse(self.remote_entry_path(entry))
+        else:
+            self.download_selection()
+
+    def download_selection(self) -> None:
+        if self.transfer_thread is None:
+            return
+
+        entries = [item.data(0, Qt.ItemDataRole.UserRole) for item in self.files_tree.selectedItems()]
+        entries = [entry for entry in entries if not entry["Directory"]]
+        if not entries:
+            return
+
+        directory = QFileDialog.getExistingDirectory(self, "Download To", self.local_directory)
+        if not directory:
+            return
+
+        self.local_directory = directory
+        for entry in entries:
+            job = self.transfer_thread.download_file(
+                self.remote_entry_path(entry), os.path.join(directory, entry["Name"]), entry["Size"]
+            )
+            self.add_transfer(job, entry["Name"])
+
+    def upload_files(self) -> None:
+        if self.transfer_thread is None:
+            return
+
+        paths, _ = QFileDialog.getOpenFileNames(self, "Upload Files", self.local_directory)
+        if not paths:
+            return
+
+        self.local_directory = os.path.dirname(paths[0])
+        for path in paths:
+            name = os.path.basename(path)
+            job = self.transfer_thread.upload_file(path, remotex.join_remote(self.remote_path, name,
+                                                                             self.remote_separator))
+            self.add_transfer(job, name)
+
+    def cancel_selection(self) -> None:
+        if self.transfer_thread is None:
+            return
+
+        selected_rows = {index.row() for index in self.transfers_table.selectedIndexes()}
+        for job_id, row in self.rows.items():
+            if row in selected_rows:
+                self.transfer_thread.cancel(job_id)
+
+    def add_transfer(self, job: remotex.TransferJob, name: str) -> None:
+        row = self.transfers_table.rowCount()
+        self.transfers_table.insertRow(row)
+        self.rows[job.id] = row
+        if job.upload:
+            self.uploads.add(job.id)
+
+        self.transfers_table.setItem(row, TRANSFER_COLUMN_FILE, QTableWidgetItem(name))
+        self.transfers_table.setItem(row, TRANSFER_COLUMN_DIRECTION, QTableWidgetItem("↑" if job.upload else "↓"))
+        self.transfers_table.setItem(row, TRANSFER_COLUMN_STATUS, QTableWidgetItem("Queued"))
+
+        progress_bar = QProgressBar()
+        progress_bar.setRange(0, 1000)
+        progress_bar.setValue(0)
+        self.transfers_table.setCellWidget(row, TRANSFER_COLUMN_PROGRESS, progress_bar)
+
+    @pyqtSlot(int, int, int)
+    def transfer_progress(self, job_id: int, transferred: int, size: int) -> None:
+        row = self.rows.get(job_id)
+        if row is None:
+            return
+
+        now = time.monotonic()
+        started, initial = self.started.setdefault(job_id, (now, transferred))
+        elapsed = now - started
+
+        progress_bar = self.transfers_table.cellWidget(row, TRANSFER_COLUMN_PROGRESS)
+        if isinstance(progress_bar, QProgressBar):
+            progress_bar.setValue(int(transferred * 1000 / size) if size else 1000)
+
+        status = f"{format_size(transferred)} / {format_size(size)}"
+        if elapsed > 0:
+            status += f" - {format_size((transferred - initial) / elapsed)}/s"
+        self.transfers_table.item(row, TRANSFER_COLUMN_STATUS).setText(status)
+
+    @pyqtSlot(int, str)
+    def transfer_finished(self, job_id: int, error: str) -> None:
+        row = self.rows.get(job_id)
+        if row is None:
+            return
+
+        self.started.pop(job_id, None)
+        self.transfers_table.item(row, TRANSFER_COLUMN_STATUS).setText(error or "Done")
+
+        progress_bar = self.transfers_table.cellWidget(row, TRANSFER_COLUMN_PROGRESS)
+        if isinstance(progress_bar, QProgressBar) and not error:
+            progress_bar.setValue(1000)
+
+        # Keep the listing current after an upload
+        if job_id in self.uploads and not error:
+            self.browse(self.remote_path)
@@ -8,7 +8,7 @@ from typing import Optional, Union
 
 from PyQt6.QtCore import QModelIndex, QSettings, Qt
 from PyQt6.QtGui import QShowEvent, QStandardItem, QStandardItemModel
-from PyQt6.QtWidgets import (QComboBox, QDialog, QGridLayout, QGroupBox,
+from PyQt6.QtWidgets import (QCheckBox, QComboBox, QDialog, QGridLayout, QGroupBox,
                              QHBoxLayout, QLabel, QMainWindow, QMessageBox,
                              QPushButton, QSizePolicy, QSpacerItem, QSpinBox,
                              QTabWidget, QTreeView, QVBoxLayout, QWidget)
@@ -74,6 +74,20 @@ class RemoteDesktopOptionsTab(QWidget):
         for block_size in remotex.BlockSize:
             self.block_size_input.addItem(block_size.display_name, userData=block_size)
 
+        # Tile Encoding (Optimization)
+        tile_encoding_label = QLabel("Tile Encoding:")
+        self.tile_encoding_input = QComboBox()
+        for tile_encoding in remotex.TileEncoding:
+            self.tile_encoding_input.addItem(tile_encoding.display_name, userData=tile_encoding)
+
+        self.tile_encoding_input.currentIndexChanged.connect(self.tile_encoding_changed)
+
+        # Pixel Format (Raw and Zlib Tiles)
+        pixel_format_label = QLabel("Pixel Format:")
+        self.pixel_format_input = QComboBox()
+        for pixel_format in remotex.PixelFormat:
+            self.pixel_format_input.addItem(pixel_format.display_name, userData=pixel_format)
+
         # Place Inputs in our Grid Layout
         desktop_capture_group_layout.addWidget(image_quality_label, 0, 0)
         desktop_capture_group_layout.addWidget(self.image_quality_input, 0, 1)
@@ -84,6 +98,83 @@ class RemoteDesktopOptionsTab(QWidget):
         desktop_capture_group_layout.addWidget(block_size_label, 2, 0)
         desktop_capture_group_layout.addWidget(self.block_size_input, 2, 1)
 
+        desktop_capture_group_layout.addWidget(tile_encoding_label, 3, 0)
+        desktop_capture_group_layout.addWidget(self.tile_encoding_input, 3, 1)
+
+        desktop_capture_group_layout.addWidget(pixel_format_label, 4, 0)
+        desktop_capture_group_layout.addWidget(self.pixel_format_input, 4, 1)
+
+        # Display (Fieldset)
+        display_group = QGroupBox("Display")
+        display_group_layout = QGridLayout()
+        display_group.setLayout(display_group_layout)
+        display_group_layout.setContentsMargins(8, 16, 8, 8)
+        core_layout.addWidget(display_group)
+
+        # OpenGL Viewport (GPU scaling, only changed areas uploaded)
+        self.opengl_viewport_checkbox = QCheckBox("Render the desktop with OpenGL")
+
+        # Software OpenGL (Mesa llvmpipe), for machines without a usable GPU driver
+        self.software_opengl_checkbox = QCheckBox("Software OpenGL rendering (applies on restart)")
+        self.opengl_viewport_checkbox.toggled.connect(self.software_opengl_checkbox.setEnabled)
+
+        # Local Cursor (drawn where the hand moves it, corrected when the remote cursor goes elsewhere)
+        self.cursor_prediction_checkbox = QCheckBox("Draw the cursor locally (hides network latency)")
+
+        cursor_smoothing_label = QLabel("Cursor Smoothing:")
+        self.cursor_smoothing_input = QSpinBox()
+        self.cursor_smoothing_input.setMinimum(0)
+        self.cursor_smoothing_input.setMaximum(1000)
+        self.cursor_smoothing_input.setSingleStep(10)
+        self.cursor_smoothing_input.setSuffix(" ms")
+        self.cursor_smoothing_input.setValue(100)
+        self.cursor_prediction_checkbox.toggled.connect(self.cursor_smoothing_input.setEnabled)
+
+        display_group_layout.addWidget(self.opengl_viewport_checkbox, 0, 0, 1, 2)
+        display_group_layout.addWidget(self.software_opengl_checkbox, 1, 0, 1, 2)
+        display_group_layout.addWidget(self.cursor_prediction_checkbox, 2, 0, 1, 2)
+        display_group_layout.addWidget(cursor_smoothing_label, 3, 0)
+        display_group_layout.addWidget(self.cursor_smoothing_input, 3, 1)
+
+        # Transport Security (Fieldset)
+        transport_security_group = QGroupBox("Transport Security")
+        transport_security_group_layout = QGridLayout()
+        transport_security_group.setLayout(transport_security_group_layout)
+        core_layout.addWidget(transport_security_group)
+
+        transport_security_group_layout.setContentsMargins(8, 16, 8, 8)
+
+        self.use_tls_checkbox = QCheckBox("Encrypt connection (TLS)")
+
+        tls_cipher_label = QLabel("Cipher Preference:")
+        self.tls_cipher_input = QComboBox()
+        for tls_cipher in remotex.TlsCipherPreference:
+            self.tls_cipher_input.addItem(tls_cipher.display_name, userData=tls_cipher)
+
+        self.use_tls_checkbox.toggled.connect(self.tls_cipher_input.setEnabled)
+
+        # Desktop tiles over UDP (Lossy Links)
+        self.datagram_transport_checkbox = QCheckBox("Desktop over UDP (lossy links, not encrypted)")
+        self.datagram_transport_checkbox.setToolTip(
+            "Desktop updates are sent as datagrams so that a lost packet does not stall the whole picture. "
+            "Servers refuse it while TLS is enabled unless configured otherwise."
+        )
+
+        # Dead Link Detection (Keepalive)
+        keepalive_timeout_label = QLabel("Dead Link Timeout:")
+        self.keepalive_timeout_input = QSpinBox()
+        self.keepalive_timeout_input.setMinimum(3)
+        self.keepalive_timeout_input.setMaximum(120)
+        self.keepalive_timeout_input.setSuffix(" s")
+        self.keepalive_timeout_input.setValue(10)
+
+        transport_security_group_layout.addWidget(self.use_tls_checkbox, 0, 0, 1, 2)
+        transport_security_group_layout.addWidget(tls_cipher_label, 1, 0)
+        transport_security_group_layout.addWidget(self.tls_cipher_input, 1, 1)
+        transport_security_group_layout.addWidget(keepalive_timeout_label, 2, 0)
+        transport_security_group_layout.addWidget(self.keepalive_timeout_input, 2, 1)
+        transport_security_group_layout.addWidget(self.datagram_transport_checkbox, 3, 0, 1, 2)
+
         core_layout.addItem(QSpacerItem(20, 40, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Expanding))
 
     def load_settings(self) -> None:
@@ -110,6 +201,60 @@ class RemoteDesktopOptionsTab(QWidget):
             )
         )
 
+        self.tile_encoding_input.setCurrentIndex(
+            self.tile_encoding_input.findData(
+                self.settings.value(remotex.SETTINGS_KEY_TILE_ENCODING, remotex.TileEncoding.Jpeg)
+            )
+        )
+
+        self.pixel_format_input.setCurrentIndex(
+            self.pixel_format_input.findData(
+                self.settings.value(remotex.SETTINGS_KEY_PIXEL_FORMAT, remotex.PixelFormat.RGB888)
+            )
+        )
+        self.tile_encoding_changed()
+
+        # Load Display Options
+        self.opengl_viewport_checkbox.setChecked(
+            self.settings.value(remotex.SETTINGS_KEY_OPENGL_VIEWPORT, False, type=bool)
+        )
+        self.software_opengl_checkbox.setEnabled(self.opengl_viewport_checkbox.isChecked())
+
+        self.software_opengl_checkbox.setChecked(
+            self.settings.value(remotex.SETTINGS_KEY_SOFTWARE_OPENGL, False, type=bool)
+        )
+
+        self.cursor_prediction_checkbox.setChecked(
+            self.settings.value(remotex.SETTINGS_KEY_CURSOR_PREDICTION, False, type=bool)
+        )
+        self.cursor_smoothing_input.setEnabled(self.cursor_prediction_checkbox.isChecked())
+
+        self.cursor_smoothing_input.setValue(
+            self.settings.value(remotex.SETTINGS_KEY_CURSOR_SMOOTHING, 100, type=int)
+        )
+
+        # Load Transport Security Options
+        self.use_tls_checkbox.setChecked(self.settings.value(remotex.SETTINGS_KEY_USE_TLS, True, type=bool))
+        self.tls_cipher_input.setEnabled(self.use_tls_checkbox.isChecked())
+
+        self.tls_cipher_input.setCurrentIndex(
+            self.tls_cipher_input.findData(
+                self.settings.value(remotex.SETTINGS_KEY_TLS_CIPHER, remotex.TlsCipherPreference.Auto)
+            )
+        )
+
+        self.keepalive_timeout_input.setValue(
+            self.settings.value(remotex.SETTINGS_KEY_KEEPALIVE_TIMEOUT, 10, type=int)
+        )
+
+        self.datagram_transport_checkbox.setChecked(
+            self.settings.value(remotex.SETTINGS_KEY_DATAGRAM_TRANSPORT, False, type=bool)
+        )
+
+    def tile_encoding_changed(self) -> None:
+        """ Pixel format only applies to raw pixel tiles """
+        self.pixel_format_input.setEnabled(self.tile_encoding_input.currentData() != remotex.TileEncoding.Jpeg)
+
     def save_settings(self) -> None:
         """ Save remote desktop settings to the settings """
         # Save Options
@@ -119,6 +264,20 @@ class RemoteDesktopOptionsTab(QWidget):
         self.settings.setValue(remotex.SETTINGS_KEY_IMAGE_QUALITY, self.image_quality_input.value())
         self.settings.setValue(remotex.SETTINGS_KEY_PACKET_SIZE, self.packet_size_input.currentData())
         self.settings.setValue(remotex.SETTINGS_KEY_BLOCK_SIZE, self.block_size_input.currentData())
+        self.settings.setValue(remotex.SETTINGS_KEY_TILE_ENCODING, self.tile_encoding_input.currentData())
+        self.settings.setValue(remotex.SETTINGS_KEY_PIXEL_FORMAT, self.pixel_format_input.currentData())
+
+        # Save Display Options
+        self.settings.setValue(remotex.SETTINGS_KEY_OPENGL_VIEWPORT, self.opengl_viewport_checkbox.isChecked())
+        self.settings.setValue(remotex.SETTINGS_KEY_SOFTWARE_OPENGL, self.software_opengl_checkbox.isChecked())
+        self.settings.setValue(remotex.SETTINGS_KEY_CURSOR_PREDICTION, self.cursor_prediction_checkbox.isChecked())
+        self.settings.setValue(remotex.SETTINGS_KEY_CURSOR_SMOOTHING, self.cursor_smoothing_input.value())
+
+        # Save Transport Security Options
+        self.settings.setValue(remotex.SETTINGS_KEY_USE_TLS, self.use_tls_checkbox.isChecked())
+        self.settings.setValue(remotex.SETTINGS_KEY_TLS_CIPHER, self.tls_cipher_input.currentData())
+        self.settings.setValue(remotex.SETTINGS_KEY_KEEPALIVE_TIMEOUT, self.keepalive_timeout_input.value())
+        self.settings.setValue(remotex.SETTINGS_KEY_DATAGRAM_TRANSPORT, self.datagram_transport_checkbox.isChecked())
 
 
 class TrustedCertificateModel(QStandardItemModel):
@@ -313,6 +472,8 @@ class TrustedCertificatesOptionsTab(QWidget):
                 }
             )
 
+        self.settings.setValue(remotex.SETTINGS_KEY_TRUSTED_CERTIFICATES, fingerprints)
+
 
 class OptionsDialog(QDialog):
     def __init__(self, parent: Optional[QWidget]) -> None:
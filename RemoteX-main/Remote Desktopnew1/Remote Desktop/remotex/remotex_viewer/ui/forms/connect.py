@@ -178,19 +178,50 @@ class ConnectWindow(utilities.QCenteredMainWindow):
                 raise Exception("Password field cannot be empty.")
 
             # Attempt connection
-            self.__connect_thread = remotex.ConnectThread(
-                self.server_address_input.text(),
-                self.server_port_input.value(),
-                self.password_input.text(),
-            )
-
-            self.__connect_thread.thread_started.connect(self.connect_thread_started)
-            self.__connect_thread.session_error.connect(self.session_error)
-            self.__connect_thread.thread_finished.connect(self.connect_thread_finished)
-            self.__connect_thread.start()
+            self.start_connect_thread()
         except Exception as e:
             QMessageBox.critical(self, "Form Error", str(e))
 
+    def start_connect_thread(self, accepted_fingerprint: Optional[str] = None) -> None:
+        self.__connect_thread = remotex.ConnectThread(
+            self.server_address_input.text(),
+            self.server_port_input.value(),
+            self.password_input.text(),
+            accepted_fingerprint,
+        )
+
+        self.__connect_thread.thread_started.connect(self.connect_thread_started)
+        self.__connect_thread.session_error.connect(self.session_error)
+        self.__connect_thread.thread_finished.connect(self.connect_thread_finished)
+        self.__connect_thread.start()
+
+    def review_server_certificate(self, fingerprint: str) -> None:
+        """ Let the user review an unknown server certificate, then retry the connection if it was accepted """
+        dialog = remotex_dialogs.ServerCertificateDialog(self, fingerprint)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+
+        if dialog.trust_certificate_checkbox.isChecked():
+            settings = QSettings(remotex.APP_ORGANIZATION_NAME, remotex.APP_NAME)
+
+            fingerprints = settings.value(remotex.SETTINGS_KEY_TRUSTED_CERTIFICATES, []) or []
+            if isinstance(fingerprints, str):
+                fingerprints = [fingerprints]
+
+            if fingerprint not in fingerprints:
+                fingerprints.append(fingerprint)
+
+            settings.setValue(remotex.SETTINGS_KEY_TRUSTED_CERTIFICATES, fingerprints)
+            settings.setValue(
+                f"{remotex.SETTINGS_KEY_TRUSTED_CERTIFICATES}.{fingerprint}",
+                {
+                    "display_name": self.server_address_input.text(),
+                    "description": "",
+                }
+            )
+
+        self.start_connect_thread(fingerprint)
+
     def adjust_size(self) -> None:
         self.setFixedSize(350, self.sizeHint().height())
 
@@ -214,6 +245,9 @@ class ConnectWindow(utilities.QCenteredMainWindow):
             self.__connecting_dialog.close()
 
         if session is None:
+            if self.__connect_thread is not None and self.__connect_thread.untrusted_fingerprint is not None:
+                self.review_server_certificate(self.__connect_thread.untrusted_fingerprint)
+
             return
 
         self.session = session
@@ -13,11 +13,9 @@ import logging
 import time
 from typing import List, Optional, Union
 
-from PyQt6.QtCore import QRect, QRectF, QSize, Qt, pyqtSlot
-from PyQt6.QtGui import (QCloseEvent, QImage, QPainter, QPixmap, QResizeEvent,
-                         QScreen, QShowEvent, QTransform)
-from PyQt6.QtWidgets import (QApplication, QDialog, QGraphicsPixmapItem,
-                             QMainWindow, QMessageBox)
+from PyQt6.QtCore import QSize, Qt, QTimer, pyqtSlot
+from PyQt6.QtGui import QCloseEvent, QKeySequence, QScreen, QShortcut, QShowEvent, QTransform
+from PyQt6.QtWidgets import QApplication, QDialog, QMainWindow, QMessageBox
 
 import remotex_viewer.remotex as remotex
 
@@ -26,18 +24,26 @@ import remotex_viewer.ui.dialogs as remotex_dialogs
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_REFRESH_RATE = 60.0  # Hz, when the screen does not report its own
+
 
 class DesktopWindow(QMainWindow):
     def __init__(self, connect_window: Union[QDialog, QMainWindow], session: remotex.Session) -> None:
         super().__init__()
 
-        self.show_fps = False
-
-        self.desktop_graphics_pixmap: Optional[QGraphicsPixmapItem] = None
-        self.desktop_pixmap: Optional[QPixmap] = None
+        self.desktop_item: Optional[remotex_widgets.DesktopItem] = None
 
         self.desktop_thread: Optional[remotex.VirtualDesktopThread] = None
         self.events_thread: Optional[remotex.EventsThread] = None
+        self.clipboard_thread: Optional[remotex.ClipboardThread] = None
+        self.file_transfer_thread: Optional[remotex.FileTransferThread] = None
+
+        self.scene_timer = remotex.SPANS.timer("Scene")
+
+        # Desktop thread composites tiles as they arrive, the view only repaints what changed once per display refresh
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.refresh_timer.timeout.connect(self.present)
 
         self.session = session
 
@@ -60,22 +66,39 @@ class DesktopWindow(QMainWindow):
         self.setContentsMargins(0, 0, 0, 0)
 
         self.tangent_universe = remotex_widgets.TangentUniverse()
+        if session.option_opengl_viewport:
+            self.tangent_universe.use_opengl_viewport()
+        if session.option_cursor_prediction and not session.presentation:
+            self.tangent_universe.set_cursor_prediction(session.option_cursor_smoothing / 1000)
+        self.tangent_universe.resized.connect(self.fit_scene)
         self.setCentralWidget(self.tangent_universe)
 
-        # FPS Counter (Debugging)
-        if self.show_fps:
-            self.FPS_counter = 0
-            self.FPS_Elapsed = time.time()
+        # File Transfer Panel (hidden until toggled, its thread is only started on first use)
+        self.transfer_panel = remotex_widgets.TransferPanel(self)
+        self.transfer_panel.hide()
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.transfer_panel)
 
-        self.start_desktop_thread()
+        self.transfer_panel_shortcut = QShortcut(QKeySequence("Ctrl+Shift+F"), self)
+        self.transfer_panel_shortcut.setContext(Qt.ShortcutContext.WindowShortcut)
+        self.transfer_panel_shortcut.activated.connect(self.toggle_transfer_panel)
 
-    def update_fps(self):
-        self.FPS_counter += 1
-        elapsed = time.time() - self.FPS_Elapsed
-        if elapsed >= 1.0:
-            self.setWindowTitle(f"{self.window_title} - FPS: {self.FPS_counter}")
-            self.FPS_counter = 0
-            self.FPS_Elapsed = time.time()
+        # Performance Overlay (statistics are only sampled while it is shown)
+        self.performance_overlay = remotex_widgets.PerformanceOverlay(self.tangent_universe)
+        self.statistics: Optional[remotex.PipelineStatistics] = None
+
+        self.statistics_timer = QTimer(self)
+        self.statistics_timer.timeout.connect(self.sample_statistics)
+
+        self.performance_overlay_shortcut = QShortcut(QKeySequence("Ctrl+Shift+P"), self)
+        self.performance_overlay_shortcut.setContext(Qt.ShortcutContext.WindowShortcut)
+        self.performance_overlay_shortcut.activated.connect(self.toggle_performance_overlay)
+
+        # Desktop pipeline timeline of this session, on both ends (see remotex/tracing.py)
+        self.tracing_shortcut = QShortcut(QKeySequence("Ctrl+Shift+T"), self)
+        self.tracing_shortcut.setContext(Qt.ShortcutContext.WindowShortcut)
+        self.tracing_shortcut.activated.connect(self.toggle_tracing)
+
+        self.start_desktop_thread()
 
     def thread_finished(self, on_error: bool) -> None:
         """ Handle the thread finished event """
@@ -90,14 +113,17 @@ class DesktopWindow(QMainWindow):
         self.stop_desktop_thread()
 
         self.desktop_thread = remotex.VirtualDesktopThread(self.session)
-        self.desktop_thread.received_dirty_rect_signal.connect(self.update_scene)
         self.desktop_thread.open_cellar_door.connect(self.open_cellar_door)
         self.desktop_thread.thread_finished.connect(self.thread_finished)
+        self.desktop_thread.connection_lost.connect(self.connection_lost)
+        self.desktop_thread.connection_resumed.connect(self.connection_resumed)
 
         self.desktop_thread.start_events_worker_signal.connect(self.start_events_thread)
         self.desktop_thread.start()
 
     def stop_desktop_thread(self) -> None:
+        self.refresh_timer.stop()
+
         if self.desktop_thread is None:
             return
 
@@ -122,11 +148,14 @@ class DesktopWindow(QMainWindow):
 
         self.events_thread = remotex.EventsThread(self.session)
         self.events_thread.thread_finished.connect(self.thread_finished)
+        self.events_thread.desktop_active_changed.connect(self.desktop_active_changed)
         self.events_thread.start()
 
         # Assign our events thread to the Tangent Universe
         self.tangent_universe.set_event_thread(self.events_thread)
 
+        self.start_clipboard_thread()
+
     def stop_events_thread(self) -> None:
         if self.events_thread is None:
             return
@@ -137,12 +166,161 @@ class DesktopWindow(QMainWindow):
 
         self.events_thread = None
 
+    def start_clipboard_thread(self) -> None:
+        """ Clipboard thread shares the clipboard on its own low priority channel, only when both this viewer and the
+            server allow it. Losing it never ends the session. """
+        self.stop_clipboard_thread()
+
+        if self.session.effective_clipboard_mode == remotex.ClipboardMode.Disabled:
+            return
+
+        self.clipboard_thread = remotex.ClipboardThread(self.session)
+        self.clipboard_thread.thread_finished.connect(self.clipboard_thread_finished)
+        self.clipboard_thread.start()
+
+        self.tangent_universe.set_clipboard_thread(self.clipboard_thread)
+
+    def stop_clipboard_thread(self) -> None:
+        if self.clipboard_thread is None:
+            return
+
+        self.tangent_universe.set_clipboard_thread(None)
+
+        if self.clipboard_thread.isRunning():
+            self.clipboard_thread.stop()
+            self.clipboard_thread.wait()
+
+        self.clipboard_thread = None
+
+    @pyqtSlot(bool)
+    def clipboard_thread_finished(self, on_error: bool) -> None:
+        if on_error:
+            logger.warning("Clipboard sharing stopped, see console output for more information.")
+
+    def toggle_transfer_panel(self) -> None:
+        """ Show or hide the file transfer panel, transfers carry on while it is hidden """
+        if self.transfer_panel.isVisible():
+            self.transfer_panel.hide()
+
+            return
+
+        if self.file_transfer_thread is None:
+            self.start_file_transfer_thread()
+
+        self.transfer_panel.show()
+
+    def toggle_performance_overlay(self) -> None:
+        """ Show or hide the desktop pipeline statistics, history starts over each time they are shown """
+        if self.performance_overlay.isVisible():
+            self.statistics_timer.stop()
+            self.performance_overlay.hide()
+            self.statistics = None
+
+            return
+
+        self.statistics = remotex.PipelineStatistics()
+        self.sample_statistics()
+        self.performance_overlay.show()
+        self.statistics_timer.start(int(remotex.STATISTICS_INTERVAL * 1000))
+
+    def sample_statistics(self) -> None:
+        if self.statistics is None or self.desktop_thread is None:
+            return
+
+        counters = self.desktop_thread.statistics()
+        self.statistics.sample(counters, self.session.link.report()["Rtt"], time.monotonic())
+
+        encoding = self.session.option_tile_encoding
+        codec = encoding.name
+        if encoding != remotex.TileEncoding.Jpeg:
+            codec += f" {self.session.option_pixel_format.name}"
+        title = f"{codec} - Quality {self.session.option_image_quality} - Scale 1/{counters['Reduction']}"
+
+        self.performance_overlay.render_statistics(self.statistics, title)
+
+    def toggle_tracing(self) -> None:
+        """ Start or stop tracing the session, the server traces along and both write their trace when it stops """
+        if self.session.tracer.enabled:
+            if self.desktop_thread is not None:
+                self.desktop_thread.request_trace(False)
+            path = self.session.stop_tracing()
+            self.setWindowTitle(self.window_title)
+            QMessageBox.information(self, "Trace", f"Viewer trace written to {path}, the server wrote its own.\n"
+                                                   "Merge them with tools/trace_merge.py.")
+
+            return
+
+        self.session.tracer.start()
+        if self.desktop_thread is not None:
+            self.desktop_thread.request_trace(True)
+        self.setWindowTitle(f"{self.window_title} - Tracing")
+
+    def start_file_transfer_thread(self) -> None:
+        """ File transfer thread runs on a connection of its own attached to the session, only when the server
+            accepts file transfers and not in presentation mode. Losing it never ends the session. """
+        self.stop_file_transfer_thread()
+
+        if not self.session.file_transfer or self.session.presentation:
+            self.transfer_panel.setWindowTitle("File Transfer - Not available on this server")
+
+            return
+
+        self.file_transfer_thread = remotex.FileTransferThread(self.session)
+        self.file_transfer_thread.thread_finished.connect(self.file_transfer_thread_finished)
+        self.file_transfer_thread.start()
+
+        self.transfer_panel.set_transfer_thread(self.file_transfer_thread)
+
+    def stop_file_transfer_thread(self) -> None:
+        if self.file_transfer_thread is None:
+            return
+
+        self.transfer_panel.set_transfer_thread(None)
+
+        if self.file_transfer_thread.isRunning():
+            self.file_transfer_thread.stop()
+            self.file_transfer_thread.wait()
+
+        self.file_transfer_thread = None
+
+    @pyqtSlot(bool)
+    def file_transfer_thread_finished(self, on_error: bool) -> None:
+        if on_error:
+            logger.warning("File transfer stopped, see console output for more information.")
+
+    @pyqtSlot(bool)
+    def desktop_active_changed(self, active: bool) -> None:
+        """ Reflect the remote desktop state (e.g. locked or secure desktop not reachable) in the window title """
+        self.setWindowTitle(self.window_title if active else f"{self.window_title} - Desktop Inactive")
+
+    @pyqtSlot()
+    def connection_lost(self) -> None:
+        """ Session connection dropped, workers are resuming it: keep the last known desktop on screen meanwhile """
+        self.setWindowTitle(f"{self.window_title} - Reconnecting...")
+
+    @pyqtSlot()
+    def connection_resumed(self) -> None:
+        self.setWindowTitle(self.window_title)
+
     def close_cellar_door(self) -> None:
         """ Collapse Tangent Universe to Main Branch, We were able to save the world before 28:06:42:12 """
+
+        # Workers are told to stop first so that none takes the session connection closing for a lost link, closing
+        # the session then interrupts a resume in progress that they would otherwise wait for
+        for thread in (self.desktop_thread, self.events_thread, self.clipboard_thread, self.file_transfer_thread):
+            if thread is not None:
+                thread.stop()
+
+        self.session.close()
+
         self.stop_desktop_thread()
 
         self.stop_events_thread()
 
+        self.stop_clipboard_thread()
+
+        self.stop_file_transfer_thread()
+
     def showEvent(self, event: Optional[QShowEvent]) -> None:
         super().showEvent(event)
 
@@ -168,12 +346,12 @@ class DesktopWindow(QMainWindow):
 
         self.tangent_universe.reset_scene()
 
-        self.desktop_pixmap = QPixmap(screen.size())
-        self.desktop_pixmap.fill(Qt.GlobalColor.black)
+        if self.desktop_thread is None:
+            return
 
-        self.desktop_graphics_pixmap = QGraphicsPixmapItem(self.desktop_pixmap)
+        self.desktop_item = remotex_widgets.DesktopItem(self.desktop_thread.compositor, self.session.tracer)
 
-        self.tangent_universe.desktop_scene.addItem(self.desktop_graphics_pixmap)
+        self.tangent_universe.desktop_scene.addItem(self.desktop_item)
         self.tangent_universe.set_screen(screen)
 
         # Initialize the size of virtual desktop window regarding our current monitor screen size
@@ -223,13 +401,14 @@ class DesktopWindow(QMainWindow):
             new_height
         )
 
+        self.fit_scene()
+
+        refresh_rate = local_screen.refreshRate() or DEFAULT_REFRESH_RATE
+        self.refresh_timer.start(max(1, int(1000 / refresh_rate)))
+
     def fit_scene(self) -> None:
-        """ Fit the scene (Hacky Technique) to the view """
-        if (
-                self.tangent_universe is None or
-                self.desktop_graphics_pixmap is None or
-                self.desktop_pixmap is None
-        ):
+        """ Fit the scene (Hacky Technique) to the view, only needed when the view or the remote screen is resized """
+        if self.tangent_universe is None or self.desktop_item is None:
             return
 
         # Instead of bellow code:
@@ -237,50 +416,50 @@ class DesktopWindow(QMainWindow):
         # We will calculate the scale factor manually to avoid the aspect ratio issue and fitting correctly the view to
         # our virtual desktop host window.
         view_rect = self.tangent_universe.frameRect()
+        desktop_size = self.desktop_item.desktop_size
+        if desktop_size.isEmpty():
+            return
 
-        scale_x = view_rect.width() / self.desktop_pixmap.width()
-        scale_y = view_rect.height() / self.desktop_pixmap.height()
+        scale_x = view_rect.width() / desktop_size.width()
+        scale_y = view_rect.height() / desktop_size.height()
 
         transform = QTransform()
         transform.scale(scale_x, scale_y)
         self.tangent_universe.setTransform(transform, False)
 
+        # Decode no more detail than the view (in device pixels) can show
+        if self.desktop_thread is not None:
+            device_scale = max(scale_x, scale_y) * self.devicePixelRatioF()
+            self.desktop_thread.set_reduction(max(
+                reduction for reduction in remotex.DESKTOP_REDUCTIONS if reduction == 1 or reduction * device_scale <= 1
+            ))
+
         self.tangent_universe.setSceneRect(
             0,
             0,
-            self.desktop_pixmap.width(),
-            self.desktop_pixmap.height(),
+            desktop_size.width(),
+            desktop_size.height(),
         )
 
-    def update_scene(self, chunk: QImage, x: int, y: int) -> None:
-        """ Update the virtual desktop with the received chunk """
-        if self.desktop_pixmap is None or self.desktop_graphics_pixmap is None:
+    def present(self) -> None:
+        """ Once per display refresh: invalidate the union of what the desktop thread composited since the previous
+            refresh, the view then repaints that area only """
+        if self.desktop_thread is None or self.desktop_item is None:
             return
 
-        if chunk is None or not isinstance(chunk, QImage):
-            return
-
-        # Update the virtual desktop with the received chunk (Tangent Universe)
-        dirty_rect = QRect(x, y, chunk.width(), chunk.height())
-
-        painter = QPainter(self.desktop_pixmap)
-        painter.setClipRect(dirty_rect)
-        painter.drawImage(dirty_rect, chunk)
-        painter.end()
+        tracing = self.session.tracer.enabled
+        started = time.perf_counter() if tracing else 0.0
 
-        # Update the scene with the updated virtual desktop
-        self.desktop_graphics_pixmap.setPixmap(self.desktop_pixmap)
-        self.desktop_graphics_pixmap.update(QRectF(dirty_rect))
-
-        self.fit_scene()
+        dirty_rects = self.desktop_thread.compositor.take_dirty()
+        if not dirty_rects:
+            return
 
-        # FPS Counter (Debugging)
-        if self.show_fps:
-            self.update_fps()
+        self.scene_timer.start()
+        for dirty_rect in dirty_rects:
+            self.desktop_item.invalidate(dirty_rect)
+        self.scene_timer.mark("invalidate")
 
-    def resizeEvent(self, event: Optional[QResizeEvent]) -> None:
-        """ Overridden resizeEvent method to fit the scene to the view """
-        self.fit_scene()
-        super().resizeEvent(event)
+        if tracing:
+            self.session.tracer.span("present", started, time.perf_counter(), self.desktop_thread.presented_trace())
 
 
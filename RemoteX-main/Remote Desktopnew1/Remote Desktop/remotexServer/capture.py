@@ -0,0 +1,391 @@
+# Frame sources of the desktop stream. The server captures the real screen and injects the viewer input through the
+# Windows API by default; benchmarks (and replays of recorded workloads) plug another source in:
+#
+#   RemotexServer(password, capture_source=SyntheticCaptureSource(1920, 1080, "typing"))
+#
+# Real workloads are recorded from a live server by wrapping its source in a RecordingCaptureSource and replayed
+# with a ReplayCaptureSource (see corpus.py).
+#
+# A source is shared by every desktop worker: `capture` must be thread safe and return a new image object whenever
+# the content changed (workers keep the previous image to find the changed tiles).
+import threading
+import time
+from bisect import bisect_right
+
+from PIL import Image, ImageDraw
+
+from clipboard import MemoryClipboard, create_clipboard
+from corpus import CorpusReader
+from protocol import MouseState, OutputEvent
+
+# Latency stamp: the low 16 bits of the wall clock in milliseconds, one black or white STAMP_CELL square per bit in the
+# top left corner of synthetic frames. Cells are aligned on the 8x8 JPEG blocks so that they survive any quality and
+# the stamp fits in the smallest tile (32x32).
+STAMP_CELL = 8
+STAMP_BITS = 16
+STAMP_COLUMNS = 4
+STAMP_SIZE = STAMP_CELL * STAMP_COLUMNS
+
+WORKLOADS = ("idle", "typing", "scrolling", "video")
+
+# Content updates per second offered by each synthetic workload
+WORKLOAD_RATES = {
+    "idle": 0,
+    "typing": 10,
+    "scrolling": 60,
+    "video": 30,
+}
+
+VIDEO_LOOP_FRAMES = 30
+TYPING_GLYPH = (8, 16)
+SCROLL_STEP = 4
+
+
+def stamp_clock():
+    return int(time.time() * 1000) & 0xFFFF
+
+
+def stamp_frame(image, value):
+    draw = ImageDraw.Draw(image)
+    for bit in range(STAMP_BITS):
+        x = (bit % STAMP_COLUMNS) * STAMP_CELL
+        y = (bit // STAMP_COLUMNS) * STAMP_CELL
+        color = (255, 255, 255) if value >> bit & 1 else (0, 0, 0)
+        draw.rectangle((x, y, x + STAMP_CELL - 1, y + STAMP_CELL - 1), fill=color)
+
+
+def read_stamp(image):
+    """Stamp of a decoded tile whose top left corner is the screen origin"""
+    gray = image.convert("L")
+    value = 0
+    for bit in range(STAMP_BITS):
+        x = (bit % STAMP_COLUMNS) * STAMP_CELL + STAMP_CELL // 2
+        y = (bit // STAMP_COLUMNS) * STAMP_CELL + STAMP_CELL // 2
+        if gray.getpixel((x, y)) > 127:
+            value |= 1 << bit
+    return value
+
+
+def stamp_age(value, now=None):
+    """Milliseconds elapsed since a stamp was taken (valid up to 65 seconds)"""
+    if now is None:
+        now = stamp_clock()
+    return (now - value) & 0xFFFF
+
+
+class CaptureSource:
+    clipboard = None # Clipboard shared with the viewers (clipboard.py), None when not supported
+
+    def capture(self):
+        raise NotImplementedError
+
+    def mouse_move(self, x, y):
+        pass
+
+    def mouse_click(self, x, y, button, down):
+        pass
+
+    def mouse_wheel(self, delta):
+        pass
+
+    def text(self, keys):
+        pass
+
+    def cursor(self):
+        """(x, y, shape) of the cursor, shape is a MouseCursorKind name. None when unknown"""
+        return None
+
+    def close(self):
+        pass
+
+
+class ScreenCaptureSource(CaptureSource):
+    """Primary screen and input injection of the machine running the server"""
+
+    def __init__(self):
+        # Imported here: the module talks to user32 as soon as it is loaded, other sources run on any platform
+        import desktop
+        self.desktop = desktop
+        self.clipboard = create_clipboard()
+
+    def capture(self):
+        return self.desktop.capture_screen()
+
+    def mouse_move(self, x, y):
+        self.desktop.simulate_mouse_move(x, y)
+
+    def mouse_click(self, x, y, button, down):
+        self.desktop.simulate_mouse_click(x, y, button, down)
+
+    def mouse_wheel(self, delta):
+        self.desktop.simulate_mouse_wheel(delta)
+
+    def text(self, keys):
+        self.desktop.simulate_text(keys)
+
+    def cursor(self):
+        return self.desktop.cursor_state()
+
+
+class SyntheticCaptureSource(CaptureSource):
+    """Deterministic desktop-like content for benchmarks. The content only depends on time (WORKLOAD_RATES updates
+    per second), so several viewers see the same frames, and each update is stamped for latency measurement.
+
+    idle: static desktop. typing: one glyph per update on a text line with a caret. scrolling: a document scrolled by
+    SCROLL_STEP pixels per update over most of the screen. video: a looping moving picture over a third of the width."""
+
+    def __init__(self, width, height, workload="idle", seed=1):
+        if workload not in WORKLOADS:
+            raise ValueError(f"Unknown workload {workload}, expected one of {', '.join(WORKLOADS)}")
+
+        self.width = width
+        self.height = height
+        self.workload = workload
+        self.rate = WORKLOAD_RATES[workload]
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.tick = -1
+        self.frame = None
+        self.events = 0
+        self.pointer = None # Last position injected by a viewer, the cursor follows it
+        self.clipboard = MemoryClipboard()
+
+        self.background = self.render_background()
+        self.base = self.background.copy()
+        if workload == "scrolling":
+            self.document = self.render_document()
+        elif workload == "video":
+            self.video = self.render_video()
+
+    def render_background(self):
+        image = Image.new("RGB", (self.width, self.height), (32, 72, 120))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, self.height - 40, self.width, self.height), fill=(24, 24, 24)) # Taskbar
+        for index in range(8):
+            x = 24 + (index % 2) * 96
+            y = 64 + (index // 2) * 96
+            draw.rectangle((x, y, x + 48, y + 48), fill=(200, 180 - index * 12, 80 + index * 16)) # Icons
+        window = (self.width // 6, self.height // 8, self.width * 5 // 6, self.height * 7 // 8)
+        draw.rectangle(window, fill=(250, 250, 250), outline=(90, 90, 90))
+        draw.rectangle((window[0], window[1], window[2], window[1] + 28), fill=(220, 220, 230))
+        return image
+
+    def window_area(self):
+        return self.width // 6 + 8, self.height // 8 + 36, self.width * 5 // 6 - 8, self.height * 7 // 8 - 8
+
+    def render_document(self):
+        left, top, right, bottom = self.window_area()
+        width = right - left
+        document = Image.new("RGB", (width, (bottom - top) * 4), (255, 255, 255))
+        draw = ImageDraw.Draw(document)
+        for line, y in enumerate(range(8, document.height - 16, 20)):
+            x = 8
+            words = 3 + (line * 7 + self.seed) % 9
+            for word in range(words):
+                length = 24 + (line * 13 + word * 29 + self.seed) % 64
+                if x + length > width - 8:
+                    break
+                draw.rectangle((x, y, x + length, y + 10), fill=(40, 40, 40 + (word * 40) % 160))
+                x += length + 10
+        return document
+
+    def render_video(self):
+        width = max(STAMP_SIZE, self.width // 3)
+        height = width * 9 // 16
+        noise = Image.effect_noise((width, height), 24)
+        frames = []
+        for index in range(VIDEO_LOOP_FRAMES):
+            phase = index / VIDEO_LOOP_FRAMES
+            gradient = Image.linear_gradient("L").resize((width, height)).rotate(phase * 360)
+            red = Image.blend(gradient, noise, 0.3)
+            green = Image.blend(gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), noise, 0.3)
+            blue = Image.blend(noise, gradient, 0.5)
+            frame = Image.merge("RGB", (red, green, blue))
+            draw = ImageDraw.Draw(frame)
+            x = int(phase * (width - 64))
+            draw.ellipse((x, height // 3, x + 64, height // 3 + 64), fill=(250, 220, 40))
+            frames.append(frame)
+        return frames
+
+    def capture(self):
+        tick = 0 if self.rate == 0 else int((time.monotonic() - self.started) * self.rate)
+        with self.lock:
+            if tick != self.tick:
+                self.tick = tick
+                self.frame = self.render(tick)
+            return self.frame
+
+    def render(self, tick):
+        left, top, right, bottom = self.window_area()
+
+        if self.workload == "typing":
+            glyph_width, glyph_height = TYPING_GLYPH
+            per_line = max(1, (right - left - 16) // (glyph_width + 2))
+            lines = max(1, (bottom - top - 16) // (glyph_height + 8))
+            position = tick % (per_line * lines)
+            if position == 0:
+                self.base = self.background.copy()
+
+            draw = ImageDraw.Draw(self.base)
+            x = left + 8 + (position % per_line) * (glyph_width + 2)
+            y = top + 8 + (position // per_line) * (glyph_height + 8)
+            shade = (tick * 37) % 120
+            draw.rectangle((x, y + 4, x + glyph_width - 1, y + glyph_height - 1), fill=(shade, shade, shade))
+            frame = self.base.copy()
+            caret_x = x + glyph_width + 1
+            if tick % 2:
+                ImageDraw.Draw(frame).line((caret_x, y, caret_x, y + glyph_height), fill=(0, 0, 0))
+
+        elif self.workload == "scrolling":
+            frame = self.background.copy()
+            span = self.document.height - (bottom - top)
+            offset = (tick * SCROLL_STEP) % max(1, span)
+            frame.paste(self.document.crop((0, offset, right - left, offset + bottom - top)), (left, top))
+
+        elif self.workload == "video":
+            frame = self.background.copy()
+            clip = self.video[tick % len(self.video)]
+            frame.paste(clip, ((self.width - clip.width) // 2, (self.height - clip.height) // 2))
+
+        else:
+            frame = self.background.copy()
+
+        stamp_frame(frame, stamp_clock())
+        return frame
+
+    def mouse_move(self, x, y):
+        self.events += 1
+        self.pointer = (x, y)
+
+    def mouse_click(self, x, y, button, down):
+        self.events += 1
+        self.pointer = (x, y)
+
+    def mouse_wheel(self, delta):
+        self.events += 1
+
+    def text(self, keys):
+        self.events += 1
+
+    def cursor(self):
+        if self.pointer is None:
+            return None
+
+        # Held inside the screen like a real cursor, a text cursor over the window
+        x = min(max(self.pointer[0], 0), self.width - 1)
+        y = min(max(self.pointer[1], 0), self.height - 1)
+        left, top, right, bottom = self.window_area()
+        return x, y, "IDC_IBEAM" if left <= x < right and top <= y < bottom else "IDC_ARROW"
+
+
+class RecordingCaptureSource(CaptureSource):
+    """Write the frames and input of another source to a workload corpus (corpus.CorpusWriter). A frame is written
+    when its content differs from the last written one, at most `max_fps` times per second."""
+
+    def __init__(self, source, writer, max_fps=30):
+        self.source = source
+        self.writer = writer
+        self.interval = 1 / max_fps if max_fps else 0
+        self.lock = threading.Lock()
+        self.last_image = None
+        self.last_pixels = None
+        self.last_write = 0.0
+        self.clipboard = source.clipboard
+
+    def capture(self):
+        image = self.source.capture()
+        with self.lock:
+            now = time.monotonic()
+            if image is self.last_image or now - self.last_write < self.interval:
+                return image
+
+            self.last_image = image
+            pixels = (image if image.mode == "RGB" else image.convert("RGB")).tobytes()
+            if pixels != self.last_pixels:
+                self.writer.write_frame(image.width, image.height, pixels)
+                self.last_pixels = pixels
+                self.last_write = now
+        return image
+
+    def mouse_move(self, x, y):
+        self.writer.write_event({"Id": OutputEvent.MouseClickMove.value, "Type": MouseState.Move.value, "X": x, "Y": y})
+        self.source.mouse_move(x, y)
+
+    def mouse_click(self, x, y, button, down):
+        self.writer.write_event({
+            "Id": OutputEvent.MouseClickMove.value,
+            "Type": (MouseState.Down if down else MouseState.Up).value,
+            "X": x,
+            "Y": y,
+            "Button": button,
+        })
+        self.source.mouse_click(x, y, button, down)
+
+    def mouse_wheel(self, delta):
+        self.writer.write_event({"Id": OutputEvent.MouseWheel.value, "Delta": delta})
+        self.source.mouse_wheel(delta)
+
+    def text(self, keys):
+        self.writer.write_event({"Id": OutputEvent.Keyboard.value, "Keys": keys})
+        self.source.text(keys)
+
+    def cursor(self):
+        return self.source.cursor()
+
+    def close(self):
+        self.source.close()
+        self.writer.close()
+
+
+class ReplayCaptureSource(CaptureSource):
+    """Frames of a recorded corpus at their original pace times `speed`, looping at the end. Only the current frame
+    is in memory. Frames are latency stamped like synthetic ones unless `stamp` is False; the recorded input events
+    are replayed by the viewer side (CorpusReader.events)."""
+
+    def __init__(self, path, speed=1.0, loop=True, stamp=True):
+        self.corpus = CorpusReader(path)
+        self.speed = speed
+        self.loop = loop
+        self.stamp = stamp
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.index = None
+        self.frame = None
+        self.events = 0
+        self.clipboard = MemoryClipboard()
+
+    @property
+    def size(self):
+        return self.corpus.size
+
+    def capture(self):
+        position = (time.monotonic() - self.started) * self.speed
+        if self.loop and self.corpus.duration > 0:
+            position %= self.corpus.duration
+        index = max(0, bisect_right(self.corpus.frame_times, position * 1000000) - 1)
+
+        with self.lock:
+            if index != self.index:
+                self.index = index
+                width, height, pixels = self.corpus.frame(index)
+                frame = Image.frombytes("RGB", (width, height), pixels)
+                if self.stamp:
+                    stamp_frame(frame, stamp_clock())
+                self.frame = frame
+            return self.frame
+
+    def mouse_move(self, x, y):
+        self.events += 1
+
+    def mouse_click(self, x, y, button, down):
+        self.events += 1
+
+    def mouse_wheel(self, delta):
+        self.events += 1
+
+    def text(self, keys):
+        self.events += 1
+
+    def close(self):
+        self.corpus.close()
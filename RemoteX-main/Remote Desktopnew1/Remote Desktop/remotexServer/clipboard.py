@@ -0,0 +1,424 @@
+# Clipboard sharing. Clipboard contents travel on the Clipboard channel, the lowest priority one of the multiplexed
+# connection: a large image never delays input or desktop frames, it only fills the link when nothing else waits.
+#
+# Channel protocol (both directions):
+#   Viewer hello: {"Mode": <ClipboardMode value of the viewer>}, server reply: {"Mode": <effective mode>}, the
+#   intersection of both settings (modes are expressed from the viewer point of view, Send: viewer to server).
+#   Then any number of transfers, each a JSON header line
+#     {"Digest": <content digest>, "Formats": [[<mime type>, <size>], ...]}
+#   followed by CHUNK_HEADER (length, flags) + data chunks, at most CHUNK_SIZE bytes of content each and compressed
+#   independently when worth it. A chunk flagged FLAG_END completes the transfer, FLAG_CANCELLED abandons it (the
+#   clipboard changed again meanwhile, only the newest content matters).
+#
+# Each side remembers the digest of what the other side holds (ClipboardSync): a change already known remotely (the
+# same copy made twice, or the echo of content just received) is never sent back.
+import hashlib
+import io
+import json
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from protocol import ClipboardMode
+
+FORMAT_TEXT = "text/plain"
+FORMAT_HTML = "text/html"
+FORMAT_RTF = "text/rtf"
+FORMAT_PNG = "image/png"
+FORMATS = (FORMAT_TEXT, FORMAT_HTML, FORMAT_RTF, FORMAT_PNG)
+
+CHUNK_HEADER = struct.Struct("!IB")
+CHUNK_SIZE = 65536
+FLAG_COMPRESSED = 0x1
+FLAG_END = 0x2
+FLAG_CANCELLED = 0x4
+
+COMPRESSION_LEVEL = 6
+UNCOMPRESSED_FORMATS = (FORMAT_PNG,) # Already compressed
+MAX_CLIPBOARD_SIZE = 67108864 # Larger contents are not shared
+ECHO_WINDOW = 1.0 # Seconds during which a local change right after applying remote content is taken for its echo
+
+
+class ClipboardError(Exception):
+    pass
+
+
+def allows_send(mode):
+    """Viewer clipboard may be sent to the server"""
+    return mode in (ClipboardMode.Send, ClipboardMode.Both)
+
+
+def allows_receive(mode):
+    """Server clipboard may be sent to the viewer"""
+    return mode in (ClipboardMode.Receive, ClipboardMode.Both)
+
+
+def combine_modes(first, second):
+    send = allows_send(first) and allows_send(second)
+    receive = allows_receive(first) and allows_receive(second)
+    if send and receive:
+        return ClipboardMode.Both
+    if send:
+        return ClipboardMode.Send
+    if receive:
+        return ClipboardMode.Receive
+    return ClipboardMode.Disabled
+
+
+def parse_mode(value, default=ClipboardMode.Disabled):
+    try:
+        return ClipboardMode(value)
+    except ValueError:
+        return default
+
+
+def content_digest(formats):
+    digest = hashlib.sha256()
+    for mime in sorted(formats):
+        data = formats[mime]
+        digest.update(mime.encode() + b"\0" + len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()[:32]
+
+
+def recv_exact(conn, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError("Clipboard channel closed")
+        data += chunk
+    return bytes(data)
+
+
+def send_transfer(conn, formats, digest, superseded=None):
+    """Send a clipboard content (mime type -> bytes), return False when `superseded()` turned true meanwhile"""
+    header = {"Digest": digest, "Formats": [[mime, len(data)] for mime, data in formats.items()]}
+    conn.sendall(json.dumps(header).encode() + b"\n")
+
+    for mime, data in formats.items():
+        view = memoryview(data)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            if superseded is not None and superseded():
+                conn.sendall(CHUNK_HEADER.pack(0, FLAG_CANCELLED))
+                return False
+
+            chunk = view[offset:offset + CHUNK_SIZE]
+            flags = 0
+            if mime not in UNCOMPRESSED_FORMATS:
+                compressed = zlib.compress(chunk, COMPRESSION_LEVEL)
+                if len(compressed) < len(chunk):
+                    chunk, flags = compressed, FLAG_COMPRESSED
+            conn.sendall(CHUNK_HEADER.pack(len(chunk), flags) + chunk)
+
+    conn.sendall(CHUNK_HEADER.pack(0, FLAG_END))
+    return True
+
+
+def read_transfer(conn):
+    """(digest, formats) of the next transfer read from a buffered socket, None when it was cancelled or refused (too
+    large)"""
+    header = json.loads(conn.read_line())
+    entries = [(str(mime), int(size)) for mime, size in header.get("Formats", [])]
+    total = sum(size for _, size in entries)
+    refused = total > MAX_CLIPBOARD_SIZE or any(size < 0 for _, size in entries)
+
+    data = bytearray()
+    while True:
+        length, flags = CHUNK_HEADER.unpack(recv_exact(conn, CHUNK_HEADER.size))
+        if flags & FLAG_CANCELLED:
+            return None
+        if flags & FLAG_END:
+            break
+
+        chunk = recv_exact(conn, length)
+        if refused:
+            continue # Drained, the channel stays usable
+
+        if flags & FLAG_COMPRESSED:
+            decompressor = zlib.decompressobj()
+            chunk = decompressor.decompress(chunk, CHUNK_SIZE)
+            if decompressor.unconsumed_tail:
+                raise ClipboardError("Clipboard chunk larger than announced")
+        if len(data) + len(chunk) > total:
+            raise ClipboardError("Clipboard content larger than announced")
+        data += chunk
+
+    if refused:
+        print(f"Clipboard content of {total} bytes refused (limit {MAX_CLIPBOARD_SIZE})")
+        return None
+    if len(data) != total:
+        raise ClipboardError("Clipboard content shorter than announced")
+
+    formats = {}
+    offset = 0
+    for mime, size in entries:
+        formats[mime] = bytes(data[offset:offset + size])
+        offset += size
+
+    digest = content_digest(formats)
+    if digest != header.get("Digest"):
+        raise ClipboardError("Clipboard content digest mismatch")
+    return digest, formats
+
+
+class ClipboardSync:
+    """What the remote side is known to hold, shared by the threads of one session"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.remote = set()
+        self.echo_deadline = 0.0
+        self.sent = 0
+        self.received = 0
+        self.suppressed = 0
+
+    def outgoing(self, digest):
+        """True when a local content should be sent, False for a duplicate or the echo of a received content"""
+        with self.lock:
+            if digest in self.remote:
+                self.echo_deadline = 0.0
+                self.suppressed += 1
+                return False
+
+            if time.monotonic() < self.echo_deadline:
+                # Local clipboard normalized the content just applied (e.g. re-encoded image): same content remotely
+                self.echo_deadline = 0.0
+                self.remote.add(digest)
+                self.suppressed += 1
+                return False
+
+            self.remote = {digest}
+            self.sent += 1
+            return True
+
+    def applied(self, digest, expect_echo=False):
+        """A remote content was written to the local clipboard"""
+        with self.lock:
+            self.remote = {digest}
+            self.received += 1
+            if expect_echo:
+                self.echo_deadline = time.monotonic() + ECHO_WINDOW
+
+    def report(self):
+        return {"Sent": self.sent, "Received": self.received, "Suppressed": self.suppressed}
+
+
+class MemoryClipboard:
+    """Process local clipboard, used by the synthetic and replay capture sources"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.formats = {}
+        self.sequence_number = 0
+
+    def sequence(self):
+        return self.sequence_number
+
+    def read(self):
+        with self.lock:
+            return dict(self.formats)
+
+    def write(self, formats):
+        """Replace the content, return the sequence number of the change"""
+        with self.lock:
+            self.formats = dict(formats)
+            self.sequence_number += 1
+            return self.sequence_number
+
+
+class WindowsClipboard:
+    """Clipboard of the interactive session: Unicode text, HTML, RTF and device independent bitmaps (shared as PNG)"""
+
+    CF_UNICODETEXT = 13
+    CF_DIB = 8
+    GMEM_MOVEABLE = 0x2
+    OPEN_ATTEMPTS = 10 # Another application may hold the clipboard for a short while
+    OPEN_RETRY_DELAY = 0.02
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+
+        self.ctypes = ctypes
+        self.user32 = ctypes.WinDLL("user32", use_last_error=True)
+        self.kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+
+        self.user32.OpenClipboard.argtypes = [wintypes.HWND]
+        self.user32.OpenClipboard.restype = wintypes.BOOL
+        self.user32.GetClipboardData.argtypes = [wintypes.UINT]
+        self.user32.GetClipboardData.restype = wintypes.HANDLE
+        self.user32.SetClipboardData.argtypes = [wintypes.UINT, wintypes.HANDLE]
+        self.user32.SetClipboardData.restype = wintypes.HANDLE
+        self.user32.IsClipboardFormatAvailable.argtypes = [wintypes.UINT]
+        self.user32.RegisterClipboardFormatW.argtypes = [wintypes.LPCWSTR]
+        self.user32.RegisterClipboardFormatW.restype = wintypes.UINT
+        self.user32.GetClipboardSequenceNumber.restype = wintypes.DWORD
+        self.kernel32.GlobalAlloc.argtypes = [wintypes.UINT, ctypes.c_size_t]
+        self.kernel32.GlobalAlloc.restype = wintypes.HGLOBAL
+        self.kernel32.GlobalLock.argtypes = [wintypes.HGLOBAL]
+        self.kernel32.GlobalLock.restype = wintypes.LPVOID
+        self.kernel32.GlobalUnlock.argtypes = [wintypes.HGLOBAL]
+        self.kernel32.GlobalSize.argtypes = [wintypes.HGLOBAL]
+        self.kernel32.GlobalSize.restype = ctypes.c_size_t
+        self.kernel32.GlobalFree.argtypes = [wintypes.HGLOBAL]
+
+        self.cf_html = self.user32.RegisterClipboardFormatW("HTML Format")
+        self.cf_rtf = self.user32.RegisterClipboardFormatW("Rich Text Format")
+        self.lock = threading.Lock()
+
+    def sequence(self):
+        return self.user32.GetClipboardSequenceNumber()
+
+    def open(self):
+        for _ in range(self.OPEN_ATTEMPTS):
+            if self.user32.OpenClipboard(None):
+                return
+            time.sleep(self.OPEN_RETRY_DELAY)
+        raise ClipboardError("Clipboard is busy")
+
+    def get(self, clipboard_format):
+        if not self.user32.IsClipboardFormatAvailable(clipboard_format):
+            return None
+        handle = self.user32.GetClipboardData(clipboard_format)
+        if not handle:
+            return None
+        pointer = self.kernel32.GlobalLock(handle)
+        if not pointer:
+            return None
+        try:
+            return self.ctypes.string_at(pointer, self.kernel32.GlobalSize(handle))
+        finally:
+            self.kernel32.GlobalUnlock(handle)
+
+    def set(self, clipboard_format, data):
+        handle = self.kernel32.GlobalAlloc(self.GMEM_MOVEABLE, len(data))
+        if not handle:
+            raise ClipboardError("Out of memory")
+        pointer = self.kernel32.GlobalLock(handle)
+        self.ctypes.memmove(pointer, data, len(data))
+        self.kernel32.GlobalUnlock(handle)
+        if not self.user32.SetClipboardData(clipboard_format, handle):
+            # Ownership is only transferred on success
+            self.kernel32.GlobalFree(handle)
+
+    def read(self):
+        with self.lock:
+            self.open()
+            try:
+                text = self.get(self.CF_UNICODETEXT)
+                html = self.get(self.cf_html)
+                rtf = self.get(self.cf_rtf)
+                dib = self.get(self.CF_DIB)
+            finally:
+                self.user32.CloseClipboard()
+
+        formats = {}
+        if text is not None:
+            formats[FORMAT_TEXT] = text.decode("utf-16-le", "replace").split("\0", 1)[0].encode()
+        if html is not None:
+            fragment = html_fragment(html)
+            if fragment is not None:
+                formats[FORMAT_HTML] = fragment
+        if rtf is not None:
+            formats[FORMAT_RTF] = rtf.split(b"\0", 1)[0]
+        if dib is not None:
+            png = dib_to_png(dib)
+            if png is not None:
+                formats[FORMAT_PNG] = png
+        return formats
+
+    def write(self, formats):
+        with self.lock:
+            self.open()
+            try:
+                self.user32.EmptyClipboard()
+                if FORMAT_TEXT in formats:
+                    self.set(self.CF_UNICODETEXT, formats[FORMAT_TEXT].decode("utf-8", "replace").encode("utf-16-le")
+                             + b"\0\0")
+                if FORMAT_HTML in formats:
+                    self.set(self.cf_html, html_document(formats[FORMAT_HTML]))
+                if FORMAT_RTF in formats:
+                    self.set(self.cf_rtf, formats[FORMAT_RTF] + b"\0")
+                if FORMAT_PNG in formats:
+                    dib = png_to_dib(formats[FORMAT_PNG])
+                    if dib is not None:
+                        self.set(self.CF_DIB, dib)
+            finally:
+                self.user32.CloseClipboard()
+            return self.sequence()
+
+
+def create_clipboard():
+    """Clipboard of the machine running the server, None where it is not supported"""
+    if sys.platform != "win32":
+        return None
+    return WindowsClipboard()
+
+
+# "HTML Format" clipboard documents: a header of byte offsets followed by the HTML, the copied part being between the
+# StartFragment and EndFragment offsets.
+HTML_HEADER = ("Version:0.9\r\nStartHTML:{0:010d}\r\nEndHTML:{1:010d}\r\n"
+               "StartFragment:{2:010d}\r\nEndFragment:{3:010d}\r\n")
+HTML_PREFIX = b"<html><body><!--StartFragment-->"
+HTML_SUFFIX = b"<!--EndFragment--></body></html>"
+
+
+def html_fragment(document):
+    offsets = {}
+    for line in document[:512].split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if value.strip().isdigit():
+            offsets[name.decode(errors="replace")] = int(value)
+    start, end = offsets.get("StartFragment"), offsets.get("EndFragment")
+    if start is None or end is None or not 0 <= start <= end <= len(document):
+        return None
+    return document[start:end]
+
+
+def html_document(fragment):
+    length = len(HTML_HEADER.format(0, 0, 0, 0))
+    start_fragment = length + len(HTML_PREFIX)
+    end_fragment = start_fragment + len(fragment)
+    end_html = end_fragment + len(HTML_SUFFIX)
+    header = HTML_HEADER.format(length, end_html, start_fragment, end_fragment).encode()
+    return header + HTML_PREFIX + fragment + HTML_SUFFIX + b"\0"
+
+
+BITMAP_FILE_HEADER = struct.Struct("<2sIHHI")
+BITMAP_INFO_HEADER = struct.Struct("<IiiHHIIiiII")
+BI_BITFIELDS = 3
+
+
+def dib_to_png(dib):
+    from PIL import Image
+
+    try:
+        size, _, _, _, bit_count, compression, _, _, _, colors_used, _ = BITMAP_INFO_HEADER.unpack_from(dib)
+    except struct.error:
+        return None
+
+    palette = colors_used or (1 << bit_count if bit_count <= 8 else 0)
+    masks = 12 if compression == BI_BITFIELDS and size == BITMAP_INFO_HEADER.size else 0
+    offset = BITMAP_FILE_HEADER.size + size + masks + palette * 4
+    bitmap = BITMAP_FILE_HEADER.pack(b"BM", BITMAP_FILE_HEADER.size + len(dib), 0, 0, offset) + dib
+
+    output = io.BytesIO()
+    try:
+        Image.open(io.BytesIO(bitmap)).save(output, "PNG")
+    except (OSError, ValueError):
+        return None
+    return output.getvalue()
+
+
+def png_to_dib(png):
+    from PIL import Image
+
+    output = io.BytesIO()
+    try:
+        Image.open(io.BytesIO(png)).convert("RGB").save(output, "BMP")
+    except (OSError, ValueError):
+        return None
+    return output.getvalue()[BITMAP_FILE_HEADER.size:]
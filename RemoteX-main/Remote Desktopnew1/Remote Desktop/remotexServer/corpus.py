@@ -0,0 +1,138 @@
+# Workload corpora: raw captured frames and the input events injected meanwhile, recorded from a live server
+# (tools/corpus_recorder.py) and replayed by capture.ReplayCaptureSource so that every change of the pipeline can be
+# measured against the same real traffic.
+#
+# <name>.rxc (append-only)
+#   CORPUS_MAGIC, metadata length (uint32) + JSON metadata, then records:
+#   RECORD_HEADER (kind, microseconds since the corpus started, payload size) + payload
+#   FRAME payload: FRAME_HEADER (width, height) + raw RGB pixels, only written when the screen content changed
+#   EVENT payload: the input event as sent by the viewer (JSON)
+#
+# Frames are stored uncompressed so that the reader maps the file and builds one image at a time: replay memory does
+# not grow with the corpus length.
+import json
+import mmap
+import struct
+import threading
+import time
+
+CORPUS_MAGIC = b"RXCRP001"
+METADATA_LENGTH = struct.Struct("!I")
+RECORD_HEADER = struct.Struct("!BQI")
+FRAME_HEADER = struct.Struct("!HH")
+
+RECORD_FRAME = 0x1
+RECORD_EVENT = 0x2
+
+CORPUS_EXTENSION = ".rxc"
+WRITE_BUFFER_SIZE = 8388608
+
+
+class CorpusError(Exception):
+    pass
+
+
+class CorpusWriter:
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.closed = False
+        self.frames = 0
+        self.events = 0
+        self.bytes_written = 0
+
+        self.file = open(path, "xb", buffering=WRITE_BUFFER_SIZE)
+        header = json.dumps(dict(metadata or {}, Started=time.time())).encode()
+        self.file.write(CORPUS_MAGIC + METADATA_LENGTH.pack(len(header)) + header)
+
+    def timestamp(self):
+        return int((time.monotonic() - self.started) * 1000000)
+
+    def _write(self, kind, payload):
+        with self.lock:
+            if self.closed:
+                return
+            self.file.write(RECORD_HEADER.pack(kind, self.timestamp(), len(payload)))
+            self.file.write(payload)
+            self.bytes_written += RECORD_HEADER.size + len(payload)
+
+    def write_frame(self, width, height, pixels):
+        self._write(RECORD_FRAME, FRAME_HEADER.pack(width, height) + pixels)
+        self.frames += 1
+
+    def write_event(self, event):
+        self._write(RECORD_EVENT, json.dumps(event).encode())
+        self.events += 1
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.file.close()
+
+    def report(self):
+        return {
+            "Path": self.path,
+            "Seconds": round(self.timestamp() / 1000000, 3),
+            "Frames": self.frames,
+            "Events": self.events,
+            "BytesWritten": self.bytes_written,
+        }
+
+
+class CorpusReader:
+    """Memory-mapped corpus: frame offsets and events are read once, frame pixels are only read when requested"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:len(CORPUS_MAGIC)] != CORPUS_MAGIC:
+            raise CorpusError("Not a Remotex workload corpus")
+        length, = METADATA_LENGTH.unpack_from(self.data, len(CORPUS_MAGIC))
+        offset = len(CORPUS_MAGIC) + METADATA_LENGTH.size
+        self.metadata = json.loads(bytes(self.data[offset:offset + length]))
+        offset += length
+
+        self.frame_times = [] # Microseconds, sorted
+        self.frame_offsets = []
+        self.events = [] # (seconds, event)
+        self.duration = 0.0
+
+        end = len(self.data)
+        while offset + RECORD_HEADER.size <= end:
+            kind, timestamp, size = RECORD_HEADER.unpack_from(self.data, offset)
+            payload = offset + RECORD_HEADER.size
+            if payload + size > end:
+                break # Corpus cut short
+
+            if kind == RECORD_FRAME:
+                self.frame_times.append(timestamp)
+                self.frame_offsets.append(payload)
+            elif kind == RECORD_EVENT:
+                self.events.append((timestamp / 1000000, json.loads(bytes(self.data[payload:payload + size]))))
+
+            self.duration = timestamp / 1000000
+            offset = payload + size
+
+        if not self.frame_offsets:
+            raise CorpusError("Corpus has no frame")
+
+    @property
+    def size(self):
+        """(width, height) of the first frame"""
+        return FRAME_HEADER.unpack_from(self.data, self.frame_offsets[0])
+
+    def frame(self, index):
+        """(width, height, raw RGB bytes) of a frame"""
+        offset = self.frame_offsets[index]
+        width, height = FRAME_HEADER.unpack_from(self.data, offset)
+        start = offset + FRAME_HEADER.size
+        return width, height, self.data[start:start + width * height * 3]
+
+    def close(self):
+        self.data.close()
+        self._file.close()
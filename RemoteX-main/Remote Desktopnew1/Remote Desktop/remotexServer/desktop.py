@@ -93,3 +93,50 @@ def simulate_text(text):
         
         send_unicode_char(text[i])
         i += 1
+
+# Standard cursors (IDC_* resource ids), named after protocol.MouseCursorKind
+CURSOR_IDS = {
+    32512: "IDC_ARROW",
+    32513: "IDC_IBEAM",
+    32514: "IDC_WAIT",
+    32515: "IDC_CROSS",
+    32516: "IDC_UPARROW",
+    32640: "IDC_SIZE",
+    32641: "IDC_ICON",
+    32642: "IDC_SIZENWSE",
+    32643: "IDC_SIZENESW",
+    32644: "IDC_SIZEWE",
+    32645: "IDC_SIZENS",
+    32646: "IDC_SIZEALL",
+    32648: "IDC_NO",
+    32649: "IDC_HAND",
+    32650: "IDC_APPSTARTING",
+    32651: "IDC_HELP",
+}
+CURSOR_SHOWING = 0x1
+
+class CURSORINFO(ctypes.Structure):
+    _fields_ = [
+        ("cbSize", wintypes.DWORD),
+        ("flags", wintypes.DWORD),
+        ("hCursor", wintypes.HANDLE),
+        ("ptScreenPos", wintypes.POINT),
+    ]
+
+cursor_names = None # Shared cursor handle -> name, loaded on first use
+
+def cursor_state():
+    """Position and standard cursor name of the visible cursor, None when hidden (custom cursors are IDC_ARROW)"""
+    global cursor_names
+    user32 = ctypes.windll.user32
+    if cursor_names is None:
+        user32.LoadCursorW.restype = wintypes.HANDLE
+        user32.LoadCursorW.argtypes = [wintypes.HINSTANCE, wintypes.LPVOID]
+        cursor_names = {user32.LoadCursorW(None, cursor_id): name for cursor_id, name in CURSOR_IDS.items()}
+
+    info = CURSORINFO()
+    info.cbSize = ctypes.sizeof(CURSORINFO)
+    if not user32.GetCursorInfo(ctypes.byref(info)) or not info.flags & CURSOR_SHOWING:
+        return None
+
+    return info.ptScreenPos.x, info.ptScreenPos.y, cursor_names.get(info.hCursor, "IDC_ARROW")
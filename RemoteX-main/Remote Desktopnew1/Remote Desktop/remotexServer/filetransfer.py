@@ -0,0 +1,243 @@
+# File transfers between the viewer and the host. A transfer uses a connection of its own, attached to the session
+# (AttachToSession <session id> FileTransfer): file data then goes straight from the page cache to the socket
+# (os.sendfile on plain TCP, memory-mapped reads otherwise) instead of being copied into multiplexer frames.
+#
+# Requests are JSON lines sent by the viewer, one transfer at a time:
+#   {"Command": "List", "Path": p}
+#       -> {"Path", "Parent", "Separator", "Entries": [{"Name", "Size", "Directory", "Modified"}, ...]}
+#   {"Command": "Download", "Path": p, "Offset": n, "Size": s, "Modified": m}
+#       -> {"Size": s, "Modified": m, "Offset": n} then chunks from the server. Offset is reset to 0 when the file is not
+#          the one (Size, Modified) a previous partial download was made of.
+#   {"Command": "Upload", "Path": p, "Size": s, "Modified": m}
+#       -> {"Offset": n} (verified data kept from an interrupted upload of the same file), then chunks from the viewer,
+#          answered by {"Done": true}
+#   Errors: {"Error": message}, the connection is closed after an error in the middle of the chunks.
+#
+# Chunk: CHUNK_HEADER (file offset, length, CRC-32 of the data) + data, a zero length chunk ends the file. The receiver
+# writes verified chunks to <path>.part and the identity of the source to <path>.part.json, an interrupted transfer
+# resumes from the last verified chunk.
+#
+# Transfers yield to interactive traffic: before each chunk the sender waits (at most YIELD_MAX) while input or desktop
+# data is queued on the session connection, and the transfer socket is marked as low priority traffic.
+import json
+import mmap
+import os
+import socket
+import ssl
+import stat
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from protocol import Channel
+
+CHUNK_HEADER = struct.Struct("!QII")
+CHUNK_SIZE = 4194304
+
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+LOW_PRIORITY_TOS = 0x20 # DSCP CS1, lower effort
+YIELD_INTERVAL = 0.002
+YIELD_MAX = 0.1 # Seconds a chunk may wait for interactive traffic, transfers always progress
+DESKTOP_BACKLOG = 65536 # Queued desktop bytes above which transfers yield (any queued input makes them yield)
+
+
+class TransferError(Exception):
+    pass
+
+
+def low_priority(sock):
+    """Mark the transfer connection as bulk traffic for the network and leave interactive flows ahead of it"""
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, LOW_PRIORITY_TOS)
+    except (OSError, AttributeError):
+        pass
+
+
+def uses_sendfile(sock):
+    # Encrypted data must go through OpenSSL in user space
+    return hasattr(os, "sendfile") and isinstance(sock, socket.socket) and not isinstance(sock, ssl.SSLSocket)
+
+
+def interactive_backlog(multiplexer):
+    """True while the session connection has input or a desktop backlog waiting to be sent"""
+    if multiplexer is None or multiplexer.closed:
+        return False
+    queued = multiplexer.queued_bytes()
+    return queued[Channel.Events] > 0 or queued[Channel.Control] > 0 or queued[Channel.Desktop] > DESKTOP_BACKLOG
+
+
+def yield_to_session(session):
+    deadline = time.monotonic() + YIELD_MAX
+    while interactive_backlog(session.connection) and time.monotonic() < deadline:
+        time.sleep(YIELD_INTERVAL)
+
+
+def resolve_path(path, root=None):
+    """Absolute path of a requested file, confined to `root` when set"""
+    if root is not None:
+        root = os.path.realpath(root)
+        resolved = os.path.realpath(os.path.join(root, path or ""))
+        if os.path.commonpath([resolved, root]) != root:
+            raise TransferError("Path outside of the transfer directory")
+        return resolved
+    return os.path.realpath(os.path.expanduser(path or "~"))
+
+
+def parent_directory(path, root=None):
+    """Directory above `path`, None at the top of the file system (or of `root`)"""
+    parent = os.path.dirname(path)
+    if parent == path or (root is not None and path == os.path.realpath(root)):
+        return None
+    return parent
+
+
+def list_directory(path):
+    entries = []
+    with os.scandir(path) as iterator:
+        for entry in iterator:
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            directory = stat.S_ISDIR(info.st_mode)
+            entries.append({
+                "Name": entry.name,
+                "Size": 0 if directory else info.st_size,
+                "Directory": directory,
+                "Modified": int(info.st_mtime),
+            })
+    entries.sort(key=lambda entry: (not entry["Directory"], entry["Name"].lower()))
+    return entries
+
+
+def recv_exact_into(conn, view):
+    received = 0
+    while received < len(view):
+        count = conn.recv_into(view[received:])
+        if not count:
+            raise EOFError("Transfer connection closed")
+        received += count
+
+
+def send_file(sock, path, offset=0, yield_to=None, progress=None):
+    """Send `path` from `offset` (a chunk boundary) as checksummed chunks, then the end of file chunk. The checksum of a
+    chunk is computed while the previous one is sent (zlib releases the GIL)"""
+    with open(path, "rb") as f, ThreadPoolExecutor(1) as checksums:
+        size = os.fstat(f.fileno()).st_size
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        zero_copy = uses_sendfile(sock)
+
+        def checksum(position):
+            # A file truncated while mapped can't be read past its new end
+            if os.fstat(f.fileno()).st_size < size:
+                raise TransferError("File truncated during the transfer")
+            with memoryview(mapped)[position:position + CHUNK_SIZE] as view:
+                return zlib.crc32(view)
+
+        try:
+            position = offset
+            upcoming = checksums.submit(checksum, position) if position < size else None
+            while upcoming is not None:
+                if yield_to is not None:
+                    yield_to()
+
+                length = min(CHUNK_SIZE, size - position)
+                header = CHUNK_HEADER.pack(position, length, upcoming.result())
+                upcoming = checksums.submit(checksum, position + length) if position + length < size else None
+
+                sock.sendall(header)
+                if zero_copy:
+                    sock.sendfile(f, position, length)
+                else:
+                    with memoryview(mapped)[position:position + length] as view:
+                        sock.sendall(view)
+
+                position += length
+                if progress is not None:
+                    progress(position)
+
+            sock.sendall(CHUNK_HEADER.pack(position, 0, 0))
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+                wait([upcoming])
+            if mapped is not None:
+                mapped.close()
+    return size - offset
+
+
+def receive_chunks(conn, output, offset, size, progress=None):
+    """Write verified chunks to `output` (positioned at `offset`) until the end of file chunk, return the end offset. A
+    chunk is verified and written while the next one is received, in the other of two buffers"""
+    buffers = [memoryview(bytearray(CHUNK_SIZE)) for _ in range(2)]
+    header = memoryview(bytearray(CHUNK_HEADER.size))
+
+    def store(view, position, checksum):
+        if zlib.crc32(view) != checksum:
+            raise TransferError(f"Checksum mismatch at {position}")
+        output.write(view)
+        if progress is not None:
+            progress(position + len(view))
+
+    with ThreadPoolExecutor(1) as writer:
+        pending = None
+        position = offset
+        while True:
+            recv_exact_into(conn, header)
+            chunk_offset, length, checksum = CHUNK_HEADER.unpack(header)
+            if length == 0:
+                if pending is not None:
+                    pending.result()
+                if position != size:
+                    raise TransferError(f"Transfer ended at {position} of {size} bytes")
+                return position
+
+            if chunk_offset != position or length > CHUNK_SIZE or position + length > size:
+                raise TransferError(f"Unexpected chunk at {chunk_offset} ({length} bytes)")
+
+            view = buffers[(position // CHUNK_SIZE) % 2][:length]
+            recv_exact_into(conn, view)
+
+            if pending is not None:
+                pending.result()
+            pending = writer.submit(store, view, position, checksum)
+            position += length
+
+
+def read_state(path):
+    try:
+        with open(path + STATE_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def open_partial(path, size, modified):
+    """Part file of `path` positioned where the transfer resumes, and that offset (0 unless a previous transfer of the
+    same source left verified chunks)"""
+    state = read_state(path)
+    offset = 0
+    if state == {"Size": size, "Modified": modified} and os.path.isfile(path + PART_SUFFIX):
+        offset = min(os.path.getsize(path + PART_SUFFIX), size) // CHUNK_SIZE * CHUNK_SIZE
+
+    if offset:
+        output = open(path + PART_SUFFIX, "r+b")
+        output.truncate(offset)
+        output.seek(offset)
+    else:
+        output = open(path + PART_SUFFIX, "wb")
+        with open(path + STATE_SUFFIX, "w") as f:
+            json.dump({"Size": size, "Modified": modified}, f)
+    return output, offset
+
+
+def complete_partial(path, modified):
+    os.replace(path + PART_SUFFIX, path)
+    try:
+        os.remove(path + STATE_SUFFIX)
+    except OSError:
+        pass
+    os.utime(path, (modified, modified))
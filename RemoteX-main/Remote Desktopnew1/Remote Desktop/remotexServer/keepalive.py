@@ -0,0 +1,121 @@
+# Timestamped ping/pong carried by KeepAlive events on the Events channel, in both directions.
+#
+# Ping: {"Id": KeepAlive, "Seq": n, "Origin": t1}
+# Pong: {"Id": KeepAlive, "Seq": n, "Origin": t1, "Received": t2, "Sent": t3}
+#
+# t1 and t2/t3 are wall clock times of the pinging and answering peer. The round trip time excludes the time spent by
+# the peer answering (t3 - t2) and the clock offset is estimated NTP-style from the sample with the lowest RTT of a
+# recent window, that sample being the least skewed by queuing.
+import threading
+import time
+from collections import deque
+
+KEEPALIVE_INTERVAL = 1.0 # Seconds between two pings
+DEAD_LINK_TIMEOUT = 10.0 # Seconds without any data from the peer before the link is considered dead
+
+OFFSET_WINDOW = 8 # Samples considered for the clock offset estimate
+MAX_PENDING_PINGS = 32
+
+
+def is_pong(event):
+    return "Received" in event
+
+
+class LinkMonitor:
+    """Rolling RTT (RFC 6298 smoothing), jitter (RFC 3550 interarrival jitter applied to RTT samples) and clock offset
+    estimates of one connection, plus dead link detection."""
+
+    def __init__(self, timeout=DEAD_LINK_TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+        self.rtt = None
+        self.rtt_min = None
+        self.rtt_variance = 0.0
+        self.jitter = 0.0
+        self.clock_offset = 0.0
+        self.last_rtt = None
+        self.samples = 0
+        self.lost = 0
+
+        self._sequence = 0
+        self._pending = {}
+        self._offsets = deque(maxlen=OFFSET_WINDOW)
+        self.last_seen = time.monotonic()
+
+    def touch(self):
+        """Any data received from the peer proves the link is alive"""
+        self.last_seen = time.monotonic()
+
+    def is_dead(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now - self.last_seen > self.timeout
+
+    def ping(self):
+        with self.lock:
+            self._sequence += 1
+            self._pending[self._sequence] = time.monotonic()
+
+            # Pings the peer never answered are counted once they fall out of the pending window
+            while len(self._pending) > MAX_PENDING_PINGS:
+                self._pending.pop(next(iter(self._pending)))
+                self.lost += 1
+
+            return {"Seq": self._sequence, "Origin": time.time()}
+
+    @staticmethod
+    def pong(ping, received):
+        """Answer to a peer `ping`, `received` is the wall clock time it was read at"""
+        return {"Seq": ping.get("Seq"), "Origin": ping.get("Origin"), "Received": received, "Sent": time.time()}
+
+    def on_pong(self, pong):
+        arrival = time.time()
+        now = time.monotonic()
+        self.touch()
+
+        with self.lock:
+            sent = self._pending.pop(pong.get("Seq"), None)
+            if sent is None:
+                return
+
+            try:
+                peer_delay = max(0.0, pong["Sent"] - pong["Received"])
+                rtt = max(0.0, (now - sent) - peer_delay)
+                offset = ((pong["Received"] - pong["Origin"]) + (pong["Sent"] - arrival)) / 2
+            except (KeyError, TypeError):
+                return
+
+            if self.rtt is None:
+                self.rtt = rtt
+                self.rtt_variance = rtt / 2
+            else:
+                self.rtt_variance += (abs(self.rtt - rtt) - self.rtt_variance) / 4
+                self.rtt += (rtt - self.rtt) / 8
+
+            if self.last_rtt is not None:
+                self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+
+            self.last_rtt = rtt
+            self.rtt_min = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+            self.samples += 1
+
+            self._offsets.append((rtt, offset))
+            self.clock_offset = min(self._offsets)[1]
+
+    def retransmission_timeout(self):
+        """Upper bound of an expected answer delay (RFC 6298 RTO), useful to pace adaptive decisions"""
+        if self.rtt is None:
+            return self.timeout
+        return self.rtt + 4 * self.rtt_variance
+
+    def report(self):
+        with self.lock:
+            return {
+                "Rtt": None if self.rtt is None else round(self.rtt * 1000, 2),
+                "RttMin": None if self.rtt_min is None else round(self.rtt_min * 1000, 2),
+                "Jitter": round(self.jitter * 1000, 2),
+                "ClockOffset": round(self.clock_offset * 1000, 2),
+                "Samples": self.samples,
+                "LostPings": self.lost,
+            }
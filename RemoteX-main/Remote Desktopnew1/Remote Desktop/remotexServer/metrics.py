@@ -0,0 +1,286 @@
+# Prometheus text exposition of the server metrics, served by an optional local HTTP endpoint (GET /metrics).
+#
+# Updating a metric on the hot path is a plain attribute increment (label children are resolved once, out of the
+# loops) and does not take any lock: concurrent updates of the same child from several threads may very rarely
+# lose an increment, which is an accepted trade-off for metrics. Per-session values (bytes, frames, throughput, queue
+# depths...) are not updated at all by the workers, collectors read them from the session registry at scrape time.
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from sub-millisecond event injection to multi-frame captures
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f"{name}=\"{value}\"")
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self.create_child()
+
+    def create_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Child metric for the given label values, resolve it once outside of hot loops"""
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.create_child())
+        return child
+
+    def remove(self, *values):
+        with self.lock:
+            self.children.pop(tuple(str(value) for value in values), None)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self.children.items()):
+            lines.extend(child.expose(self.name, dict(zip(self.labelnames, key))))
+        return lines
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def expose(self, name, labels):
+        return [f"{name}{format_labels(labels)} {self.value}"]
+
+
+class GaugeChild(CounterChild):
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def expose(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            bucket_labels = dict(labels, le="+Inf" if bound == float("inf") else repr(bound))
+            lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def create_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def create_child(self):
+        return GaugeChild()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def dec(self, amount=1):
+        self.children[()].dec(amount)
+
+    def set(self, value):
+        self.children[()].set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def create_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """`collector()` returns metrics built at scrape time (values read from live objects)"""
+        self.collectors.append(collector)
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        for collector in self.collectors:
+            for metric in collector():
+                lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+def resident_memory():
+    """Resident set size of this process in bytes, None when unknown"""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.WorkingSetSize
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def collect_process():
+    """Resource usage of the server process, what load tests watch while the number of viewers grows"""
+    cpu = Counter("process_cpu_seconds_total", "User and system CPU time of the process")
+    cpu.inc(time.process_time())
+    threads = Gauge("process_threads", "Threads of the process")
+    threads.set(threading.active_count())
+    collected = [cpu, threads]
+
+    rss = resident_memory()
+    if rss is not None:
+        memory = Gauge("process_resident_memory_bytes", "Resident memory size")
+        memory.set(rss)
+        collected.append(memory)
+    return collected
+
+
+REGISTRY = Registry()
+REGISTRY.add_collector(collect_process)
+
+CAPTURE_SECONDS = REGISTRY.register(Histogram("remotex_capture_seconds", "Screen capture duration"))
+ENCODE_SECONDS = REGISTRY.register(
+    Histogram("remotex_encode_seconds", "Changed tiles detection and JPEG encoding duration per frame")
+)
+EVENT_INJECTION_SECONDS = REGISTRY.register(
+    Histogram("remotex_event_injection_seconds", "Input event injection duration", ("event",))
+)
+FRAMES_DROPPED = REGISTRY.register(Counter("remotex_frames_dropped_total", "Frames (or tiles) not sent", ("reason",)))
+TILES = REGISTRY.register(
+    Counter("remotex_tiles_total", "Screen tiles compared with the previous capture (hit: unchanged)", ("result",))
+)
+CONNECTIONS = REGISTRY.register(Gauge("remotex_connections", "Open viewer connections"))
+CONNECTIONS_TOTAL = REGISTRY.register(Counter("remotex_connections_total", "Accepted viewer connections"))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+    routes = {}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            body = self.registry.expose()
+        elif url.path in self.routes:
+            try:
+                body = self.routes[url.path]({name: values[-1] for name, values in parse_qs(url.query).items()})
+            except (KeyError, ValueError) as e:
+                self.send_error(400, str(e))
+                return
+        else:
+            self.send_error(404)
+            return
+
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    def __init__(self, address, registry=REGISTRY):
+        self.routes = {}
+        handler = type("Handler", (MetricsHandler,), {"registry": registry, "routes": self.routes})
+        self.httpd = ThreadingHTTPServer(address, handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="Metrics", daemon=True)
+
+    def add_route(self, path, handler):
+        """Serve `handler(query)` (query parameters as a dict, returns text) on GET `path`"""
+        self.routes[path] = handler
+
+    def start(self):
+        self.thread.start()
+        host, port = self.httpd.server_address[:2]
+        print(f"Metrics available on http://{host}:{port}/metrics")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
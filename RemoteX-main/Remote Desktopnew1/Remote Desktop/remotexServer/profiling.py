@@ -0,0 +1,169 @@
+# Per-stage instrumentation of the streaming hot paths and on-demand cProfile snapshots.
+#
+# Stage spans: a StageTimer per worker accumulates the time spent in each stage (capture, detect, encode, send...).
+# They are off by default, a disabled timer costs one attribute check per stage. They can be toggled at runtime
+# (metrics endpoint: /spans?enable=1) and are exported with the metrics.
+#
+# Snapshots: /profile?session=<id>&seconds=<n> asks every worker of that session to run under cProfile for n seconds.
+# cProfile only sees the thread that enabled it, so the workers themselves start and stop their profiler between two
+# iterations (SessionProfiler.step), the merged pstats are then written to PROFILE_DIRECTORY.
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+PROFILE_DIRECTORY = "profiles"
+MAX_PROFILE_DURATION = 60
+PROFILE_REPORT_LINES = 40
+
+
+class Spans:
+    """Global toggle and registry of the stage timers"""
+
+    def __init__(self):
+        self.enabled = False
+        self.timers = []
+        self.lock = threading.Lock()
+
+    def timer(self, worker):
+        timer = StageTimer(self, worker)
+        with self.lock:
+            self.timers.append(timer)
+        return timer
+
+    def release(self, timer):
+        with self.lock:
+            if timer in self.timers:
+                self.timers.remove(timer)
+
+    def report(self):
+        """{worker: {stage: (count, total seconds)}} of the live timers"""
+        with self.lock:
+            timers = list(self.timers)
+        return {timer.worker: timer.report() for timer in timers}
+
+
+class StageTimer:
+    """`start()` at the top of an iteration, then `mark(stage)` at the end of each stage: the time elapsed since the
+    previous mark is accounted to `stage`"""
+
+    def __init__(self, spans, worker):
+        self.spans = spans
+        self.worker = worker
+        self.totals = {}
+        self.counts = {}
+        self.last = None
+
+    def start(self):
+        self.last = time.perf_counter() if self.spans.enabled else None
+
+    def mark(self, stage):
+        if self.last is None:
+            return
+        now = time.perf_counter()
+        self.totals[stage] = self.totals.get(stage, 0.0) + now - self.last
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+        self.last = now
+
+    def report(self):
+        return {stage: (self.counts.get(stage, 0), total) for stage, total in list(self.totals.items())}
+
+
+SPANS = Spans()
+
+
+class SessionProfiler:
+    """Run the workers of a session under cProfile for a while, on request"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.until = 0.0
+        self.active = 0
+        self.results = []
+        self.errors = []
+        self.cond = threading.Condition()
+        self.local = threading.local()
+
+    @property
+    def requested(self):
+        return self.until > 0
+
+    def request(self, seconds):
+        with self.cond:
+            self.until = time.monotonic() + min(seconds, MAX_PROFILE_DURATION)
+            self.results = []
+            self.errors = []
+
+    def step(self):
+        """Called by a worker between two iterations"""
+        profile = getattr(self.local, "profile", None)
+        if profile is None and not self.requested:
+            return
+
+        now = time.monotonic()
+        if profile is None:
+            if now >= self.until:
+                return
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e: # Python 3.12+: a single profiler may be active at a time
+                with self.cond:
+                    self.errors.append(f"{threading.current_thread().name}: {e}")
+                return
+            self.local.profile = profile
+            with self.cond:
+                self.active += 1
+        elif now >= self.until:
+            self.stop()
+
+    def stop(self):
+        """Stop the calling worker profiler (also called when the worker ends)"""
+        profile = getattr(self.local, "profile", None)
+        if profile is None:
+            return
+        profile.disable()
+        self.local.profile = None
+        with self.cond:
+            self.results.append((threading.current_thread().name, profile))
+            self.active -= 1
+            self.cond.notify_all()
+
+    def collect(self, timeout):
+        """Wait for the requested duration to elapse and every profiled worker to hand its profile over"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            self.cond.wait_for(lambda: time.monotonic() >= self.until and self.active == 0,
+                               max(0.0, deadline - time.monotonic()))
+            self.until = 0.0
+            return list(self.results), list(self.errors)
+
+    def snapshot(self, seconds):
+        """Profile the session for `seconds`, dump the merged stats and return a text summary"""
+        self.request(seconds)
+        time.sleep(min(seconds, MAX_PROFILE_DURATION))
+        results, errors = self.collect(timeout=5)
+
+        if not results:
+            return "No worker of this session ran while profiling\n" + "\n".join(errors)
+
+        stats = None
+        for _, profile in results:
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+        path = os.path.join(PROFILE_DIRECTORY, f"{self.session_id}-{time.strftime('%Y%m%d-%H%M%S')}.pstats")
+        stats.dump_stats(path)
+
+        output = io.StringIO()
+        output.write(f"Profiled workers: {', '.join(name for name, _ in results)}\nSaved to {path}\n")
+        for error in errors:
+            output.write(f"Skipped {error}\n")
+        stats.stream = output
+        stats.sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        return output.getvalue()
@@ -1,10 +1,30 @@
-from enum import Enum, auto
+from enum import Enum, IntFlag, auto
 
 PROTOCOL_VERSION = '5.0.2'
 
+# Flags of the desktop chunk header (Size, X, Y, Flags)
+class ChunkFlag(IntFlag):
+    EndOfFrame = 0x1 # Last chunk of a captured frame
+    Keyframe = 0x2 # Chunk belongs to a full screen refresh
+    Pixels = 0x4 # Raw pixels (tiles.PIXELS_HEADER + pixels, maybe zlib compressed) instead of a JPEG image
+
+# Desktop tile encodings a viewer may ask for (desktop params TileEncoding and PixelFormat, by name)
+class TileEncoding(Enum):
+    Jpeg = 0x1
+    Raw = 0x2 # Uncompressed pixels, for LAN sessions where CPU rather than bandwidth is the limit
+    Zlib = 0x3 # Lossless, zlib compressed pixels
+
+# Raw pixel layouts, multi-byte pixels are little endian words
+class PixelFormat(Enum):
+    RGB888 = 0x1 # R, G, B bytes
+    RGB565 = 0x2 # 16 bits, red in the high bits
+    ARGB32 = 0x3 # 32 bits 0xAARRGGBB (B, G, R, A bytes), alpha always 0xFF
+
 class WorkerKind(Enum):
     Desktop = 0x1
     Events = 0x2
+    Clipboard = 0x3
+    FileTransfer = 0x4
 
 class ClipboardMode(Enum):
     Disabled = 0x1
@@ -20,6 +40,22 @@ class RemotexProtocolCommand(Enum):
     BadRequest = 0x5
     ResourceFound = 0x6
     ResourceNotFound = 0x7
+    OpenSession = 0x8
+    ResumeSession = 0x9
+
+class Channel(Enum):
+    Control = 0x0
+    Desktop = 0x1
+    Events = 0x2
+    Clipboard = 0x3
+
+# Lower value is sent first, input must never wait behind a desktop frame
+CHANNEL_PRIORITY = {
+    Channel.Events: 0,
+    Channel.Control: 1,
+    Channel.Desktop: 2,
+    Channel.Clipboard: 3,
+}
 
 class OutputEvent(Enum):
     Keyboard = 0x1
@@ -0,0 +1,122 @@
+# Bandwidth limits of the desktop send path. A token bucket per session and a global one shared by every session: a
+# chunk is always sent whole (tokens may go negative), the stream then waits for the debt to be paid back before the
+# next capture. Frames are therefore dropped at the source (lower update rate) instead of piling up in send buffers,
+# and a stream that keeps hitting its cap also lowers its JPEG quality to get more updates per byte.
+import threading
+import time
+
+BURST_DURATION = 0.25 # Seconds of traffic a bucket may send at once
+
+# Quality adaptation
+MIN_QUALITY = 20
+QUALITY_STEP = 10
+THROTTLED_RATIO = 0.2 # Share of the time spent waiting for tokens above which the quality is lowered
+RECOVERY_FRAMES = 30 # Frames without waiting before the quality is raised again
+
+THROUGHPUT_WINDOW = 2.0 # Seconds of the throughput moving average
+
+
+class TokenBucket:
+    """`rate` bytes per second, None (or 0) for no limit"""
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate or None
+        self.capacity = burst or (self.rate * BURST_DURATION if self.rate else 0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return self.rate is not None
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, size):
+        """Take `size` tokens, possibly going in debt"""
+        if not self.limited:
+            return
+
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= size
+
+    def delay(self):
+        """Seconds until the bucket is out of debt"""
+        if not self.limited:
+            return 0.0
+
+        with self.lock:
+            self._refill(time.monotonic())
+            return max(0.0, -self.tokens / self.rate)
+
+
+class ThroughputMeter:
+    """Exponentially weighted throughput (bytes per second)"""
+
+    def __init__(self, window=THROUGHPUT_WINDOW):
+        self.window = window
+        self.rate = 0.0
+        self.updated = time.monotonic()
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        with self.lock:
+            self.pending += size
+            self._update(time.monotonic())
+
+    def _update(self, now):
+        elapsed = now - self.updated
+        if elapsed < 0.1:
+            return
+
+        weight = min(1.0, elapsed / self.window)
+        self.rate += (self.pending / elapsed - self.rate) * weight
+        self.pending = 0
+        self.updated = now
+
+    def value(self):
+        with self.lock:
+            self._update(time.monotonic())
+            return self.rate
+
+
+class RateController:
+    """Pace one desktop stream against its session and the global buckets, and adapt its JPEG quality"""
+
+    def __init__(self, buckets, meter, quality):
+        self.buckets = [bucket for bucket in buckets if bucket.limited]
+        self.meter = meter
+        self.max_quality = quality
+        self.quality = quality
+        self.frames_unthrottled = 0
+        self.throttled_time = 0.0
+        self.frames_throttled = 0
+
+    def sent(self, size):
+        for bucket in self.buckets:
+            bucket.consume(size)
+        self.meter.add(size)
+
+    def wait(self, frame_time):
+        """Called before each capture with the duration of the previous frame, sleep until every bucket is out of debt
+        and adapt the quality to the share of time spent waiting"""
+        delay = max((bucket.delay() for bucket in self.buckets), default=0.0)
+        if delay > 0:
+            time.sleep(delay)
+            self.throttled_time += delay
+            self.frames_throttled += 1
+
+        if delay > THROTTLED_RATIO * (frame_time + delay):
+            self.frames_unthrottled = 0
+            self.quality = max(MIN_QUALITY, self.quality - QUALITY_STEP)
+        elif delay == 0:
+            self.frames_unthrottled += 1
+            if self.frames_unthrottled >= RECOVERY_FRAMES and self.quality < self.max_quality:
+                self.frames_unthrottled = 0
+                self.quality = min(self.max_quality, self.quality + QUALITY_STEP)
+
+        return delay
@@ -0,0 +1,284 @@
+# Session recordings: the desktop chunks already encoded for the viewer are appended as they are sent, so recording
+# costs a buffered file write and no encoding. The stream is forced to send a keyframe every KEYFRAME_INTERVAL seconds
+# so that playback can start anywhere.
+#
+# <name>.rxr (data, append-only)
+#   RECORDING_MAGIC, metadata length (uint32) + JSON metadata, then records:
+#   RECORD_HEADER (kind, microseconds since the recording started, payload size) + payload
+#   A chunk record payload is the chunk exactly as sent on the wire (chunk header + JPEG or raw pixels).
+#
+# <name>.rxi (index, append-only)
+#   INDEX_MAGIC + step (milliseconds), then one INDEX_ENTRY (timestamp, data offset) per step of recording time:
+#   entry n is the last keyframe that started at or before n * step. A closed recording ends with one more entry, its
+#   last keyframe. Seeking to t reads entry t // step of the memory-mapped index (constant time, the last entry past
+#   the end) and plays the records from that offset up to t. The index only depends on the data file.
+#
+# A recording cut short (crash, full disk) stays readable up to its last complete record, the index can be rebuilt
+# from the data file with `rebuild_index`.
+import json
+import mmap
+import struct
+import threading
+import time
+
+from protocol import PROTOCOL_VERSION, ChunkFlag
+
+RECORDING_MAGIC = b"RXREC001"
+INDEX_MAGIC = b"RXIDX001"
+METADATA_LENGTH = struct.Struct("!I")
+RECORD_HEADER = struct.Struct("!BQI")
+INDEX_HEADER = struct.Struct("!8sI")
+INDEX_ENTRY = struct.Struct("!QQ")
+CHUNK_HEADER = struct.Struct("IIIB")
+
+RECORD_CHUNK = 0x1
+
+DATA_EXTENSION = ".rxr"
+INDEX_EXTENSION = ".rxi"
+
+KEYFRAME_INTERVAL = 10 # Seconds between two forced keyframes
+INDEX_STEP = 1000 # Milliseconds of recording time per index entry
+WRITE_BUFFER_SIZE = 1048576
+
+
+class RecordingError(Exception):
+    pass
+
+
+class SessionRecorder:
+    """Append the desktop chunks of one session to a recording, called from the desktop worker"""
+
+    def __init__(self, path, session_id, keyframe_interval=KEYFRAME_INTERVAL, index_step=INDEX_STEP):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.index_step = index_step
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.closed = False
+
+        self.data = open(path + DATA_EXTENSION, "xb", buffering=WRITE_BUFFER_SIZE)
+        self.index = open(path + INDEX_EXTENSION, "xb")
+
+        metadata = json.dumps({
+            "SessionId": session_id,
+            "Started": time.time(),
+            "Version": PROTOCOL_VERSION,
+            "KeyframeInterval": keyframe_interval,
+        }).encode()
+        self.data.write(RECORDING_MAGIC + METADATA_LENGTH.pack(len(metadata)) + metadata)
+        self.offset = len(RECORDING_MAGIC) + METADATA_LENGTH.size + len(metadata)
+
+        self.index.write(INDEX_HEADER.pack(INDEX_MAGIC, index_step))
+        self.index.flush()
+        self.next_slot = 0
+
+        self.keyframe = None # (timestamp, offset) of the last complete keyframe start
+        self.pending_keyframe = None
+        self.in_keyframe = False
+        self.last_keyframe = None
+        self.bytes_written = 0
+
+    def timestamp(self):
+        return int((time.monotonic() - self.started) * 1000000)
+
+    def keyframe_due(self):
+        """True when the desktop stream should send a full refresh for the recording"""
+        return self.last_keyframe is None or time.monotonic() - self.last_keyframe >= self.keyframe_interval
+
+    def write_chunk(self, chunk, flags):
+        with self.lock:
+            if self.closed:
+                return
+
+            timestamp = self.timestamp()
+
+            # Slots up to now get the keyframe known so far: it started before them, unlike one completing now
+            self._fill_index(timestamp)
+
+            if flags & ChunkFlag.Keyframe and not self.in_keyframe:
+                self.in_keyframe = True
+                self.pending_keyframe = (timestamp, self.offset)
+            if self.in_keyframe and flags & ChunkFlag.EndOfFrame:
+                # Only complete keyframes are indexed
+                self.in_keyframe = False
+                self.keyframe = self.pending_keyframe
+                self.last_keyframe = time.monotonic()
+
+            self.data.write(RECORD_HEADER.pack(RECORD_CHUNK, timestamp, len(chunk)))
+            self.data.write(chunk)
+            self.offset += RECORD_HEADER.size + len(chunk)
+            self.bytes_written += RECORD_HEADER.size + len(chunk)
+
+    def _fill_index(self, timestamp):
+        if self.keyframe is None:
+            return
+
+        entries = []
+        while self.next_slot * self.index_step * 1000 <= timestamp:
+            entries.append(INDEX_ENTRY.pack(*self.keyframe))
+            self.next_slot += 1
+
+        self._write_entries(entries)
+
+    def _write_entries(self, entries):
+        if entries:
+            # The data the entries point to must be on disk before the index refers to it
+            self.data.flush()
+            self.index.write(b"".join(entries))
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            # Trailing entry: the last keyframe, it may have completed after the last slot was written
+            if self.keyframe is not None:
+                self._write_entries([INDEX_ENTRY.pack(*self.keyframe)])
+                self.next_slot += 1
+            self.data.close()
+            self.index.close()
+
+    def report(self):
+        return {
+            "Path": self.path + DATA_EXTENSION,
+            "BytesWritten": self.bytes_written,
+            "IndexEntries": self.next_slot,
+        }
+
+
+def read_records(data, offset, end=None):
+    """Yield (kind, timestamp in microseconds, payload offset, payload size) from `offset`, stops at the first
+    incomplete record"""
+    end = len(data) if end is None else end
+    while offset + RECORD_HEADER.size <= end:
+        kind, timestamp, size = RECORD_HEADER.unpack_from(data, offset)
+        payload = offset + RECORD_HEADER.size
+        if payload + size > end:
+            return
+        yield kind, timestamp, payload, size
+        offset = payload + size
+
+
+def read_metadata(data):
+    if data[:len(RECORDING_MAGIC)] != RECORDING_MAGIC:
+        raise RecordingError("Not a Remotex recording")
+
+    length, = METADATA_LENGTH.unpack_from(data, len(RECORDING_MAGIC))
+    start = len(RECORDING_MAGIC) + METADATA_LENGTH.size
+    return json.loads(bytes(data[start:start + length])), start + length
+
+
+def read_index_step(path):
+    """Step of the index of a recording, None when it has no readable index"""
+    try:
+        with open(path + INDEX_EXTENSION, "rb") as f:
+            magic, index_step = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return index_step if magic == INDEX_MAGIC and index_step > 0 else None
+
+
+def rebuild_index(path, index_step=None):
+    """Write the index of a recording again from its data file (lost or truncated index), with the step of the index
+    it replaces by default (INDEX_STEP when there is none). The result is the index the recorder writes on close."""
+    if index_step is None:
+        index_step = read_index_step(path) or INDEX_STEP
+
+    with open(path + DATA_EXTENSION, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            _, offset = read_metadata(data)
+
+            keyframe = None
+            pending = None
+            slot = 0
+            entries = []
+            for kind, timestamp, payload, size in read_records(data, offset):
+                if kind != RECORD_CHUNK:
+                    continue
+
+                while keyframe is not None and slot * index_step * 1000 <= timestamp:
+                    entries.append(INDEX_ENTRY.pack(*keyframe))
+                    slot += 1
+
+                flags = CHUNK_HEADER.unpack_from(data, payload)[3]
+                if flags & ChunkFlag.Keyframe and pending is None:
+                    pending = (timestamp, payload - RECORD_HEADER.size)
+                if pending is not None and flags & ChunkFlag.EndOfFrame:
+                    keyframe, pending = pending, None
+
+            if keyframe is not None:
+                entries.append(INDEX_ENTRY.pack(*keyframe))
+        finally:
+            data.close()
+
+    with open(path + INDEX_EXTENSION, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, index_step))
+        f.write(b"".join(entries))
+
+
+class RecordingReader:
+    """Memory-mapped access to a recording: constant time seek through the index, then sequential records"""
+
+    def __init__(self, path):
+        if path.endswith(DATA_EXTENSION):
+            path = path[:-len(DATA_EXTENSION)]
+        self.path = path
+
+        self._data_file = open(path + DATA_EXTENSION, "rb")
+        self.data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.metadata, self.first_record = read_metadata(self.data)
+
+        self._index_file = open(path + INDEX_EXTENSION, "rb")
+        self.index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.index_step = INDEX_HEADER.unpack_from(self.index)
+        if magic != INDEX_MAGIC:
+            raise RecordingError("Not a Remotex recording index")
+
+    @property
+    def index_entries(self):
+        return (len(self.index) - INDEX_HEADER.size) // INDEX_ENTRY.size
+
+    def keyframe_at(self, seconds):
+        """(timestamp, data offset) of the last keyframe that started at or before `seconds`, None before the first
+        indexed keyframe"""
+        entries = self.index_entries
+        if entries == 0:
+            return None
+
+        if seconds * 1000 >= entries * self.index_step:
+            slot = entries - 1
+        else:
+            slot = max(0, int(seconds * 1000 // self.index_step))
+        return INDEX_ENTRY.unpack_from(self.index, INDEX_HEADER.size + slot * INDEX_ENTRY.size)
+
+    def chunks(self, start=None, until=None):
+        """Yield (timestamp in seconds, chunk) from the keyframe preceding `start` (the first record when None) up to
+        `until` seconds"""
+        offset = self.first_record
+        if start is not None:
+            keyframe = self.keyframe_at(start)
+            if keyframe is not None:
+                offset = keyframe[1]
+
+        for kind, timestamp, payload, size in read_records(self.data, offset):
+            if until is not None and timestamp > until * 1000000:
+                return
+            if kind == RECORD_CHUNK:
+                yield timestamp / 1000000, self.data[payload:payload + size]
+
+    def duration(self):
+        """Timestamp of the last complete record, read from the last indexed keyframe onwards"""
+        last = 0
+        keyframe = self.keyframe_at(float("inf"))
+        offset = keyframe[1] if keyframe is not None else self.first_record
+        for _, timestamp, _, _ in read_records(self.data, offset):
+            last = timestamp
+        return last / 1000000
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+        self._data_file.close()
+        self._index_file.close()
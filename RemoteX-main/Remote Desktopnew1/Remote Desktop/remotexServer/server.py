@@ -6,52 +6,277 @@ import time
 import ssl
 import io
 import hashlib
-import random
-import string
+import os
+import subprocess
 from protocol import *
-import desktop
+from session import SessionManager, SessionError
+from transport import BufferedSocket, Multiplexer
+from capture import ScreenCaptureSource
+import tiles
+import datagram
+from keepalive import KEEPALIVE_INTERVAL, LinkMonitor, is_pong
+from ratelimit import RateController, TokenBucket
+import metrics
+import profiling
+import clipboard
+import filetransfer
 
 # Configuration
 LISTEN_IP = "0.0.0.0"
 LISTEN_PORT = 2801
-CERT_FILE = "server.crt" # User needs to generate this or we can generate self-signed
+CERT_FILE = "server.crt" # A self-signed one is generated on first start when missing (viewers pin its fingerprint)
 KEY_FILE = "server.key"
+ALLOW_PLAINTEXT = False # Serve without TLS instead when no certificate is provided (traffic is then NOT encrypted)
+TLS_HANDSHAKE_TIMEOUT = 10
+DEFAULT_IMAGE_QUALITY = 60 # Reduced quality for speed
+FRAME_INTERVAL = 0.005
+DEAD_LINK_TIMEOUT = 10 # Seconds without any event (keepalive included) before the viewer connection is dropped
+
+# Local Prometheus endpoint (GET /metrics), e.g. ("127.0.0.1", 9801). None to disable.
+# Also serves the profiling controls: GET /spans?enable=1|0, GET /profile?session=<id>&seconds=<n> and
+# GET /trace?session=<id>&enable=1|0 (desktop stream timeline of a session, see tracing.py)
+METRICS_ADDRESS = None
+STAGE_SPANS = False # Per-stage timing of the desktop and events workers at startup (toggled at runtime with /spans)
+
+# Session recordings for audit: the desktop stream of every session is written to this directory as sent (no
+# re-encoding), with a forced keyframe every recording.KEYFRAME_INTERVAL seconds. None to disable.
+RECORDING_DIRECTORY = None
+
+# Clipboard sharing allowed with viewers, from the viewer point of view (Send: viewer to server). Viewers may restrict
+# it further, contents travel on the low priority Clipboard channel and are polled every CLIPBOARD_POLL_INTERVAL.
+CLIPBOARD_MODE = ClipboardMode.Both
+CLIPBOARD_POLL_INTERVAL = 0.5
+
+# Cursor position and shape pushed to the viewer (MouseCursorUpdated) when they change, checked every
+# CURSOR_POLL_INTERVAL. The viewer draws the cursor where the user's hand is and only corrects it when the remote cursor
+# went elsewhere (moved by an application, held at the screen edge...).
+CURSOR_POLL_INTERVAL = 0.02
+
+# File transfers, on a connection of their own attached to the session (AttachToSession <id> FileTransfer). Paths are
+# confined to FILE_TRANSFER_ROOT (created when missing). Point it at another directory to share more, None gives the
+# viewer access to every file of the server account.
+FILE_TRANSFER = True
+FILE_TRANSFER_ROOT = os.path.join(os.path.expanduser("~"), "RemotexTransfers")
+
+# Desktop bandwidth caps in bytes per second (None for no limit), e.g. 2 Mbit/s is 250000
+CLIENT_BANDWIDTH_LIMIT = None # Per session
+GLOBAL_BANDWIDTH_LIMIT = None # All sessions together
+
+# Raw (or zlib compressed) pixel tiles instead of JPEG ones, when the viewer asks for them. They cost far less CPU on
+# both ends but far more bandwidth, they are meant for LAN sessions.
+RAW_TILES = True
+
+# Desktop tiles over UDP (when the viewer asks for it). Datagrams are NOT encrypted, the transport is therefore refused
+# while TLS is enabled unless explicitly allowed.
+DATAGRAM_TRANSPORT = True
+DATAGRAM_ALLOW_UNENCRYPTED = False
+DATAGRAM_HELLO_TIMEOUT = 3
+DATAGRAM_PACING_RATE = datagram.DEFAULT_PACING_RATE
+
+# TLS 1.2 suites (TLS 1.3 suites are AEAD only and can't be restricted from Python). Client order is honoured so that
+# a viewer without AES instructions can get ChaCha20 while others get hardware accelerated AES-GCM.
+TLS_CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"
+
+def create_tls_context(cert_file, key_file):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS_CIPHERS)
+    context.options &= ~ssl.OP_CIPHER_SERVER_PREFERENCE
+    context.load_cert_chain(certfile=cert_file, keyfile=key_file)
+
+    # Session resumption: OpenSSL keeps a server side session cache and issues tickets (TLS 1.2 and 1.3) for the
+    # lifetime of this context, reconnecting viewers then skip the certificate exchange and key agreement.
+    context.num_tickets = 2
+    return context
+
+def generate_self_signed_certificate(cert_file, key_file):
+    """Create a self-signed certificate with the openssl command line tool, False when it could not"""
+    try:
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "3650",
+                        "-subj", "/CN=Remotex", "-keyout", key_file, "-out", cert_file],
+                       check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not generate a self-signed certificate: {e}")
+        return False
+    os.chmod(key_file, 0o600)
+    return True
+
+def certificate_fingerprint(cert_file):
+    with open(cert_file, "r") as f:
+        der = ssl.PEM_cert_to_DER_cert(f.read())
+    return hashlib.sha1(der).hexdigest().upper()
 
 class RemotexServer:
-    def __init__(self, password):
+    def __init__(self, password, capture_source=None):
         self.password = password
-        self.sessions = {}
+        self.capture_source = capture_source if capture_source is not None else ScreenCaptureSource()
+        self.sessions = SessionManager(link_timeout=DEAD_LINK_TIMEOUT, bandwidth_limit=CLIENT_BANDWIDTH_LIMIT,
+                                       recording_directory=RECORDING_DIRECTORY)
+        self.bandwidth = TokenBucket(GLOBAL_BANDWIDTH_LIMIT)
         self.running = True
+        self.tls_context = None
 
     def start(self):
-        # Create a self-signed cert if not exists (simplified for "simple code")
-        # For now, we assume SSL context is handled or we skip SSL for "simple" if user allows?
-        # The original had SSL. We should keep it.
-        # We'll assume certs exist or use ad-hoc if python supports it (stdlib doesn't generate certs easily).
-        # We'll skip SSL generation code to keep it simple, user must provide certs or we run insecure (not recommended).
-        # Actually, let's try to run without SSL for maximum simplicity if the user wants "simple", 
-        # BUT the client expects SSL. So we must wrap.
-        
-        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        # context.load_cert_chain(certfile=CERT_FILE, keyfile=KEY_FILE) 
-        # To make it run out of the box, we might need to generate one or disable SSL on client.
-        # Let's assume we disable SSL on client for "Simplification" or we generate one.
-        # Generating is too much code. 
-        # Let's try to use ad-hoc context or just plain TCP and modify client to support plain TCP?
-        # The client uses `ssl.wrap_socket` or similar.
-        # Let's modify client to allow plain TCP for simplicity.
-        
+        # Without a certificate provided, a self-signed one is generated on first start. Only ALLOW_PLAINTEXT lets the
+        # server run unencrypted instead.
+        if not (os.path.isfile(CERT_FILE) and os.path.isfile(KEY_FILE)) and not ALLOW_PLAINTEXT:
+            print(f"{CERT_FILE} / {KEY_FILE} not found, generating a self-signed certificate")
+            if not generate_self_signed_certificate(CERT_FILE, KEY_FILE):
+                raise SystemExit(f"No TLS certificate ({CERT_FILE} / {KEY_FILE}), refusing to serve in plaintext. "
+                                 "Provide one, or set ALLOW_PLAINTEXT to serve unencrypted on a trusted network.")
+
+        if os.path.isfile(CERT_FILE) and os.path.isfile(KEY_FILE):
+            self.tls_context = create_tls_context(CERT_FILE, KEY_FILE)
+            print(f"TLS enabled, certificate fingerprint (SHA-1): {certificate_fingerprint(CERT_FILE)}")
+        else:
+            print(f"WARNING: ALLOW_PLAINTEXT is set and {CERT_FILE} / {KEY_FILE} not found, traffic will NOT be "
+                  "encrypted")
+
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.bind((LISTEN_IP, LISTEN_PORT))
         self.sock.listen(5)
         print(f"Server listening on {LISTEN_IP}:{LISTEN_PORT}")
 
+        self.sessions.start()
+
+        profiling.SPANS.enabled = STAGE_SPANS
+        if METRICS_ADDRESS is not None:
+            metrics.REGISTRY.add_collector(self.collect_metrics)
+            metrics.REGISTRY.add_collector(self.collect_spans)
+            endpoint = metrics.MetricsServer(METRICS_ADDRESS)
+            endpoint.add_route("/spans", self.toggle_spans)
+            endpoint.add_route("/profile", self.profile_session)
+            endpoint.add_route("/trace", self.trace_session)
+            endpoint.start()
+
         while self.running:
             client_sock, addr = self.sock.accept()
             print(f"Connection from {addr}")
-            threading.Thread(target=self.handle_client, args=(client_sock,)).start()
+            metrics.CONNECTIONS_TOTAL.inc()
+            threading.Thread(target=self.handle_client, args=(client_sock,), daemon=True).start()
+
+    def session_information(self, session):
+        return {
+            "SessionId": session.id,
+            "Version": PROTOCOL_VERSION,
+            "ViewOnly": False,
+            "Clipboard": self.clipboard_mode().value,
+            "FileTransfer": FILE_TRANSFER,
+            "Username": "User",
+            "MachineName": "Server",
+            "WindowsVersion": "10"
+        }
+
+    def collect_metrics(self):
+        """Per-session metrics, read from the session registry at scrape time so that workers never update them"""
+        sessions = metrics.Gauge("remotex_sessions", "Live sessions")
+        workers = metrics.Gauge("remotex_workers", "Attached workers")
+        bytes_sent = metrics.Counter("remotex_session_bytes_sent_total", "Bytes sent", ("session",))
+        bytes_received = metrics.Counter("remotex_session_bytes_received_total", "Bytes received", ("session",))
+        frames_sent = metrics.Counter("remotex_session_frames_sent_total", "Desktop frames sent", ("session",))
+        throughput = metrics.Gauge("remotex_session_throughput_bytes", "Desktop throughput (bytes/s)", ("session",))
+        quality = metrics.Gauge("remotex_session_image_quality", "Image quality in use", ("session",))
+        rtt = metrics.Gauge("remotex_session_rtt_seconds", "Smoothed keepalive round trip time", ("session",))
+        queued = metrics.Gauge("remotex_session_queued_bytes", "Bytes waiting to be sent", ("session", "channel"))
+
+        live_sessions = self.sessions.live_sessions()
+        sessions.set(len(live_sessions))
+        workers.set(self.sessions.worker_count())
+
+        for session in live_sessions:
+            report = session.report()
+            bytes_sent.labels(session.id).inc(report["BytesSent"])
+            bytes_received.labels(session.id).inc(report["BytesReceived"])
+            frames_sent.labels(session.id).inc(report["FramesSent"])
+            throughput.labels(session.id).set(report["Throughput"])
+            quality.labels(session.id).set(session.quality or 0)
+            rtt.labels(session.id).set(session.link.rtt or 0)
+
+            if isinstance(session.connection, Multiplexer):
+                for channel, size in session.connection.queued_bytes().items():
+                    queued.labels(session.id, channel.name).set(size)
+
+        return [sessions, workers, bytes_sent, bytes_received, frames_sent, throughput, quality, rtt, queued]
+
+    def collect_spans(self):
+        stage_seconds = metrics.Counter("remotex_stage_seconds_total", "Time spent per worker stage",
+                                        ("worker", "stage"))
+        stage_calls = metrics.Counter("remotex_stage_calls_total", "Worker stages completed", ("worker", "stage"))
+
+        for worker, stages in profiling.SPANS.report().items():
+            for stage, (count, total) in stages.items():
+                stage_seconds.labels(worker, stage).inc(total)
+                stage_calls.labels(worker, stage).inc(count)
+
+        return [stage_seconds, stage_calls]
+
+    def toggle_spans(self, query):
+        """GET /spans[?enable=1|0]: switch stage spans on or off, and return the current totals"""
+        if "enable" in query:
+            profiling.SPANS.enabled = query["enable"].lower() not in ("0", "false", "no", "off")
+            print(f"Stage spans {'enabled' if profiling.SPANS.enabled else 'disabled'}")
+
+        report = {
+            worker: {stage: {"Count": count, "Total": round(total, 6)} for stage, (count, total) in stages.items()}
+            for worker, stages in profiling.SPANS.report().items()
+        }
+        return json.dumps({"Enabled": profiling.SPANS.enabled, "Workers": report}, indent=2) + "\n"
+
+    def profile_session(self, query):
+        """GET /profile?session=<id>&seconds=<n>: run the workers of a session under cProfile, blocks for n seconds"""
+        session = self.sessions.get(query["session"])
+        if session is None:
+            raise KeyError(f"Unknown session {query['session']}")
+
+        seconds = float(query.get("seconds", 10))
+        if seconds <= 0:
+            raise ValueError("seconds must be positive")
+
+        print(f"Session {session.id}: profiling for {min(seconds, profiling.MAX_PROFILE_DURATION)}s")
+        return session.profiler.snapshot(seconds)
+
+    def trace_session(self, query):
+        """GET /trace?session=<id>[&enable=1|0]: start or stop tracing the desktop stream of a session"""
+        session = self.sessions.get(query["session"])
+        if session is None:
+            raise KeyError(f"Unknown session {query['session']}")
+
+        path = None
+        if "enable" in query:
+            if query["enable"].lower() not in ("0", "false", "no", "off"):
+                if session.tracer.start():
+                    print(f"Session {session.id}: tracing")
+            else:
+                path = session.stop_tracing()
+        return json.dumps({"Enabled": session.tracer.enabled, "Trace": path}, indent=2) + "\n"
+
+    def clipboard_mode(self):
+        if self.capture_source.clipboard is None:
+            return ClipboardMode.Disabled
+        return CLIPBOARD_MODE
+
+    def handle_client(self, client_sock):
+        metrics.CONNECTIONS.inc()
+        try:
+            self.serve_client(client_sock)
+        finally:
+            metrics.CONNECTIONS.dec()
+
+    def serve_client(self, client_sock):
+        try:
+            if self.tls_context is not None:
+                # Handshake happens here, in the client thread, so a slow viewer never blocks `accept`
+                client_sock.settimeout(TLS_HANDSHAKE_TIMEOUT)
+                client_sock = self.tls_context.wrap_socket(client_sock, server_side=True)
+                client_sock.settimeout(None)
+        except (OSError, ssl.SSLError) as e:
+            print(f"TLS handshake failed: {e}")
+            client_sock.close()
+            return
 
-    def handle_client(self, conn):
+        # Viewer may pipeline its password and first command without waiting for our banner, lines must therefore
+        # be read from a buffer rather than with one `recv` per line.
+        conn = BufferedSocket(client_sock)
         try:
             # Simple Handshake
             # 1. Auth
@@ -76,7 +301,7 @@ class RemotexServer:
             # 3. Server sends "OK"
             
             conn.sendall(b"RemotexServer\n")
-            password = conn.recv(1024).decode().strip()
+            password = conn.read_line()
             if password != self.password:
                 conn.sendall(b"FAIL\n")
                 conn.close()
@@ -85,33 +310,58 @@ class RemotexServer:
             
             # 4. Command Loop
             while True:
-                cmd = conn.recv(1024).decode().strip()
+                cmd = conn.read_line()
                 if not cmd: break
                 
-                if cmd == "RequestSession":
-                    session_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-                    self.sessions[session_id] = {"active": True}
-                    
-                    info = {
-                        "SessionId": session_id,
-                        "Version": PROTOCOL_VERSION,
-                        "ViewOnly": False,
-                        "Clipboard": 4, # Both
-                        "Username": "User",
-                        "MachineName": "Server",
-                        "WindowsVersion": "10"
-                    }
-                    conn.sendall(json.dumps(info).encode() + b"\n")
+                if cmd == "OpenSession":
+                    # Single connection session: every worker is a logical channel of this connection
+                    try:
+                        session = self.sessions.create()
+                    except SessionError as e:
+                        print(f"Session refused: {e}")
+                        conn.sendall(b"Fail\n")
+                        break
+
+                    conn.sendall(json.dumps(self.session_information(session)).encode() + b"\n")
+
+                    self.serve_multiplexed(session, conn)
+                    break
+
+                elif cmd == "ResumeSession":
+                    # Viewer lost its connection, bind the existing session (and its grace period) to this one
+                    sid = conn.read_line()
+                    session = self.sessions.get(sid)
+                    if session is None or session.closed:
+                        conn.sendall(b"ResourceNotFound\n")
+                        break
+
+                    print(f"Session {sid} resumed")
+                    conn.sendall(json.dumps(self.session_information(session)).encode() + b"\n")
+
+                    self.serve_multiplexed(session, conn)
+                    break
+
+                elif cmd == "RequestSession":
+                    try:
+                        session = self.sessions.create()
+                    except SessionError as e:
+                        print(f"Session refused: {e}")
+                        conn.sendall(b"Fail\n")
+                        break
+
+                    conn.sendall(json.dumps(self.session_information(session)).encode() + b"\n")
                     
                 elif cmd == "AttachToSession":
-                    sid = conn.recv(1024).decode().strip()
-                    if sid in self.sessions:
+                    sid = conn.read_line()
+                    session = self.sessions.get(sid)
+                    if session is not None:
                         conn.sendall(b"ResourceFound\n")
-                        worker_kind = conn.recv(1024).decode().strip()
-                        if worker_kind == "Desktop":
-                            self.stream_desktop(conn)
-                        elif worker_kind == "Events":
-                            self.handle_events(conn)
+                        worker_kind = conn.read_line()
+                        if worker_kind not in WorkerKind.__members__:
+                            break
+
+                        self.attach_worker(session, WorkerKind[worker_kind], conn)
+                        break
                     else:
                         conn.sendall(b"ResourceNotFound\n")
                         
@@ -120,65 +370,547 @@ class RemotexServer:
         finally:
             conn.close()
 
-    def stream_desktop(self, conn):
-        # Read params (simplified, just consume lines)
-        conn.recv(1024) # ScreenName etc.
-        
-        print("Starting desktop stream...")
+    def serve_multiplexed(self, session, conn):
+        mux = Multiplexer(
+            conn.sock,
+            initial_data=conn.take_buffer(),
+            on_channel_opened=lambda stream: threading.Thread(
+                target=self.serve_channel, args=(session, stream), daemon=True
+            ).start()
+        )
+        session.replace_connection(mux)
+        mux.start_writer()
+        mux.run()
+
+    def serve_channel(self, session, stream):
         try:
-            while True:
+            if stream.channel == Channel.Control:
+                self.handle_control(session, stream)
+            elif stream.channel == Channel.Desktop:
+                self.attach_worker(session, WorkerKind.Desktop, stream)
+            elif stream.channel == Channel.Events:
+                self.attach_worker(session, WorkerKind.Events, stream)
+            elif stream.channel == Channel.Clipboard:
+                self.attach_worker(session, WorkerKind.Clipboard, stream)
+        finally:
+            stream.close()
+
+    def handle_control(self, session, stream):
+        conn = BufferedSocket(stream)
+        while True:
+            try:
+                command = json.loads(conn.read_line())
+            except EOFError:
+                break
+            except json.JSONDecodeError:
+                continue
+
+            if command.get("Command") == "CloseSession":
+                self.sessions.remove(session.id)
+                break
+
+    def attach_worker(self, session, kind, conn):
+        try:
+            with self.sessions.attach(session, kind, conn) as worker:
+                if kind == WorkerKind.Desktop:
+                    self.stream_desktop(conn, worker)
+                elif kind == WorkerKind.Events:
+                    self.handle_events(conn, worker)
+                elif kind == WorkerKind.Clipboard:
+                    self.sync_clipboard(conn, worker)
+                elif kind == WorkerKind.FileTransfer:
+                    self.transfer_files(conn, worker)
+        except SessionError as e:
+            print(f"Worker refused: {e}")
+
+    def stream_desktop(self, conn, worker):
+        # Params are a single JSON line (ScreenName, ImageCompressionQuality, BlockSize...)
+        reader = BufferedSocket(conn)
+        try:
+            params = json.loads(reader.read_line() or "{}")
+        except (EOFError, json.JSONDecodeError):
+            params = {}
+
+        quality = params.get("ImageCompressionQuality", DEFAULT_IMAGE_QUALITY)
+        block_size = params.get("BlockSize", tiles.DEFAULT_BLOCK_SIZE)
+        encoding, pixel_format = self.tile_encoding(params)
+
+        sender = None
+        stopped = threading.Event()
+        keyframe_requested = threading.Event()
+        if params.get("DatagramTransport"):
+            sender = self.open_datagram_transport(reader, block_size)
+        threading.Thread(
+            target=self.read_desktop_feedback, args=(worker.session, reader, sender, stopped, keyframe_requested),
+            name=f"DesktopFeedback-{worker.session.id}", daemon=True
+        ).start()
+
+        session = worker.session
+        recorder = session.recorder
+        rate = RateController([session.bucket, self.bandwidth], session.throughput, quality)
+
+        capture_seconds = metrics.CAPTURE_SECONDS
+        encode_seconds = metrics.ENCODE_SECONDS
+        tile_hits = metrics.TILES.labels("hit")
+        tile_misses = metrics.TILES.labels("miss")
+        frames_dropped = metrics.FRAMES_DROPPED.labels("bandwidth")
+        timer = profiling.SPANS.timer(f"Desktop-{session.id}")
+        tracer = session.tracer
+
+        print(f"Starting desktop stream ({'UDP' if sender is not None else 'TCP'}, {encoding.name})...")
+        try:
+            # Every new desktop worker (first connection or resumed one) starts with a keyframe, then only the tiles
+            # that changed since the previous capture are sent.
+            previous = None
+            frame = 0 # Frames and tiles sent by this stream, the viewer numbers them the same way (tracing)
+            tile = 0
+            while not stopped.is_set():
+                session.profiler.step()
+                timer.start()
+                tracing = tracer.enabled
+                frame_start = time.monotonic()
+
                 # Capture
-                img = desktop.capture_screen()
-                
-                # Compress
-                buffer = io.BytesIO()
-                img.save(buffer, format="JPEG", quality=60) # Reduced quality for speed
-                data = buffer.getvalue()
-                
-                # Send Header: Size(4), X(4), Y(4), Updated(1)
-                # Total 13 bytes
-                header = struct.pack("IIIB", len(data), 0, 0, 0)
-                
-                conn.sendall(header)
-                conn.sendall(data)
-                
-                time.sleep(0.005) # Reduced sleep for higher FPS
+                capture_start = time.perf_counter()
+                img = self.capture_source.capture()
+                encode_start = time.perf_counter()
+                capture_seconds.observe(encode_start - capture_start)
+                timer.mark("capture")
+
+                # Viewer gave up on a tile lost over UDP, needs more detail than it decoded so far (view scaled up), or
+                # the recording needs a new seek point: repaint everything
+                if keyframe_requested.is_set() or (recorder is not None and recorder.keyframe_due()):
+                    keyframe_requested.clear()
+                    previous = None
+
+                regions = tiles.changed_regions(previous, img, block_size)
+                flags = ChunkFlag.Keyframe if previous is None else ChunkFlag(0)
+
+                if previous is not None:
+                    grid = -(-img.width // block_size) * -(-img.height // block_size)
+                    dirty = sum(-(-(r - l) // block_size) * -(-(b - t) // block_size) for l, t, r, b in regions)
+                    tile_hits.inc(grid - dirty)
+                    tile_misses.inc(dirty)
+
+                previous = img
+                detected = time.perf_counter()
+                encode_time = detected - encode_start
+                timer.mark("detect")
+
+                if regions:
+                    frame += 1
+                if tracing:
+                    trace_args = {"Frame": frame} if regions else None
+                    tracer.span("capture", capture_start, encode_start, trace_args)
+                    tracer.span("detect", encode_start, detected, trace_args)
+
+                for index, (left, top, right, bottom) in enumerate(regions):
+                    encode_start = time.perf_counter()
+                    chunk_flags = flags
+                    if encoding == TileEncoding.Jpeg:
+                        data = tiles.encode_region(img, (left, top, right, bottom), rate.quality)
+                    else:
+                        data = tiles.encode_pixels(img, (left, top, right, bottom), pixel_format,
+                                                   encoding == TileEncoding.Zlib)
+                        chunk_flags |= ChunkFlag.Pixels
+                    encoded = time.perf_counter()
+                    encode_time += encoded - encode_start
+                    timer.mark("encode")
+                    tile += 1
+
+                    if index == len(regions) - 1:
+                        chunk_flags |= ChunkFlag.EndOfFrame
+
+                    # Send Header: Size(4), X(4), Y(4), Flags(1)
+                    # Total 13 bytes
+                    chunk = struct.pack("IIIB", len(data), left, top, chunk_flags) + data
+
+                    if sender is not None:
+                        size = sender.send_tile(chunk, (left, top, right, bottom))
+                    else:
+                        conn.sendall(chunk)
+                        size = len(chunk)
+
+                    if recorder is not None:
+                        recorder.write_chunk(chunk, chunk_flags)
+
+                    worker.sent(size, frames=1 if chunk_flags & ChunkFlag.EndOfFrame else 0)
+                    rate.sent(size)
+                    timer.mark("send")
+
+                    if tracing:
+                        trace_args = {"Frame": frame, "Tile": tile, "Bytes": size}
+                        tracer.span("encode", encode_start, encoded, trace_args)
+                        tracer.span("send", encoded, time.perf_counter(), trace_args)
+
+                if tracing and regions:
+                    tracer.span("frame", capture_start, time.perf_counter(),
+                                {"Frame": frame, "Tiles": len(regions), "Keyframe": bool(flags & ChunkFlag.Keyframe)})
+
+                encode_seconds.observe(encode_time)
+
+                time.sleep(FRAME_INTERVAL)
+
+                # At its cap the stream waits before capturing again: fewer updates rather than growing send buffers
+                frame_time = time.monotonic() - frame_start
+                delay = rate.wait(frame_time)
+                if delay > 0:
+                    frames_dropped.inc(max(1, round(delay / frame_time)))
+                session.quality = rate.quality
+                timer.mark("pace")
         except Exception as e:
             print(f"Stream error: {e}")
+        finally:
+            stopped.set()
+            profiling.SPANS.release(timer)
+            session.profiler.stop()
+            if sender is not None:
+                print(f"Datagram transport closed: {sender.report()}")
+                sender.sock.close()
+
+    @staticmethod
+    def tile_encoding(params):
+        """Tile encoding and raw pixel format the viewer asked for, JPEG when raw tiles are disabled or unknown"""
+        try:
+            encoding = TileEncoding[params.get("TileEncoding", TileEncoding.Jpeg.name)]
+            pixel_format = PixelFormat[params.get("PixelFormat", PixelFormat.RGB888.name)]
+        except KeyError:
+            return TileEncoding.Jpeg, PixelFormat.RGB888
+        if not RAW_TILES:
+            encoding = TileEncoding.Jpeg
+        return encoding, pixel_format
+
+    def open_datagram_transport(self, reader, block_size):
+        """Negotiate the UDP tile transport on the desktop channel:
+            server -> {"DatagramPort": port, "Token": token} (port is null when refused)
+            viewer -> HELLO datagram(s) carrying the token, from the address tiles must be sent to
+            server -> {"Datagram": true|false}, false when no HELLO came in time (tiles then stay on TCP)"""
+        if not DATAGRAM_TRANSPORT or (self.tls_context is not None and not DATAGRAM_ALLOW_UNENCRYPTED):
+            reader.sendall(json.dumps({"DatagramPort": None}).encode() + b"\n")
+            return None
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((LISTEN_IP, 0))
+        token = os.urandom(16).hex()
+
+        reader.sendall(json.dumps({"DatagramPort": sock.getsockname()[1], "Token": token}).encode() + b"\n")
+
+        address = None
+        deadline = time.monotonic() + DATAGRAM_HELLO_TIMEOUT
+        try:
+            while address is None and time.monotonic() < deadline:
+                sock.settimeout(max(0.01, deadline - time.monotonic()))
+                data, source = sock.recvfrom(datagram.DATAGRAM_BUFFER_SIZE)
+                if data[:1] == bytes([datagram.KIND_HELLO]) and data[datagram.DATAGRAM_HEADER.size:] == token.encode():
+                    address = source
+        except OSError:
+            pass
+
+        reader.sendall(json.dumps({"Datagram": address is not None}).encode() + b"\n")
 
-    def handle_events(self, conn):
+        if address is None:
+            print("No datagram received from the viewer, desktop tiles stay on TCP")
+            sock.close()
+            return None
+
+        sock.settimeout(None)
+        return datagram.TileSender(sock, address, block_size, pacing_rate=DATAGRAM_PACING_RATE)
+
+    def read_desktop_feedback(self, session, reader, sender, stopped, keyframe_requested):
+        """Viewer feedback on the desktop channel: NACKs of a UDP stream (`sender`, None on TCP), keyframe requests,
+        tracing toggles"""
+        stale_tiles = metrics.FRAMES_DROPPED.labels("stale")
+        try:
+            while not stopped.is_set():
+                try:
+                    feedback = json.loads(reader.read_line())
+                except json.JSONDecodeError:
+                    continue
+
+                if "Nack" in feedback and sender is not None:
+                    skipped = sender.tiles_skipped
+                    sender.resend(feedback["Nack"], feedback.get("Fragments", []))
+                    stale_tiles.inc(sender.tiles_skipped - skipped)
+                elif feedback.get("Keyframe"):
+                    keyframe_requested.set()
+                elif "Trace" in feedback:
+                    if not feedback["Trace"]:
+                        session.stop_tracing()
+                    elif session.tracer.start():
+                        print(f"Session {session.id}: tracing, requested by the viewer")
+        except (EOFError, OSError):
+            pass
+        finally:
+            # Desktop channel closed: the viewer is gone, the UDP stream can't notice it by itself
+            stopped.set()
+
+    def handle_events(self, conn, worker):
         print("Starting event handler...")
+        session = worker.session
+        link = session.link
+        reader = BufferedSocket(conn)
+        send_lock = threading.Lock()
+        stopped = threading.Event()
+
+        def send_event(event_id, payload):
+            with send_lock:
+                conn.sendall(json.dumps({"Id": event_id.value, **payload}).encode() + b"\n")
+
+        def send_keepalives():
+            while not stopped.wait(KEEPALIVE_INTERVAL):
+                if link.is_dead():
+                    # Half-open link: drop the whole connection, the viewer may still resume the session
+                    print(f"Session {session.id}: no data from viewer for {link.timeout}s, dropping connection")
+                    if session.connection is not None:
+                        session.connection.close()
+                    conn.close()
+                    break
+
+                try:
+                    send_event(InputEvent.KeepAlive, link.ping())
+                except OSError:
+                    break
+
+        source = self.capture_source
+
+        def send_cursor_updates():
+            last = None
+            while not stopped.wait(CURSOR_POLL_INTERVAL):
+                cursor = source.cursor()
+                if cursor is None or cursor == last:
+                    continue
+
+                last = cursor
+                x, y, shape = cursor
+                try:
+                    send_event(InputEvent.MouseCursorUpdated, {"X": x, "Y": y, "Cursor": shape})
+                except OSError:
+                    break
+
+        threading.Thread(target=send_keepalives, name=f"KeepAlive-{session.id}", daemon=True).start()
+        threading.Thread(target=send_cursor_updates, name=f"Cursor-{session.id}", daemon=True).start()
+        injection_seconds = {
+            kind.value: metrics.EVENT_INJECTION_SECONDS.labels(kind.name)
+            for kind in (OutputEvent.MouseClickMove, OutputEvent.MouseWheel, OutputEvent.Keyboard)
+        }
+        timer = profiling.SPANS.timer(f"Events-{session.id}")
+
         try:
             while True:
-                line = conn.recv(4096).decode().strip() # JSON events
-                if not line: break
-                
-                # There might be multiple JSONs in one chunk or partials. 
-                # For simplicity, assume one line per event (Client must send newline).
-                # If recv gets multiple, we split.
-                parts = line.split("\n")
-                for part in parts:
-                    if not part: continue
-                    try:
-                        event = json.loads(part)
-                        eid = event.get("Id")
-                        
-                        if eid == OutputEvent.MouseClickMove.value:
-                            if event["Type"] == MouseState.Move.value:
-                                desktop.simulate_mouse_move(event["X"], event["Y"])
-                            elif event["Type"] in (MouseState.Down.value, MouseState.Up.value):
-                                desktop.simulate_mouse_click(event["X"], event["Y"], event["Button"], event["Type"] == MouseState.Down.value)
-                                
-                        elif eid == OutputEvent.MouseWheel.value:
-                            desktop.simulate_mouse_wheel(event["Delta"])
-                            
-                        elif eid == OutputEvent.Keyboard.value:
-                            desktop.simulate_text(event["Keys"])
-                            
-                    except json.JSONDecodeError:
-                        pass
+                # One JSON event per line, read through a buffer so an event split across two reads is not lost
+                try:
+                    line = reader.read_line()
+                except EOFError:
+                    break
+
+                received = time.time()
+                session.profiler.step()
+                timer.start()
+                link.touch()
+                worker.received(len(line) + 1)
+                if not line: continue
+
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                eid = event.get("Id")
+                timer.mark("parse")
+
+                if eid == OutputEvent.KeepAlive.value:
+                    if is_pong(event):
+                        link.on_pong(event)
+                    else:
+                        send_event(InputEvent.KeepAlive, LinkMonitor.pong(event, received))
+                    timer.mark("keepalive")
+                    continue
+
+                injection_start = time.perf_counter()
+
+                if eid == OutputEvent.MouseClickMove.value:
+                    if event["Type"] == MouseState.Move.value:
+                        source.mouse_move(event["X"], event["Y"])
+                    elif event["Type"] in (MouseState.Down.value, MouseState.Up.value):
+                        source.mouse_click(event["X"], event["Y"], event["Button"], event["Type"] == MouseState.Down.value)
+
+                elif eid == OutputEvent.MouseWheel.value:
+                    source.mouse_wheel(event["Delta"])
+
+                elif eid == OutputEvent.Keyboard.value:
+                    source.text(event["Keys"])
+
+                elif eid == OutputEvent.ClipboardUpdated.value:
+                    # Text only event of viewers without the Clipboard channel
+                    if clipboard.allows_send(self.clipboard_mode()) and isinstance(event.get("Text"), str):
+                        formats = {clipboard.FORMAT_TEXT: event["Text"].encode()}
+                        session.clipboard.applied(clipboard.content_digest(formats))
+                        source.clipboard.write(formats)
+                    continue
+
+                else:
+                    continue
+
+                injection_seconds[eid].observe(time.perf_counter() - injection_start)
+                timer.mark("inject")
         except Exception as e:
             print(f"Event error: {e}")
+        finally:
+            stopped.set()
+            profiling.SPANS.release(timer)
+            session.profiler.stop()
+
+    def sync_clipboard(self, conn, worker):
+        """Clipboard worker: applies the contents sent by the viewer, polls the local clipboard and sends its changes"""
+        session = worker.session
+        sync = session.clipboard
+        local = self.capture_source.clipboard
+        reader = BufferedSocket(conn)
+
+        try:
+            hello = json.loads(reader.read_line() or "{}")
+        except (EOFError, json.JSONDecodeError):
+            return
+        mode = clipboard.combine_modes(self.clipboard_mode(), clipboard.parse_mode(hello.get("Mode")))
+        conn.sendall(json.dumps({"Mode": mode.value}).encode() + b"\n")
+        print(f"Session {session.id}: clipboard {mode.name}")
+
+        stopped = threading.Event()
+        own_changes = set() # Sequence numbers of the changes made by this worker
+
+        def watch():
+            sequence = local.sequence()
+            while not stopped.wait(CLIPBOARD_POLL_INTERVAL):
+                current = local.sequence()
+                if current == sequence:
+                    continue
+                sequence = current
+                if current in own_changes:
+                    own_changes.discard(current)
+                    continue
+
+                try:
+                    formats = local.read()
+                except clipboard.ClipboardError as e:
+                    print(f"Clipboard read failed: {e}")
+                    continue
+                if not formats or sum(map(len, formats.values())) > clipboard.MAX_CLIPBOARD_SIZE:
+                    continue
+
+                digest = clipboard.content_digest(formats)
+                if not sync.outgoing(digest):
+                    continue
+                try:
+                    if clipboard.send_transfer(conn, formats, digest, lambda: local.sequence() != current):
+                        worker.sent(sum(map(len, formats.values())))
+                except OSError:
+                    break
+
+        if clipboard.allows_receive(mode):
+            threading.Thread(target=watch, name=f"Clipboard-{session.id}", daemon=True).start()
+
+        try:
+            while True:
+                try:
+                    transfer = clipboard.read_transfer(reader)
+                except EOFError:
+                    break
+                if transfer is None:
+                    continue
+
+                digest, formats = transfer
+                worker.received(sum(map(len, formats.values())))
+                if not clipboard.allows_send(mode):
+                    continue # Viewer ignored the negotiated mode
+
+                sync.applied(digest)
+                own_changes.add(local.write(formats))
+        except (clipboard.ClipboardError, json.JSONDecodeError, ValueError) as e:
+            print(f"Clipboard error: {e}")
+        finally:
+            stopped.set()
+
+    def transfer_files(self, conn, worker):
+        """File transfer worker: serves the listing, download and upload requests of the viewer, one at a time"""
+        session = worker.session
+
+        def reply(message):
+            conn.sendall(json.dumps(message).encode() + b"\n")
+
+        if not FILE_TRANSFER:
+            reply({"Error": "File transfer is disabled"})
+            return
+
+        # Data is sent from the socket itself (sendfile), never through a multiplexed channel
+        sock = getattr(conn, "sock", None)
+        if not isinstance(sock, socket.socket):
+            reply({"Error": "File transfer needs a connection of its own"})
+            return
+
+        filetransfer.low_priority(sock)
+
+        if FILE_TRANSFER_ROOT is not None:
+            os.makedirs(FILE_TRANSFER_ROOT, exist_ok=True)
+
+        while True:
+            try:
+                request = json.loads(conn.read_line())
+            except EOFError:
+                break
+            except json.JSONDecodeError:
+                continue
+
+            command = request.get("Command")
+            streaming = False
+            try:
+                path = filetransfer.resolve_path(request.get("Path"), FILE_TRANSFER_ROOT)
+
+                if command == "List":
+                    reply({
+                        "Path": path,
+                        "Parent": filetransfer.parent_directory(path, FILE_TRANSFER_ROOT),
+                        "Separator": os.sep,
+                        "Entries": filetransfer.list_directory(path),
+                    })
+
+                elif command == "Download":
+                    info = os.stat(path)
+                    size, modified = info.st_size, int(info.st_mtime)
+                    offset = int(request.get("Offset", 0))
+                    # A partial download of another version of the file restarts from scratch
+                    if request.get("Size") != size or request.get("Modified") != modified or not 0 <= offset <= size:
+                        offset = 0
+                    offset -= offset % filetransfer.CHUNK_SIZE
+
+                    reply({"Size": size, "Modified": modified, "Offset": offset})
+                    streaming = True
+                    print(f"Session {session.id}: sending {path} from {offset} ({size} bytes)")
+                    sent = filetransfer.send_file(sock, path, offset, lambda: filetransfer.yield_to_session(session))
+                    worker.sent(sent)
+
+                elif command == "Upload":
+                    size, modified = int(request["Size"]), int(request["Modified"])
+                    output, offset = filetransfer.open_partial(path, size, modified)
+                    with output:
+                        reply({"Offset": offset})
+                        streaming = True
+                        print(f"Session {session.id}: receiving {path} from {offset} ({size} bytes)")
+                        end = filetransfer.receive_chunks(conn, output, offset, size)
+                        worker.received(end - offset)
+                    filetransfer.complete_partial(path, modified)
+                    reply({"Done": True})
+
+                else:
+                    reply({"Error": f"Unknown command {command}"})
+
+            except (OSError, filetransfer.TransferError, KeyError, ValueError) as e:
+                print(f"File transfer error: {e}")
+                if streaming:
+                    break # Chunks are in flight, the viewer reconnects and resumes
+                try:
+                    reply({"Error": str(e)})
+                except OSError:
+                    break
 
 if __name__ == "__main__":
     server = RemotexServer("password") # Default password
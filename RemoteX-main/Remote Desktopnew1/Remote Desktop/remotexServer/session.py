@@ -0,0 +1,311 @@
+import os
+import random
+import string
+import threading
+import time
+from contextlib import contextmanager
+
+from clipboard import ClipboardSync
+from keepalive import DEAD_LINK_TIMEOUT, LinkMonitor
+from profiling import SessionProfiler
+from protocol import WorkerKind
+from ratelimit import ThroughputMeter, TokenBucket
+from recording import SessionRecorder
+from tracing import SessionTracer
+
+# Limits
+MAX_SESSIONS = 16 # Global number of live sessions
+MAX_WORKERS = 64 # Global number of attached workers (all sessions)
+MAX_WORKERS_PER_KIND = 1 # Per session, one Desktop and one Events worker
+
+# Lifecycle
+SESSION_IDLE_TIMEOUT = 60 # Seconds a session may stay without any attached worker before it is expired, this is also
+                          # the grace period a viewer has to resume the session after a network drop.
+REAPER_INTERVAL = 5
+ATTACH_TIMEOUT = 5 # Seconds a resumed worker waits for the worker of the dropped connection to detach
+
+SESSION_ID_LENGTH = 10
+
+
+class SessionError(Exception):
+    pass
+
+
+class SessionLimitReached(SessionError):
+    pass
+
+
+class SessionClosed(SessionError):
+    pass
+
+
+class Worker:
+    """Accounting record of one worker (Desktop or Events) attached to a session.
+    Counters are only written by the worker thread itself, so the hot path takes no lock."""
+
+    def __init__(self, session, kind, conn):
+        self.session = session
+        self.kind = kind
+        self.conn = conn
+        self.thread = threading.current_thread()
+        self.started = time.monotonic()
+        self._cpu_start = time.thread_time()
+        self.cpu_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+
+    def sent(self, size, frames=0):
+        self.bytes_sent += size
+        self.frames_sent += frames
+        self.cpu_time = time.thread_time() - self._cpu_start
+
+    def received(self, size):
+        self.bytes_received += size
+        self.cpu_time = time.thread_time() - self._cpu_start
+
+    def close(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+
+class Session:
+    def __init__(self, session_id, link_timeout=DEAD_LINK_TIMEOUT, bandwidth_limit=None):
+        self.id = session_id
+        self.created = time.monotonic()
+        self.last_active = self.created
+        self.closed = False
+        self.workers = {}
+        self.connection = None
+        self.link = LinkMonitor(link_timeout) # Keepalive estimates of the current connection
+        self.bucket = TokenBucket(bandwidth_limit) # Desktop bandwidth cap of this viewer
+        self.throughput = ThroughputMeter()
+        self.quality = None # Image quality currently used by the desktop stream (lowered when capped)
+        self.profiler = SessionProfiler(session_id)
+        self.tracer = SessionTracer(session_id) # Desktop stream timeline, toggled at runtime
+        self.recorder = None
+        self.clipboard = ClipboardSync() # Clipboard content known to the viewer
+        self.lock = threading.Condition()
+
+        # Totals of workers that already detached
+        self.cpu_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+
+    def attach(self, kind, conn, timeout=0):
+        with self.lock:
+            attached = self.workers.setdefault(kind, [])
+
+            # After a resume, the worker of the dropped connection may still be on its way out
+            self.lock.wait_for(lambda: self.closed or len(attached) < MAX_WORKERS_PER_KIND, timeout)
+
+            if self.closed:
+                raise SessionClosed(f"Session {self.id} is closed")
+
+            if len(attached) >= MAX_WORKERS_PER_KIND:
+                raise SessionLimitReached(f"Session {self.id} already has a {kind.name} worker")
+
+            worker = Worker(self, kind, conn)
+            attached.append(worker)
+            self.last_active = time.monotonic()
+
+            return worker
+
+    def detach(self, worker):
+        with self.lock:
+            attached = self.workers.get(worker.kind, [])
+            if worker in attached:
+                attached.remove(worker)
+
+            self.cpu_time += worker.cpu_time
+            self.bytes_sent += worker.bytes_sent
+            self.bytes_received += worker.bytes_received
+            self.frames_sent += worker.frames_sent
+            self.last_active = time.monotonic()
+            self.lock.notify_all()
+
+    def replace_connection(self, connection):
+        """Bind the session to a new (resumed) connection, the previous one is closed so that its workers, possibly
+        blocked on a half-open link, release their slot right away."""
+        with self.lock:
+            previous, self.connection = self.connection, connection
+            self.link = LinkMonitor(self.link.timeout)
+            self.last_active = time.monotonic()
+
+        if previous is not None and previous is not connection:
+            previous.close()
+
+    def active_workers(self):
+        with self.lock:
+            return [worker for attached in self.workers.values() for worker in attached]
+
+    def idle_time(self, now):
+        if self.active_workers():
+            return 0
+        return now - self.last_active
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            connection = self.connection
+            self.lock.notify_all()
+        for worker in self.active_workers():
+            worker.close()
+        if connection is not None:
+            connection.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.stop_tracing()
+
+    def stop_tracing(self):
+        """Write the trace of the session, return its path (None when the session was not traced)"""
+        path = self.tracer.stop(self.link.report())
+        if path is not None:
+            print(f"Session {self.id}: trace written to {path}")
+        return path
+
+    def report(self):
+        workers = self.active_workers()
+        return {
+            "SessionId": self.id,
+            "Age": round(time.monotonic() - self.created, 1),
+            "Workers": [worker.kind.name for worker in workers],
+            "CpuTime": round(self.cpu_time + sum(w.cpu_time for w in workers), 3),
+            "BytesSent": self.bytes_sent + sum(w.bytes_sent for w in workers),
+            "BytesReceived": self.bytes_received + sum(w.bytes_received for w in workers),
+            "FramesSent": self.frames_sent + sum(w.frames_sent for w in workers),
+            "Link": self.link.report(),
+            "Throughput": round(self.throughput.value()),
+            "BandwidthLimit": self.bucket.rate,
+            "Quality": self.quality,
+            "Recording": None if self.recorder is None else self.recorder.report(),
+            "Clipboard": self.clipboard.report(),
+        }
+
+
+class SessionManager:
+    """Registry of live sessions: creation, worker attachment, expiry of abandoned sessions and limits."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, max_workers=MAX_WORKERS, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 link_timeout=DEAD_LINK_TIMEOUT, bandwidth_limit=None, recording_directory=None):
+        self.max_sessions = max_sessions
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self.link_timeout = link_timeout
+        self.bandwidth_limit = bandwidth_limit
+        self.recording_directory = recording_directory
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self._attaching = 0 # Worker slots reserved by attachments in progress
+        self._stopped = threading.Event()
+        self._reaper = None
+
+    def start(self):
+        self._reaper = threading.Thread(target=self._reap_loop, name="SessionReaper", daemon=True)
+        self._reaper.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self):
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise SessionLimitReached(f"Maximum number of sessions reached ({self.max_sessions})")
+
+            while True:
+                session_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=SESSION_ID_LENGTH))
+                if session_id not in self.sessions:
+                    break
+
+            session = Session(session_id, self.link_timeout, self.bandwidth_limit)
+            self.sessions[session_id] = session
+
+        print(f"Session {session_id} created")
+        if self.recording_directory is not None:
+            self.start_recording(session)
+        return session
+
+    def start_recording(self, session):
+        path = os.path.join(self.recording_directory, f"{session.id}-{time.strftime('%Y%m%d-%H%M%S')}")
+        try:
+            os.makedirs(self.recording_directory, exist_ok=True)
+            session.recorder = SessionRecorder(path, session.id)
+        except OSError as e:
+            print(f"Session {session.id} can't be recorded: {e}")
+            return
+
+        print(f"Session {session.id} recorded to {path}")
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def remove(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+            print(f"Session {session_id} closed: {session.report()}")
+
+    def live_sessions(self):
+        return list(self.sessions.values())
+
+    def worker_count(self):
+        return sum(len(session.active_workers()) for session in self.live_sessions())
+
+    @contextmanager
+    def attach(self, session, kind, conn):
+        """Attach the calling thread as `kind` worker of `session` for the duration of the block"""
+        # The slot is reserved atomically (concurrent attachments can't all pass the check), it is held until the
+        # worker is counted by its session or the attachment failed. The session may wait for a slot of its own, that
+        # wait happens outside of the manager lock.
+        with self.lock:
+            if self.worker_count() + self._attaching >= self.max_workers:
+                raise SessionLimitReached(f"Maximum number of workers reached ({self.max_workers})")
+            self._attaching += 1
+
+        try:
+            worker = session.attach(kind, conn, ATTACH_TIMEOUT)
+        finally:
+            with self.lock:
+                self._attaching -= 1
+
+        threading.current_thread().name = f"{kind.name}Worker-{session.id}"
+        try:
+            yield worker
+        finally:
+            session.detach(worker)
+
+    def expire(self, now=None):
+        """Remove sessions without any attached worker for longer than the idle timeout"""
+        if now is None:
+            now = time.monotonic()
+
+        with self.lock:
+            expired = [sid for sid, session in self.sessions.items() if session.idle_time(now) > self.idle_timeout]
+
+        for session_id in expired:
+            print(f"Session {session_id} expired")
+            self.remove(session_id)
+
+        return expired
+
+    def report(self):
+        return [session.report() for session in self.live_sessions()]
+
+    def _reap_loop(self):
+        while not self._stopped.wait(REAPER_INTERVAL):
+            self.expire()
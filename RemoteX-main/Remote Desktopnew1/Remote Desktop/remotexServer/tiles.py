@@ -0,0 +1,99 @@
+import io
+import struct
+import zlib
+
+from PIL import Image, ImageChops
+
+from protocol import ChunkFlag, PixelFormat
+
+DEFAULT_BLOCK_SIZE = 64
+
+# Raw tiles (ChunkFlag.Pixels): Width(2), Height(2), PixelFormat(1), Compressed(1) then the pixels, row after row
+PIXELS_HEADER = struct.Struct("!HHBB")
+ZLIB_LEVEL = 1 # Raw tiles are meant for fast links, compression must stay cheap
+
+# RGB565 bytes (low byte first) from the 8 bit channels, Pillow has no packer for it
+RGB565_RED_HIGH = [value & 0xF8 for value in range(256)]
+RGB565_GREEN_HIGH = [value >> 5 for value in range(256)]
+RGB565_GREEN_LOW = [(value << 3) & 0xE0 for value in range(256)]
+RGB565_BLUE_LOW = [value >> 3 for value in range(256)]
+
+
+def changed_regions(previous, current, block_size=DEFAULT_BLOCK_SIZE):
+    """Return the regions (left, top, right, bottom) of `current` that differ from `previous`.
+    The screen is split in `block_size` tiles, only tiles inside the bounding box of the difference are compared and
+    horizontally adjacent dirty tiles of a same row are merged so that a text line costs one image, not one per tile."""
+    if previous is None or previous.size != current.size:
+        return [(0, 0, current.width, current.height)]
+
+    bounding_box = ImageChops.difference(previous, current).getbbox()
+    if bounding_box is None:
+        return []
+
+    left, top, right, bottom = bounding_box
+    left -= left % block_size
+    top -= top % block_size
+
+    regions = []
+    for y in range(top, bottom, block_size):
+        tile_bottom = min(y + block_size, current.height)
+        run_start = run_end = None
+
+        for x in range(left, right, block_size):
+            box = (x, y, min(x + block_size, current.width), tile_bottom)
+            if ImageChops.difference(previous.crop(box), current.crop(box)).getbbox() is not None:
+                if run_start is None:
+                    run_start = x
+                run_end = box[2]
+            elif run_start is not None:
+                regions.append((run_start, y, run_end, tile_bottom))
+                run_start = None
+
+        if run_start is not None:
+            regions.append((run_start, y, run_end, tile_bottom))
+
+    return regions
+
+
+def encode_region(image, box, quality):
+    buffer = io.BytesIO()
+    image.crop(box).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def pack_pixels(tile, pixel_format):
+    if pixel_format == PixelFormat.RGB888:
+        return tile.tobytes()
+    if pixel_format == PixelFormat.ARGB32:
+        return tile.convert("RGBA").tobytes("raw", "BGRA")
+
+    # Channel bits don't overlap, adding them is a bitwise or
+    red, green, blue = tile.split()
+    high = ImageChops.add(red.point(RGB565_RED_HIGH), green.point(RGB565_GREEN_HIGH))
+    low = ImageChops.add(green.point(RGB565_GREEN_LOW), blue.point(RGB565_BLUE_LOW))
+    return Image.merge("LA", (low, high)).tobytes()
+
+
+def encode_pixels(image, box, pixel_format, compress):
+    """Raw pixels of a region of the captured image, the payload of a ChunkFlag.Pixels chunk"""
+    tile = image.crop(box)
+    data = pack_pixels(tile, pixel_format)
+    if compress:
+        data = zlib.compress(data, ZLIB_LEVEL)
+    return PIXELS_HEADER.pack(tile.width, tile.height, pixel_format.value, int(compress)) + data
+
+
+def decode_tile(data, flags):
+    """Pillow image of a chunk payload, JPEG or raw pixels (tools and benchmarks, the viewer decodes with Qt)"""
+    if not flags & ChunkFlag.Pixels:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    width, height, pixel_format, compressed = PIXELS_HEADER.unpack_from(data)
+    pixels = data[PIXELS_HEADER.size:]
+    if compressed:
+        pixels = zlib.decompress(pixels)
+
+    raw_mode = {PixelFormat.RGB888: "RGB", PixelFormat.RGB565: "BGR;16", PixelFormat.ARGB32: "BGRX"}
+    return Image.frombytes("RGB", (width, height), pixels, "raw", raw_mode[PixelFormat(pixel_format)])
@@ -0,0 +1,99 @@
+# Per-session timeline of the desktop stream in the Chrome trace event format (chrome://tracing, ui.perfetto.dev).
+#
+# While a session is traced, the desktop worker records a complete event per stage: capture and detect per frame,
+# encode and send per tile. Events carry the frame number and the tile sequence number of the stream (both start at 1
+# with each desktop worker): the viewer numbers what it receives the same way, so that tools/trace_merge.py can line a
+# frame up across both traces. Timestamps are wall clock microseconds, the keepalive clock offset estimate of the
+# session is saved along (otherData) for the merge tool to align the two clocks.
+#
+# Tracing is toggled at runtime for a single session, by the viewer (desktop channel feedback {"Trace": true|false})
+# or on the metrics endpoint (GET /trace?session=<id>&enable=1|0). Events are held in memory and written to
+# TRACE_DIRECTORY when tracing stops or the session closes. A disabled tracer costs one attribute check per frame.
+import json
+import os
+import threading
+import time
+
+TRACE_DIRECTORY = "traces"
+MAX_TRACE_EVENTS = 500000 # Events held per trace, later ones are dropped
+TRACE_PROCESS_ID = 1 # Viewer traces use 2
+TRACE_PROCESS_NAME = "Remotex Server"
+
+
+class SessionTracer:
+    """Trace events of one session, recorded from any worker thread while `enabled`"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.enabled = False
+        self.events = []
+        self.threads = {}
+        self.dropped = 0
+        self.started = None
+        self.epoch = 0.0
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start a new trace, False when one is already running"""
+        with self.lock:
+            if self.enabled:
+                return False
+            self.events = []
+            self.threads = {}
+            self.dropped = 0
+            self.started = time.time()
+            self.epoch = self.started - time.perf_counter() # Spans are measured with perf_counter
+            self.enabled = True
+            return True
+
+    def span(self, name, start, end, args=None):
+        """Complete event of the calling thread, `start` and `end` are perf_counter times"""
+        thread = threading.get_ident()
+        event = {
+            "name": name, "ph": "X", "pid": TRACE_PROCESS_ID, "tid": thread,
+            "ts": round((start + self.epoch) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+        }
+        if args:
+            event["args"] = args
+
+        with self.lock:
+            if not self.enabled:
+                return
+            if len(self.events) >= MAX_TRACE_EVENTS:
+                self.dropped += 1
+                return
+            if thread not in self.threads:
+                self.threads[thread] = threading.current_thread().name
+            self.events.append(event)
+
+    def stop(self, link):
+        """Stop tracing and write the trace, `link` is the keepalive report of the session. Return the path of the
+        trace, None when the session was not traced."""
+        with self.lock:
+            if not self.enabled:
+                return None
+            self.enabled = False
+            events, self.events = self.events, []
+            threads = self.threads
+
+        metadata = [{"name": "process_name", "ph": "M", "pid": TRACE_PROCESS_ID, "args": {"name": TRACE_PROCESS_NAME}}]
+        metadata += [
+            {"name": "thread_name", "ph": "M", "pid": TRACE_PROCESS_ID, "tid": thread, "args": {"name": name}}
+            for thread, name in threads.items()
+        ]
+
+        os.makedirs(TRACE_DIRECTORY, exist_ok=True)
+        path = os.path.join(TRACE_DIRECTORY, f"{self.session_id}-{time.strftime('%Y%m%d-%H%M%S')}-server.json")
+        with open(path, "w") as f:
+            json.dump({
+                "traceEvents": metadata + events,
+                "displayTimeUnit": "ms",
+                "otherData": {
+                    "Side": "Server",
+                    "SessionId": self.session_id,
+                    "Started": self.started,
+                    "Link": link, # ClockOffset: viewer clock minus server clock, in ms
+                    "DroppedEvents": self.dropped,
+                },
+            }, f)
+        return path
@@ -0,0 +1,362 @@
+# Multiplexed session transport: a single authenticated connection carries every logical channel (Control, Desktop,
+# Events, Clipboard). Each frame is prefixed with FRAME_HEADER (channel, flags, payload size). Large payloads are split
+# in fragments of at most MAX_FRAGMENT_SIZE bytes and a single writer thread always drains the most urgent channel
+# first, so a keystroke waits at most for one fragment instead of a whole desktop frame.
+import socket
+import struct
+import threading
+from collections import deque
+
+from protocol import CHANNEL_PRIORITY, Channel
+
+FRAME_HEADER = struct.Struct("!BBI")
+
+FLAG_CLOSE = 0x1
+
+MAX_FRAGMENT_SIZE = 16384
+
+# Maximum amount of bytes a single channel may have waiting in the writer queue before `sendall` blocks
+MAX_QUEUED_BYTES = 262144
+
+# Keep little unsent data in the kernel so that urgent frames are not queued behind it (Linux only)
+NOTSENT_LOWAT = 32768
+
+
+def tune_socket(sock):
+    """Disable Nagle algorithm and bound the unsent kernel queue when supported"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+    notsent_lowat = getattr(socket, "TCP_NOTSENT_LOWAT", None)
+    if notsent_lowat is not None:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, notsent_lowat, NOTSENT_LOWAT)
+        except OSError:
+            pass
+
+
+class BufferedSocket:
+    """Socket wrapper able to read lines, `recv` drains already buffered bytes first so that the legacy workers
+    (and the multiplexer) never lose pipelined data read ahead during the handshake."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def read_line(self):
+        while True:
+            index = self.buffer.find(b"\n")
+            if index != -1:
+                break
+
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise EOFError("Connection closed by the remote peer")
+            self.buffer += chunk
+
+        line = bytes(self.buffer[:index])
+        del self.buffer[:index + 1]
+
+        return line.decode().strip()
+
+    def take_buffer(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+    def recv(self, size):
+        if self.buffer:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+        return self.sock.recv(size)
+
+    def recv_into(self, view):
+        if self.buffer:
+            size = min(len(view), len(self.buffer))
+            view[:size] = self.buffer[:size]
+            del self.buffer[:size]
+            return size
+        return self.sock.recv_into(view)
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.sock.close()
+
+
+class ChannelStream:
+    """Socket-like endpoint of a logical channel (`recv`, `sendall`, `shutdown` and `close`)"""
+
+    def __init__(self, multiplexer, channel):
+        self.multiplexer = multiplexer
+        self.channel = channel
+
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        self._eof = False
+        self._closed = False
+        self.peer_closed = False # FLAG_CLOSE received
+
+    @property
+    def eof(self):
+        """True once the channel is closed and every received byte was read"""
+        with self._cond:
+            return self._eof and not self._buffer
+
+    def feed(self, data):
+        with self._cond:
+            self._buffer += data
+            self._cond.notify_all()
+
+    def feed_eof(self):
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+
+    def recv(self, size):
+        """Block until data is available, return b"" once the channel (or the connection) is closed"""
+        with self._cond:
+            while not self._buffer and not self._eof:
+                self._cond.wait()
+
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+
+            return data
+
+    def sendall(self, data):
+        if self._closed:
+            raise BrokenPipeError(f"Channel {self.channel.name} is closed")
+
+        self.multiplexer.send(self.channel, data)
+
+    def shutdown(self, how):
+        self.feed_eof()
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self.feed_eof()
+
+        self.multiplexer.close_channel(self.channel)
+
+
+class Multiplexer:
+    """Demultiplex incoming frames to channel streams (reader thread) and serialize outgoing frames by channel
+    priority (writer thread)."""
+
+    def __init__(self, sock, initial_data=b"", on_channel_opened=None, on_closed=None):
+        self.sock = sock
+        self.on_channel_opened = on_channel_opened
+        self.on_closed = on_closed
+
+        self._buffer = bytearray(initial_data)
+        self._channels = {}
+        # Channels closed here whose close the peer did not acknowledge yet
+        self._closed_channels = set()
+        self._channels_lock = threading.Lock()
+
+        priorities = sorted(set(CHANNEL_PRIORITY.values()))
+        self._queues = [deque() for _ in priorities]
+        self._queued_bytes = {channel: 0 for channel in Channel}
+        self._write_cond = threading.Condition()
+        self._closed = False
+
+        self._reader = None
+        self._writer = threading.Thread(target=self._write_loop, name="MultiplexerWriter", daemon=True)
+
+        tune_socket(sock)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def start(self):
+        """Start both reader and writer threads"""
+        self._writer.start()
+
+        self._reader = threading.Thread(target=self.run, name="MultiplexerReader", daemon=True)
+        self._reader.start()
+
+    def run(self):
+        """Reader loop, may be called directly from an existing thread (writer must be started with `start_writer`)"""
+        try:
+            while not self._closed:
+                channel_id, flags, size = FRAME_HEADER.unpack(self._recv_exact(FRAME_HEADER.size))
+                payload = self._recv_exact(size) if size else b""
+
+                try:
+                    channel = Channel(channel_id)
+                except ValueError:
+                    print(f"Frame received for unknown channel {channel_id}")
+                    continue
+
+                with self._channels_lock:
+                    if channel in self._closed_channels:
+                        # Closed here, frames the peer sent meanwhile are dropped and its close acknowledges ours
+                        if flags & FLAG_CLOSE:
+                            self._closed_channels.discard(channel)
+                        continue
+
+                    # A bare close never opens a channel
+                    if not payload and channel not in self._channels:
+                        continue
+
+                stream = self._get_channel(channel, remote=True)
+                if payload:
+                    stream.feed(payload)
+
+                if flags & FLAG_CLOSE:
+                    stream.peer_closed = True
+                    stream.feed_eof()
+        except (OSError, EOFError) as e:
+            if not self._closed:
+                print(f"Multiplexed connection lost: {e}")
+        finally:
+            self.close()
+
+    def start_writer(self):
+        self._writer.start()
+
+    def open_channel(self, channel):
+        with self._channels_lock:
+            self._closed_channels.discard(channel)
+
+        return self._get_channel(channel, remote=False)
+
+    def send(self, channel, data, flags=0):
+        """Queue `data` to be sent on `channel`, block while the channel has too much data already queued"""
+        queue = self._queues[CHANNEL_PRIORITY[channel]]
+
+        with self._write_cond:
+            while self._queued_bytes[channel] > MAX_QUEUED_BYTES and not self._closed:
+                self._write_cond.wait()
+
+            if self._closed:
+                raise BrokenPipeError("Multiplexed connection is closed")
+
+            view = memoryview(data)
+            offset = 0
+            while True:
+                fragment = view[offset:offset + MAX_FRAGMENT_SIZE]
+                offset += len(fragment)
+
+                last = offset >= len(view)
+                frame_flags = flags if last else 0
+
+                queue.append(FRAME_HEADER.pack(channel.value, frame_flags, len(fragment)) + fragment)
+                self._queued_bytes[channel] += len(fragment)
+
+                if last:
+                    break
+
+            self._write_cond.notify_all()
+
+    def flush(self, timeout=1.0):
+        """Wait (bounded) until every queued frame was handed to the socket"""
+        with self._write_cond:
+            self._write_cond.wait_for(lambda: self._closed or not any(self._queues), timeout)
+
+    def queued_bytes(self):
+        """Bytes waiting in the writer queue, per channel"""
+        with self._write_cond:
+            return dict(self._queued_bytes)
+
+    def close_channel(self, channel):
+        with self._channels_lock:
+            stream = self._channels.pop(channel, None)
+            if stream is not None and not stream.peer_closed:
+                self._closed_channels.add(channel)
+
+        try:
+            self.send(channel, b"", FLAG_CLOSE)
+        except BrokenPipeError:
+            pass
+
+    def close(self):
+        with self._write_cond:
+            if self._closed:
+                return
+
+            self._closed = True
+            self._write_cond.notify_all()
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.sock.close()
+
+        with self._channels_lock:
+            streams = list(self._channels.values())
+            self._channels.clear()
+
+        for stream in streams:
+            stream.feed_eof()
+
+        if self.on_closed is not None:
+            self.on_closed()
+
+    def _get_channel(self, channel, remote):
+        created = False
+        with self._channels_lock:
+            stream = self._channels.get(channel)
+            if stream is None:
+                stream = ChannelStream(self, channel)
+                self._channels[channel] = stream
+                created = True
+
+        if created and remote and self.on_channel_opened is not None:
+            self.on_channel_opened(stream)
+
+        return stream
+
+    def _recv_exact(self, size):
+        while len(self._buffer) < size:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise EOFError("Connection closed by the remote peer")
+
+            self._buffer += chunk
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+
+        return data
+
+    def _write_loop(self):
+        try:
+            while True:
+                with self._write_cond:
+                    frame = None
+                    while frame is None:
+                        for queue in self._queues:
+                            if queue:
+                                frame = queue.popleft()
+                                break
+                        else:
+                            if self._closed:
+                                return
+
+                            self._write_cond.wait()
+
+                    channel = Channel(frame[0])
+                    self._queued_bytes[channel] -= len(frame) - FRAME_HEADER.size
+                    self._write_cond.notify_all()
+
+                self.sock.sendall(frame)
+        except OSError as e:
+            if not self._closed:
+                print(f"Multiplexed connection write failed: {e}")
+        finally:
+            self.close()
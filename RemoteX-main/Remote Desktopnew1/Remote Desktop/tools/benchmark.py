@@ -0,0 +1,322 @@
+"""
+    End-to-end loopback benchmark: the server streams a synthetic capture source (remotexServer/capture.py) to the
+    headless viewer core (headless_viewer.py), each in its own process, for every workload and resolution.
+
+    Reported per run: frames per second (and the update rate the workload offered), p50/p99 frame latency (capture to
+    last chunk of the frame received and decoded), bytes per frame, bandwidth and CPU seconds of each process over the
+    measurement window. Results are JSON so that releases can be compared.
+
+    With --corpus, a workload recorded from a live server (corpus_recorder.py) is replayed instead of the synthetic
+    workloads: frames by the server, input events by the viewer, both at the original pace times --speed.
+
+    Usage:
+        python benchmark.py [--workloads idle,typing,scrolling,video] [--resolutions 1280x720,1920x1080]
+                            [--duration 10] [--warmup 2] [--quality 60] [--block-size 64] [--json results.json]
+                            [--encoding Jpeg|Raw|Zlib] [--pixel-format RGB888|RGB565|ARGB32]
+        python benchmark.py --corpus workload.rxc [--speed 1.0] [--duration 10] [--json results.json]
+
+    Internal roles (spawned by the benchmark itself):
+        python benchmark.py serve --port P --width W --height H --workload X [--corpus C] --result server.json
+        python benchmark.py view --port P --duration D --warmup W [--corpus C] --result viewer.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+TOOLS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS_DIRECTORY, "..", "remotexServer"))
+
+PASSWORD = "benchmark"
+DEFAULT_WORKLOADS = "idle,typing,scrolling,video"
+DEFAULT_RESOLUTIONS = "1280x720,1920x1080"
+SERVER_START_TIMEOUT = 15
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def write_result(path, result):
+    with open(path, "w") as f:
+        json.dump(result, f)
+
+
+def read_result(path):
+    """Result written by a role process, None when it did not get that far"""
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def serve(args):
+    """Server process: runs until its stdin is closed, "mark" starts the CPU measurement window"""
+    import server
+    from capture import ReplayCaptureSource, SyntheticCaptureSource
+
+    server.LISTEN_IP = "127.0.0.1"
+    server.LISTEN_PORT = args.port
+    server.ALLOW_PLAINTEXT = True # Loopback only, the headless viewer connects in plain TCP
+
+    if args.corpus:
+        source = ReplayCaptureSource(args.corpus, speed=args.speed)
+    else:
+        source = SyntheticCaptureSource(args.width, args.height, args.workload)
+    remotex_server = server.RemotexServer(PASSWORD, capture_source=source)
+    threading.Thread(target=remotex_server.start, daemon=True).start()
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    for line in sys.stdin:
+        if line.strip() == "mark":
+            cpu_start = time.process_time()
+            wall_start = time.monotonic()
+
+    write_result(args.result, {
+        "CpuSeconds": round(time.process_time() - cpu_start, 3),
+        "Seconds": round(time.monotonic() - wall_start, 3),
+        "InputEvents": source.events,
+    })
+
+
+def view(args):
+    """Viewer process: connects, waits for the warmup, then measures for the given duration"""
+    from headless_viewer import HeadlessViewer
+
+    viewer = HeadlessViewer("127.0.0.1", args.port, PASSWORD, quality=args.quality, block_size=args.block_size,
+                            encoding=args.encoding, pixel_format=args.pixel_format)
+    viewer.start()
+
+    if args.corpus:
+        threading.Thread(target=replay_events, args=(viewer, args.corpus, args.speed), daemon=True).start()
+
+    time.sleep(args.warmup)
+    print("mark", flush=True)
+    viewer.reset()
+    cpu_start = time.process_time()
+
+    time.sleep(args.duration)
+
+    report = viewer.report()
+    report["CpuSeconds"] = round(time.process_time() - cpu_start, 3)
+    viewer.close()
+    write_result(args.result, report)
+
+
+def replay_events(viewer, path, speed):
+    """Send the recorded input events at their original pace (times `speed`), looping like the server frames"""
+    from corpus import CorpusReader
+
+    corpus = CorpusReader(path)
+    events, duration = corpus.events, corpus.duration
+    corpus.close()
+    if not events or duration <= 0:
+        return
+
+    started = time.monotonic()
+    loop = 0
+    try:
+        while not viewer.stopped.is_set():
+            for seconds, event in events:
+                delay = started + (loop * duration + seconds) / speed - time.monotonic()
+                if delay > 0 and viewer.stopped.wait(delay):
+                    return
+                viewer.send_event(event)
+            loop += 1
+    except OSError:
+        pass
+
+
+def offered_fps(args, workload):
+    if workload != "replay":
+        from capture import WORKLOAD_RATES
+        return WORKLOAD_RATES[workload]
+
+    from corpus import CorpusReader
+    corpus = CorpusReader(args.corpus)
+    try:
+        return round(len(corpus.frame_times) / max(corpus.duration, 1e-6) * args.speed, 2)
+    finally:
+        corpus.close()
+
+
+def run_one(args, workload, width, height, directory):
+    corpus = ["--corpus", os.path.abspath(args.corpus), "--speed", str(args.speed)] if args.corpus else []
+    port = free_port()
+    server_result = os.path.join(directory, f"server-{workload}-{width}x{height}.json")
+    viewer_result = os.path.join(directory, f"viewer-{workload}-{width}x{height}.json")
+
+    server_process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port), "--width", str(width),
+         "--height", str(height), "--workload", workload, "--result", server_result] + corpus,
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True, cwd=directory,
+    )
+    error = None
+    try:
+        if not wait_for_port(port, SERVER_START_TIMEOUT):
+            raise RuntimeError("Server did not start")
+
+        viewer_process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "view", "--port", str(port), "--duration", str(args.duration),
+             "--warmup", str(args.warmup), "--quality", str(args.quality), "--block-size", str(args.block_size),
+             "--encoding", args.encoding, "--pixel-format", args.pixel_format, "--result", viewer_result] + corpus,
+            stdout=subprocess.PIPE, text=True, cwd=directory,
+        )
+
+        # Both CPU windows start together, once the viewer is past its warmup
+        for line in viewer_process.stdout:
+            if line.strip() == "mark":
+                server_process.stdin.write("mark\n")
+                server_process.stdin.flush()
+        if viewer_process.wait():
+            error = f"Viewer exited with code {viewer_process.returncode}"
+    except RuntimeError as e:
+        error = str(e)
+    finally:
+        server_process.stdin.close()
+        server_process.wait(timeout=SERVER_START_TIMEOUT)
+
+    # A failed run is recorded as such, the sweep carries on with the next one
+    viewer = read_result(viewer_result)
+    server = read_result(server_result)
+    if error is None and (viewer is None or server is None):
+        error = "No result written"
+    if error is not None:
+        return {
+            "Workload": workload,
+            "Resolution": f"{width}x{height}",
+            "OfferedFps": offered_fps(args, workload),
+            "Error": error,
+        }
+
+    seconds = viewer["Seconds"]
+    return {
+        "Workload": workload,
+        "Resolution": f"{width}x{height}",
+        "OfferedFps": offered_fps(args, workload),
+        "Fps": viewer["Fps"],
+        "LatencyP50": viewer["LatencyP50"],
+        "LatencyP99": viewer["LatencyP99"],
+        "LatencySamples": viewer["LatencySamples"],
+        "BytesPerFrame": viewer["BytesPerFrame"],
+        "BandwidthBytes": round(viewer["Bytes"] / seconds) if seconds else None,
+        "ServerCpu": round(server["CpuSeconds"] / server["Seconds"], 3) if server["Seconds"] else None,
+        "ViewerCpu": round(viewer["CpuSeconds"] / seconds, 3) if seconds else None,
+        "ViewerDecodeSeconds": viewer["DecodeSeconds"],
+        "InputEventsInjected": server["InputEvents"],
+        "Error": viewer["Error"],
+    }
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback FPS, latency and bandwidth benchmark")
+    parser.add_argument("role", nargs="?", choices=("run", "serve", "view"), default="run")
+    parser.add_argument("--workloads", default=DEFAULT_WORKLOADS)
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS)
+    parser.add_argument("--duration", type=float, default=10.0, help="Measurement window per run (seconds)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds ignored after connecting (keyframe)")
+    parser.add_argument("--quality", type=int, default=60)
+    parser.add_argument("--block-size", type=int, default=64)
+    parser.add_argument("--encoding", choices=("Jpeg", "Raw", "Zlib"), default="Jpeg", help="Desktop tile encoding")
+    parser.add_argument("--pixel-format", choices=("RGB888", "RGB565", "ARGB32"), default="RGB888",
+                        help="Pixel format of Raw and Zlib tiles")
+    parser.add_argument("--json", help="Write results as JSON to this file ('-' for stdout)")
+    parser.add_argument("--corpus", help="Replay this recorded workload instead of the synthetic ones")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor")
+
+    # Internal roles
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--workload")
+    parser.add_argument("--result")
+    args = parser.parse_args()
+
+    if args.role == "serve":
+        return serve(args)
+    if args.role == "view":
+        return view(args)
+
+    if args.corpus:
+        from corpus import CorpusReader
+        corpus = CorpusReader(args.corpus)
+        width, height = corpus.size
+        corpus.close()
+        scenarios = [("replay", width, height)]
+    else:
+        scenarios = [
+            (workload, width, height)
+            for width, height in map(parse_resolution, args.resolutions.split(","))
+            for workload in args.workloads.split(",")
+        ]
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for workload, width, height in scenarios:
+            result = run_one(args, workload, width, height, directory)
+            runs.append(result)
+            if "Fps" not in result:
+                print(f"{result['Resolution']:>10} {workload:<10} failed: {result['Error']}")
+                continue
+            print(f"{result['Resolution']:>10} {workload:<10} {result['Fps']:>6} fps "
+                  f"(offered {result['OfferedFps']}), latency p50 {result['LatencyP50']} ms "
+                  f"p99 {result['LatencyP99']} ms, {result['BytesPerFrame']} B/frame, "
+                  f"CPU server {result['ServerCpu']} viewer {result['ViewerCpu']}")
+
+    results = {
+        "Parameters": {
+            "Duration": args.duration,
+            "Warmup": args.warmup,
+            "Quality": args.quality,
+            "BlockSize": args.block_size,
+            "Encoding": args.encoding,
+            "PixelFormat": args.pixel_format if args.encoding != "Jpeg" else None,
+            "Corpus": args.corpus,
+            "Speed": args.speed if args.corpus else None,
+        },
+        "Host": {
+            "Platform": platform.platform(),
+            "Python": platform.python_version(),
+            "Processor": platform.processor(),
+            "Cpus": os.cpu_count(),
+        },
+        "Runs": runs,
+    }
+
+    if args.json:
+        output = json.dumps(results, indent=2)
+        if args.json == "-":
+            print(output)
+        else:
+            with open(args.json, "w") as f:
+                f.write(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+    Record a workload corpus (remotexServer/corpus.py) from a live server: the server runs as usual, a viewer connects
+    and works normally, and every distinct captured frame plus every injected input event is written to the corpus.
+    benchmark.py --corpus then replays it against any version of the pipeline.
+
+    Frames are stored raw (width x height x 3 bytes each, only when the screen changed), mind the disk usage: one
+    minute of full HD video at 30 fps is about 11 GB.
+
+    Usage:
+        python corpus_recorder.py --output workload.rxc [--duration 60] [--max-fps 30] [--password password]
+                                  [--port 2801] [--synthetic typing --resolution 1920x1080]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remotexServer"))
+
+import server  # noqa: E402
+from capture import RecordingCaptureSource, ScreenCaptureSource, SyntheticCaptureSource  # noqa: E402
+from corpus import CorpusWriter  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a workload corpus from a live server")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to record, from the first frame")
+    parser.add_argument("--max-fps", type=float, default=30.0, help="Frames written per second at most")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--port", type=int, default=server.LISTEN_PORT)
+    parser.add_argument("--synthetic", help="Record a synthetic workload instead of the screen (idle, typing...)")
+    parser.add_argument("--resolution", default="1920x1080", help="Resolution of the synthetic workload")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        width, height = map(int, args.resolution.lower().split("x"))
+        source = SyntheticCaptureSource(width, height, args.synthetic)
+    else:
+        source = ScreenCaptureSource()
+
+    writer = CorpusWriter(args.output, {"Source": args.synthetic or "Screen", "MaxFps": args.max_fps})
+    recorder = RecordingCaptureSource(source, writer, max_fps=args.max_fps)
+
+    server.LISTEN_PORT = args.port
+    remotex_server = server.RemotexServer(args.password, capture_source=recorder)
+    threading.Thread(target=remotex_server.start, daemon=True).start()
+
+    print(f"Recording to {args.output}, connect a viewer to port {args.port} (Ctrl+C to stop)")
+    try:
+        while writer.frames == 0:
+            time.sleep(0.1)
+        print("First frame recorded")
+
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+
+    print(json.dumps(writer.report(), indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+    Headless viewer core: speaks the real session protocol (authentication, OpenSession, multiplexed Desktop and
+    Events channels, keepalive answers) without any GUI, for benchmarks and load tests. With protocol="attach" it
+    uses the connection per worker flavour instead: RequestSession, then AttachToSession for the Desktop and Events
+    workers.
+
+    Desktop chunks (JPEG, or raw pixels with encoding="Raw"/"Zlib") are read and, unless disabled, decoded with Pillow
+    like the viewer decodes them with Qt. When the server streams a synthetic capture source (remotexServer/capture.py),
+    the latency stamp of each frame is read back and frame latencies are measured (server and viewer must share the
+    wall clock, e.g. both on loopback).
+
+    Usage (as a module):
+        viewer = HeadlessViewer("127.0.0.1", 2801, "password")
+        viewer.start()
+        ...
+        viewer.reset()  # Start of the measurement window
+        ...
+        print(viewer.report())
+        viewer.close()
+"""
+
+import json
+import os
+import socket
+import ssl
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remotexServer"))
+
+from capture import STAMP_SIZE, read_stamp, stamp_age  # noqa: E402
+from keepalive import KEEPALIVE_INTERVAL, LinkMonitor, is_pong  # noqa: E402
+from protocol import Channel, ChunkFlag, InputEvent, OutputEvent  # noqa: E402
+from tiles import decode_tile  # noqa: E402
+from transport import BufferedSocket, Multiplexer  # noqa: E402
+
+CHUNK_HEADER = struct.Struct("IIIB")
+CONNECT_TIMEOUT = 10
+
+
+def percentile(values, ratio):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+class HeadlessViewer:
+    def __init__(self, host, port, password, quality=60, block_size=64, decode=True, protocol="multiplexed",
+                 tls=False, encoding="Jpeg", pixel_format="RGB888"):
+        if protocol not in ("multiplexed", "attach"):
+            raise ValueError(f"Unknown protocol {protocol}")
+
+        self.host = host
+        self.port = port
+        self.password = password
+        self.quality = quality
+        self.block_size = block_size
+        self.encoding = encoding
+        self.pixel_format = pixel_format
+        self.decode = decode
+        self.protocol = protocol
+        self.tls_context = None
+        if tls:
+            # Load tests and benchmarks only: the server certificate is not verified
+            self.tls_context = ssl.create_default_context()
+            self.tls_context.check_hostname = False
+            self.tls_context.verify_mode = ssl.CERT_NONE
+
+        self.session_id = None
+        self.multiplexer = None
+        self.connections = []
+        self.events = None
+        self.events_lock = threading.Lock()
+        self.link = LinkMonitor()
+        self.stopped = threading.Event()
+        self.threads = []
+        self.error = None
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start a new measurement window"""
+        with self.lock:
+            self.started = time.monotonic()
+            self.frames = 0
+            self.chunks = 0
+            self.bytes = 0
+            self.latencies = []
+            self.decode_time = 0.0
+            self.pending_stamp = None
+
+    def connect(self, *commands):
+        """Authenticated connection, `commands` are pipelined with the password and the banner is read afterwards"""
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        try:
+            if self.tls_context is not None:
+                sock = self.tls_context.wrap_socket(sock, server_hostname=self.host)
+            sock.settimeout(None)
+
+            conn = BufferedSocket(sock)
+            conn.sendall("".join(f"{line}\n" for line in (self.password,) + commands).encode())
+            if conn.read_line() != "RemotexServer" or conn.read_line() != "OK":
+                raise ConnectionError("Authentication failed")
+        except (OSError, EOFError):
+            sock.close()
+            raise
+
+        self.connections.append(sock)
+        return conn
+
+    def open_session(self, command):
+        conn = self.connect(command)
+        line = conn.read_line()
+        if not line.startswith("{"):
+            conn.close()
+            raise ConnectionError(f"Session refused: {line}")
+        self.session_id = json.loads(line)["SessionId"]
+        return conn
+
+    def attach(self, kind):
+        conn = self.connect("AttachToSession", self.session_id, kind)
+        response = conn.read_line()
+        if response != "ResourceFound":
+            raise ConnectionError(f"{kind} worker refused: {response}")
+        return conn
+
+    def start(self):
+        if self.protocol == "multiplexed":
+            conn = self.open_session("OpenSession")
+            self.multiplexer = Multiplexer(conn.sock, initial_data=conn.take_buffer())
+            self.multiplexer.start()
+
+            desktop = BufferedSocket(self.multiplexer.open_channel(Channel.Desktop))
+            self.events = self.multiplexer.open_channel(Channel.Events)
+            events = BufferedSocket(self.events)
+        else:
+            # The RequestSession connection stays open, the server keeps reading commands on it
+            self.open_session("RequestSession")
+            desktop = self.attach("Desktop")
+            events = self.events = self.attach("Events")
+
+        desktop.sendall(json.dumps({
+            "ScreenName": "Primary",
+            "ImageCompressionQuality": self.quality,
+            "BlockSize": self.block_size,
+            "TileEncoding": self.encoding,
+            "PixelFormat": self.pixel_format,
+        }).encode() + b"\n")
+
+        self.threads = [
+            threading.Thread(target=self.receive_desktop, args=(desktop,), daemon=True),
+            threading.Thread(target=self.receive_events, args=(events,), daemon=True),
+            threading.Thread(target=self.send_keepalives, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def recv_exact(self, stream, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = stream.recv(size - len(data))
+            if not chunk:
+                raise EOFError("Desktop channel closed")
+            data += chunk
+        return bytes(data)
+
+    def receive_desktop(self, stream):
+        try:
+            while not self.stopped.is_set():
+                size, x, y, flags = CHUNK_HEADER.unpack(self.recv_exact(stream, CHUNK_HEADER.size))
+                data = self.recv_exact(stream, size)
+
+                stamp = None
+                decode_time = 0.0
+                if self.decode:
+                    decode_start = time.perf_counter()
+                    image = decode_tile(data, flags)
+                    decode_time = time.perf_counter() - decode_start
+
+                    if x == 0 and y == 0 and image.width >= STAMP_SIZE and image.height >= STAMP_SIZE:
+                        stamp = read_stamp(image)
+
+                with self.lock:
+                    self.chunks += 1
+                    self.bytes += CHUNK_HEADER.size + size
+                    self.decode_time += decode_time
+                    if stamp is not None:
+                        self.pending_stamp = stamp
+
+                    if flags & ChunkFlag.EndOfFrame:
+                        self.frames += 1
+                        if self.pending_stamp is not None:
+                            self.latencies.append(stamp_age(self.pending_stamp))
+                            self.pending_stamp = None
+        except (EOFError, OSError) as e:
+            if not self.stopped.is_set():
+                self.error = str(e)
+
+    def receive_events(self, stream):
+        try:
+            while not self.stopped.is_set():
+                line = stream.read_line()
+                received = time.time()
+                if not line:
+                    continue
+
+                self.link.touch()
+                event = json.loads(line)
+                if event.get("Id") != InputEvent.KeepAlive.value:
+                    continue
+
+                if is_pong(event):
+                    self.link.on_pong(event)
+                else:
+                    self.send_event({"Id": OutputEvent.KeepAlive.value, **LinkMonitor.pong(event, received)})
+        except (EOFError, OSError, ValueError):
+            pass
+
+    def send_keepalives(self):
+        """Like the viewer: the first ping also opens the Events channel on the server side"""
+        try:
+            self.send_event({"Id": OutputEvent.KeepAlive.value, **self.link.ping()})
+            while not self.stopped.wait(KEEPALIVE_INTERVAL):
+                self.send_event({"Id": OutputEvent.KeepAlive.value, **self.link.ping()})
+        except OSError:
+            pass
+
+    def send_event(self, event):
+        with self.events_lock:
+            self.events.sendall(json.dumps(event).encode() + b"\n")
+
+    def report(self):
+        with self.lock:
+            elapsed = max(1e-6, time.monotonic() - self.started)
+            return {
+                "SessionId": self.session_id,
+                "Seconds": round(elapsed, 3),
+                "Frames": self.frames,
+                "Fps": round(self.frames / elapsed, 2),
+                "Chunks": self.chunks,
+                "Bytes": self.bytes,
+                "BytesPerFrame": None if not self.frames else round(self.bytes / self.frames),
+                "LatencyP50": percentile(self.latencies, 0.5),
+                "LatencyP99": percentile(self.latencies, 0.99),
+                "LatencySamples": len(self.latencies),
+                "DecodeSeconds": round(self.decode_time, 4),
+                "Link": self.link.report(),
+                "Error": self.error,
+            }
+
+    def close(self):
+        """Close the session (multiplexed protocol), sessions of the attach protocol expire on the server"""
+        self.stopped.set()
+        if self.multiplexer is not None:
+            try:
+                control = self.multiplexer.open_channel(Channel.Control)
+                control.sendall(json.dumps({"Command": "CloseSession"}).encode() + b"\n")
+                self.multiplexer.flush()
+            except OSError:
+                pass
+            self.multiplexer.close()
+
+        for sock in self.connections:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
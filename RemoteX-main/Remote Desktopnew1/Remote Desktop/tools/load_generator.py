@@ -0,0 +1,388 @@
+"""
+    Server scaling test: simulates a growing number of headless viewers (headless_viewer.py) speaking the real session
+    protocol with scripted input (mouse moves, optionally typing), and measures per-viewer frame rates and the server
+    resource usage (CPU cores, resident memory, threads, scraped from its metrics endpoint) at every step.
+
+    The knee of the curve is reported twice: "Sustained" is the largest number of viewers that still get at least
+    SUSTAINED_RATIO of the frame rate a single viewer gets, "Knee" is where the aggregate frame rate stops growing
+    proportionally (maximum distance to the diagonal of the normalized curve).
+
+    Viewers are spread over --processes viewer groups so that the load generator is not the bottleneck, prefer another
+    host than the server for the largest runs. The default protocol is the connection per worker one (RequestSession,
+    then AttachToSession for the Desktop and Events workers), --protocol multiplexed uses OpenSession like the viewer.
+
+    Usage:
+        python load_generator.py --spawn typing [--resolution 1280x720] [--steps 1,2,4,8,16,32] [--duration 10]
+        python load_generator.py --host 10.0.0.5 --password secret --metrics http://10.0.0.5:9801/metrics [--tls]
+                                 [--protocol attach|multiplexed] [--processes 4] [--input-rate 10] [--typing]
+                                 [--json results.json]
+
+    Warning: against a real server (no --spawn) the scripted input moves the mouse of the remote desktop, and types
+    into it with --typing.
+
+    Internal roles (spawned by the load generator itself):
+        python load_generator.py serve --port P --metrics-port M --workload X --resolution WxH
+        python load_generator.py group --host H --port P --password S --protocol X [--tls] [--decode]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+TOOLS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS_DIRECTORY, "..", "remotexServer"))
+
+from benchmark import free_port, parse_resolution, wait_for_port  # noqa: E402
+from headless_viewer import percentile  # noqa: E402
+
+PASSWORD = "load"
+DEFAULT_STEPS = "1,2,4,8,16,32"
+SUSTAINED_RATIO = 0.9 # Per-viewer frame rate kept, relative to the first step
+KNEE_MIN_DISTANCE = 0.1 # Smaller bends of the normalized curve are measurement noise
+SERVER_START_TIMEOUT = 15
+SCRAPE_TIMEOUT = 5
+MAX_SESSIONS = 4096 # Session limits of a spawned server
+TYPING_INTERVAL = 2.0
+
+
+def script_input(viewer, rate, typing, phase):
+    """Mouse moves along a Lissajous curve at `rate` events per second, a key every TYPING_INTERVAL seconds"""
+    from protocol import MouseState, OutputEvent
+
+    if rate <= 0:
+        return
+
+    started = time.monotonic()
+    last_key = started
+    try:
+        while not viewer.stopped.wait(1 / rate):
+            now = time.monotonic()
+            t = now - started + phase
+            viewer.send_event({
+                "Id": OutputEvent.MouseClickMove.value,
+                "Type": MouseState.Move.value,
+                "X": int(400 + 300 * math.sin(t * 1.3)),
+                "Y": int(300 + 200 * math.sin(t * 1.7)),
+            })
+            if typing and now - last_key >= TYPING_INTERVAL:
+                viewer.send_event({"Id": OutputEvent.Keyboard.value, "Keys": "a"})
+                last_key = now
+    except OSError:
+        pass
+
+
+def serve(args):
+    """Server process with a synthetic capture source and its metrics endpoint, runs until its stdin is closed"""
+    import server
+    from capture import SyntheticCaptureSource
+
+    server.LISTEN_IP = "127.0.0.1"
+    server.LISTEN_PORT = args.port
+    server.ALLOW_PLAINTEXT = True # Loopback only, the headless viewer connects in plain TCP
+    server.METRICS_ADDRESS = ("127.0.0.1", args.metrics_port)
+
+    width, height = parse_resolution(args.resolution)
+    remotex_server = server.RemotexServer(PASSWORD, SyntheticCaptureSource(width, height, args.workload))
+    remotex_server.sessions.max_sessions = MAX_SESSIONS
+    remotex_server.sessions.max_workers = MAX_SESSIONS * 2
+    threading.Thread(target=remotex_server.start, daemon=True).start()
+
+    for _ in sys.stdin:
+        pass
+
+
+def group(args):
+    """Viewer group process, driven by stdin ("add N", "mark", "report"), answers one JSON line per command"""
+    from headless_viewer import HeadlessViewer
+
+    viewers = []
+
+    def reply(result):
+        print(json.dumps(result), flush=True)
+
+    for line in sys.stdin:
+        command = line.split()
+        if not command:
+            continue
+
+        if command[0] == "add":
+            started = 0
+            errors = []
+            for _ in range(int(command[1])):
+                viewer = HeadlessViewer(args.host, args.port, args.password, quality=args.quality,
+                                        block_size=args.block_size, decode=args.decode, protocol=args.protocol,
+                                        tls=args.tls)
+                try:
+                    viewer.start()
+                except (OSError, EOFError, ValueError) as e:
+                    viewer.close()
+                    errors.append(str(e))
+                    continue
+
+                viewers.append(viewer)
+                started += 1
+                threading.Thread(target=script_input, args=(viewer, args.input_rate, args.typing, len(viewers)),
+                                 daemon=True).start()
+            reply({"Started": started, "Refused": len(errors), "Errors": errors[:3]})
+
+        elif command[0] == "mark":
+            for viewer in viewers:
+                viewer.reset()
+            reply({"Viewers": len(viewers)})
+
+        elif command[0] == "report":
+            reply({"Viewers": [viewer.report() for viewer in viewers]})
+
+    for viewer in viewers:
+        viewer.close()
+
+
+class ViewerGroup:
+    def __init__(self, args, host, port, password):
+        command = [
+            sys.executable, os.path.abspath(__file__), "group", "--host", host, "--port", str(port),
+            "--password", password, "--protocol", args.protocol, "--quality", str(args.quality),
+            "--block-size", str(args.block_size), "--input-rate", str(args.input_rate),
+        ]
+        command += ["--tls"] if args.tls else []
+        command += ["--decode"] if args.decode else []
+        command += ["--typing"] if args.typing else []
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+    def send(self, command):
+        self.process.stdin.write(command + "\n")
+        self.process.stdin.flush()
+
+    def receive(self):
+        for line in self.process.stdout:
+            if line.startswith("{"):
+                return json.loads(line)
+        raise RuntimeError("Viewer group exited")
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait(timeout=SERVER_START_TIMEOUT)
+
+
+def scrape(url):
+    """Unlabelled samples of a Prometheus text endpoint, None when it can't be reached"""
+    if url is None:
+        return None
+    try:
+        with urllib.request.urlopen(url, timeout=SCRAPE_TIMEOUT) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#") or "{" in line:
+            continue
+        name, _, value = line.partition(" ")
+        try:
+            samples[name] = float(value)
+        except ValueError:
+            pass
+    return samples
+
+
+def find_knee(steps):
+    """Number of viewers where the aggregate frame rate stops growing with them (maximum of the normalized curve
+    minus the diagonal), None when the curve has less than three points or stays about linear"""
+    points = [(step["Viewers"], step["AggregateFps"]) for step in steps if step["Viewers"]]
+    if len(points) < 3:
+        return None
+
+    (x0, y0), x1 = points[0], points[-1][0]
+    y1 = max(y for _, y in points)
+    if x1 == x0 or y1 == y0:
+        return None
+
+    distances = [((y - y0) / (y1 - y0) - (x - x0) / (x1 - x0), x) for x, y in points]
+    distance, viewers = max(distances)
+    return viewers if distance >= KNEE_MIN_DISTANCE else None
+
+
+def run_step(args, groups, target, current, metrics_url):
+    # Round robin, the groups stay balanced as viewers are added
+    additions = [target // len(groups) + (i < target % len(groups)) for i in range(len(groups))]
+    additions = [max(0, wanted - have) for wanted, have in zip(additions, current)]
+    refused = 0
+    errors = []
+    for viewer_group, count in zip(groups, additions):
+        viewer_group.send(f"add {count}")
+    for i, viewer_group in enumerate(groups):
+        result = viewer_group.receive()
+        current[i] += result["Started"]
+        refused += result["Refused"]
+        errors += result["Errors"]
+
+    time.sleep(args.warmup)
+
+    before = scrape(metrics_url)
+    started = time.monotonic()
+    for viewer_group in groups:
+        viewer_group.send("mark")
+    for viewer_group in groups:
+        viewer_group.receive()
+
+    time.sleep(args.duration)
+
+    for viewer_group in groups:
+        viewer_group.send("report")
+    reports = [report for viewer_group in groups for report in viewer_group.receive()["Viewers"]]
+    after = scrape(metrics_url)
+    seconds = time.monotonic() - started
+
+    fps = [report["Fps"] for report in reports]
+    step = {
+        "Target": target,
+        "Viewers": len(reports),
+        "Refused": refused,
+        "Disconnected": sum(1 for report in reports if report["Error"]),
+        "FpsMean": round(sum(fps) / len(fps), 2) if fps else None,
+        "FpsMin": min(fps) if fps else None,
+        "FpsP10": percentile(fps, 0.1),
+        "AggregateFps": round(sum(fps), 2),
+        "BandwidthBytes": round(sum(report["Bytes"] for report in reports) / seconds),
+        "LatencyP50": percentile([r["LatencyP50"] for r in reports if r["LatencyP50"] is not None], 0.5),
+        "RttP50": percentile([r["Link"]["Rtt"] for r in reports if r["Link"].get("Rtt") is not None], 0.5),
+        "ServerCpu": None,
+        "ServerMemoryBytes": None,
+        "ServerThreads": None,
+        "Errors": errors,
+    }
+    if before is not None and after is not None:
+        cpu = after.get("process_cpu_seconds_total", 0) - before.get("process_cpu_seconds_total", 0)
+        step["ServerCpu"] = round(cpu / seconds, 3)
+        step["ServerMemoryBytes"] = after.get("process_resident_memory_bytes")
+        step["ServerThreads"] = after.get("process_threads")
+    return step
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-viewer load generator for server scaling tests")
+    parser.add_argument("role", nargs="?", choices=("run", "serve", "group"), default="run")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2801)
+    parser.add_argument("--password", default=PASSWORD)
+    parser.add_argument("--protocol", choices=("attach", "multiplexed"), default="attach")
+    parser.add_argument("--tls", action="store_true", help="Connect with TLS (certificate not verified)")
+    parser.add_argument("--steps", default=DEFAULT_STEPS, help="Numbers of concurrent viewers, increasing")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measurement window per step (seconds)")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds ignored after adding viewers (keyframes)")
+    parser.add_argument("--processes", type=int, default=min(4, os.cpu_count() or 1), help="Viewer group processes")
+    parser.add_argument("--input-rate", type=float, default=10.0, help="Scripted mouse moves per second per viewer")
+    parser.add_argument("--typing", action="store_true", help="Also type a key every few seconds")
+    parser.add_argument("--decode", action="store_true", help="Decode the tiles (costs load generator CPU)")
+    parser.add_argument("--quality", type=int, default=60)
+    parser.add_argument("--block-size", type=int, default=64)
+    parser.add_argument("--metrics", help="Metrics endpoint of the server (METRICS_ADDRESS), for its resource usage")
+    parser.add_argument("--spawn", metavar="WORKLOAD", help="Start a local server with this synthetic workload")
+    parser.add_argument("--resolution", default="1280x720", help="Resolution of the spawned server")
+    parser.add_argument("--json", help="Write results as JSON to this file ('-' for stdout)")
+
+    # Internal roles
+    parser.add_argument("--metrics-port", type=int)
+    parser.add_argument("--workload")
+    args = parser.parse_args()
+
+    if args.role == "serve":
+        return serve(args)
+    if args.role == "group":
+        return group(args)
+
+    steps = sorted(set(int(step) for step in args.steps.split(",")))
+    host, port, password, metrics_url = args.host, args.port, args.password, args.metrics
+
+    with tempfile.TemporaryDirectory() as directory:
+        server_process = None
+        if args.spawn:
+            host, port, password = "127.0.0.1", free_port(), PASSWORD
+            metrics_port = free_port()
+            metrics_url = f"http://127.0.0.1:{metrics_port}/metrics"
+            server_process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port),
+                 "--metrics-port", str(metrics_port), "--workload", args.spawn, "--resolution", args.resolution],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True, cwd=directory,
+            )
+            if not wait_for_port(port, SERVER_START_TIMEOUT):
+                server_process.kill()
+                raise RuntimeError("Server did not start")
+
+        groups = [ViewerGroup(args, host, port, password) for _ in range(max(1, args.processes))]
+        current = [0] * len(groups)
+        results = []
+        try:
+            for target in steps:
+                step = run_step(args, groups, target, current, metrics_url)
+                results.append(step)
+                cpu = "?" if step["ServerCpu"] is None else step["ServerCpu"]
+                memory = "?" if step["ServerMemoryBytes"] is None else round(step["ServerMemoryBytes"] / 1048576)
+                print(f"{step['Viewers']:>5} viewers ({step['Refused']} refused): {step['FpsMean']} fps mean, "
+                      f"{step['FpsP10']} p10, {step['AggregateFps']} aggregate, server CPU {cpu} cores, "
+                      f"{memory} MB", flush=True)
+                if step["Viewers"] == 0 or step["Refused"] and step["Viewers"] < target:
+                    break # Server full, larger steps would measure the same sessions
+        finally:
+            for viewer_group in groups:
+                viewer_group.close()
+            if server_process is not None:
+                server_process.stdin.close()
+                server_process.wait(timeout=SERVER_START_TIMEOUT)
+
+    baseline = results[0]["FpsMean"] if results else None
+    sustained = None
+    for step in results:
+        if baseline and step["FpsMean"] is not None and step["FpsMean"] >= SUSTAINED_RATIO * baseline:
+            sustained = step["Viewers"]
+    knee = find_knee(results)
+    print(f"Sustained: {sustained} viewers (at least {SUSTAINED_RATIO:.0%} of {baseline} fps), "
+          f"knee: {'none within the steps' if knee is None else f'{knee} viewers'}")
+
+    output = {
+        "Parameters": {
+            "Protocol": args.protocol,
+            "Tls": args.tls,
+            "Steps": steps,
+            "Duration": args.duration,
+            "Warmup": args.warmup,
+            "Processes": len(groups),
+            "InputRate": args.input_rate,
+            "Typing": args.typing,
+            "Decode": args.decode,
+            "Quality": args.quality,
+            "BlockSize": args.block_size,
+            "Spawn": args.spawn,
+            "Resolution": args.resolution if args.spawn else None,
+        },
+        "Host": {
+            "Platform": platform.platform(),
+            "Python": platform.python_version(),
+            "Processor": platform.processor(),
+            "Cpus": os.cpu_count(),
+        },
+        "Steps": results,
+        "Sustained": sustained,
+        "Knee": knee,
+    }
+
+    if args.json:
+        text = json.dumps(output, indent=2)
+        if args.json == "-":
+            print(text)
+        else:
+            with open(args.json, "w") as f:
+                f.write(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+    Inspect and extract session recordings written by the server (RECORDING_DIRECTORY, see remotexServer/recording.py).
+
+    info: metadata, duration, chunk and keyframe counts.
+    snapshot: the desktop as displayed at a given time, rebuilt from the preceding keyframe (constant time seek).
+    reindex: rebuild the index of a recording from its data file.
+
+    Usage:
+        python recording_tool.py info <recording.rxr> [--json]
+        python recording_tool.py snapshot <recording.rxr> --at 42.5 --output frame.png
+        python recording_tool.py reindex <recording.rxr>
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remotexServer"))
+
+from protocol import ChunkFlag  # noqa: E402
+from recording import CHUNK_HEADER, DATA_EXTENSION, RecordingReader, rebuild_index  # noqa: E402
+from tiles import decode_tile  # noqa: E402
+
+
+def info(reader):
+    chunks = 0
+    keyframes = 0
+    size = 0
+    for _, chunk in reader.chunks():
+        chunks += 1
+        size += len(chunk)
+        flags = CHUNK_HEADER.unpack_from(chunk)[3]
+        if flags & ChunkFlag.Keyframe and flags & ChunkFlag.EndOfFrame:
+            keyframes += 1
+
+    return {
+        "Metadata": reader.metadata,
+        "Duration": round(reader.duration(), 3),
+        "Chunks": chunks,
+        "Keyframes": keyframes,
+        "Bytes": size,
+        "IndexEntries": reader.index_entries,
+        "IndexStep": reader.index_step,
+    }
+
+
+def snapshot(reader, seconds):
+    from PIL import Image
+
+    screen = None
+    for _, chunk in reader.chunks(start=seconds, until=seconds):
+        size, x, y, flags = CHUNK_HEADER.unpack_from(chunk)
+        tile = decode_tile(chunk[CHUNK_HEADER.size:CHUNK_HEADER.size + size], flags)
+        if flags & ChunkFlag.Keyframe and (screen is None or tile.size != screen.size) and x == 0 and y == 0:
+            screen = Image.new("RGB", tile.size)
+        if screen is not None:
+            screen.paste(tile, (x, y))
+    return screen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remotex session recordings")
+    parser.add_argument("command", choices=("info", "snapshot", "reindex"))
+    parser.add_argument("recording")
+    parser.add_argument("--at", type=float, default=0.0, help="Snapshot time (seconds since the recording started)")
+    parser.add_argument("--output", default="snapshot.png")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    path = args.recording[:-len(DATA_EXTENSION)] if args.recording.endswith(DATA_EXTENSION) else args.recording
+
+    if args.command == "reindex":
+        rebuild_index(path)
+        print(f"Index of {path} rebuilt")
+        return
+
+    reader = RecordingReader(path)
+    try:
+        if args.command == "info":
+            result = info(reader)
+            if args.json:
+                print(json.dumps(result, indent=2))
+            else:
+                print(f"Session {result['Metadata']['SessionId']}: {result['Duration']}s, {result['Chunks']} chunks, "
+                      f"{result['Keyframes']} keyframes, {result['Bytes']} bytes")
+        else:
+            image = snapshot(reader, args.at)
+            if image is None:
+                print("No keyframe before this time")
+                return 1
+            image.save(args.output)
+            print(f"Desktop at {args.at}s saved to {args.output}")
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+    Measure TLS overhead against plain TCP for desktop frames over loopback.
+
+    For each transport (plain TCP, TLS 1.3 default suite, TLS 1.2 AES-GCM, TLS 1.2 ChaCha20-Poly1305) a sender pushes
+    length prefixed frames of incompressible data (JPEG-like) to a receiver thread. Reported per frame size:
+    throughput, sender and receiver CPU time per frame and the overhead compared to plain TCP. Full versus resumed
+    handshake latency is measured as well.
+
+    Usage:
+        python tls_benchmark.py [--cert server.crt --key server.key] [--frames 500] [--sizes 16384,65536,262144]
+                                [--json results.json]
+
+    Without --cert/--key a temporary self-signed certificate is generated with the `openssl` command line tool.
+"""
+
+import argparse
+import json
+import os
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+FRAME_HEADER = struct.Struct("!I")
+
+TRANSPORTS = [
+    # Name, maximum TLS version, TLS 1.2 cipher string
+    ("plain", None, None),
+    ("tls1.3", ssl.TLSVersion.TLSv1_3, None),
+    ("tls1.2-aesgcm", ssl.TLSVersion.TLSv1_2, "ECDHE+AESGCM"),
+    ("tls1.2-chacha20", ssl.TLSVersion.TLSv1_2, "ECDHE+CHACHA20"),
+]
+
+
+def generate_certificate(directory):
+    cert_file = os.path.join(directory, "server.crt")
+    key_file = os.path.join(directory, "server.key")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=Remotex",
+         "-keyout", key_file, "-out", cert_file],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return cert_file, key_file
+
+
+def create_contexts(cert_file, key_file, max_version, ciphers):
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert_file, key_file)
+    server_context.maximum_version = max_version
+
+    client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    client_context.check_hostname = False
+    client_context.verify_mode = ssl.CERT_NONE
+    client_context.maximum_version = max_version
+
+    if ciphers is not None:
+        server_context.set_ciphers(ciphers)
+        client_context.set_ciphers(ciphers)
+
+    return server_context, client_context
+
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 262144))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def connected_pair(server_context, client_context, client_session=None):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    accepted = {}
+
+    def accept():
+        conn, _ = listener.accept()
+        if server_context is not None:
+            conn = server_context.wrap_socket(conn, server_side=True)
+        accepted["conn"] = conn
+
+    thread = threading.Thread(target=accept)
+    thread.start()
+
+    client = socket.create_connection(listener.getsockname())
+    if client_context is not None:
+        client = client_context.wrap_socket(client, session=client_session)
+
+    thread.join()
+    listener.close()
+
+    return client, accepted["conn"]
+
+
+def benchmark_stream(server_context, client_context, frame_size, frames):
+    sender, receiver = connected_pair(server_context, client_context)
+    payload = os.urandom(frame_size)
+
+    result = {}
+
+    def receive():
+        cpu_start = time.thread_time()
+        for _ in range(frames):
+            size, = FRAME_HEADER.unpack(recv_exact(receiver, FRAME_HEADER.size))
+            recv_exact(receiver, size)
+        result["receiver_cpu"] = time.thread_time() - cpu_start
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    for _ in range(frames):
+        sender.sendall(FRAME_HEADER.pack(frame_size) + payload)
+    sender_cpu = time.thread_time() - cpu_start
+    thread.join()
+    elapsed = time.perf_counter() - wall_start
+
+    cipher = sender.cipher() if isinstance(sender, ssl.SSLSocket) else None
+
+    sender.close()
+    receiver.close()
+
+    return {
+        "frame_size": frame_size,
+        "frames": frames,
+        "cipher": cipher[0] if cipher else None,
+        "fps": round(frames / elapsed, 1),
+        "throughput_mbps": round(frames * frame_size * 8 / elapsed / 1e6, 1),
+        "sender_cpu_us_per_frame": round(sender_cpu / frames * 1e6, 1),
+        "receiver_cpu_us_per_frame": round(result["receiver_cpu"] / frames * 1e6, 1),
+    }
+
+
+def benchmark_handshake(server_context, client_context, iterations=20):
+    """Average connection setup time for a full handshake and for a resumed one (session ticket)"""
+    full = []
+    resumed = []
+    session = None
+    reused = 0
+
+    for _ in range(iterations):
+        start = time.perf_counter()
+        client, server = connected_pair(server_context, client_context)
+        full.append(time.perf_counter() - start)
+
+        # A TLS 1.3 ticket is only processed once application data is read
+        server.sendall(b"x")
+        client.recv(1)
+        session = client.session
+        client.close()
+        server.close()
+
+        start = time.perf_counter()
+        client, server = connected_pair(server_context, client_context, session)
+        resumed.append(time.perf_counter() - start)
+        reused += client.session_reused
+        client.close()
+        server.close()
+
+    return {
+        "full_handshake_ms": round(sum(full) / len(full) * 1000, 3),
+        "resumed_handshake_ms": round(sum(resumed) / len(resumed) * 1000, 3),
+        "resumed_ratio": round(reused / iterations, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TLS versus plain TCP overhead for desktop frames over loopback")
+    parser.add_argument("--cert")
+    parser.add_argument("--key")
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--sizes", default="16384,65536,262144")
+    parser.add_argument("--json", help="Write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.cert and args.key:
+            cert_file, key_file = args.cert, args.key
+        else:
+            cert_file, key_file = generate_certificate(directory)
+
+        results = {"openssl": ssl.OPENSSL_VERSION, "transports": {}}
+
+        for name, max_version, ciphers in TRANSPORTS:
+            if max_version is None:
+                server_context = client_context = None
+            else:
+                server_context, client_context = create_contexts(cert_file, key_file, max_version, ciphers)
+
+            transport = {"streams": [benchmark_stream(server_context, client_context, size, args.frames)
+                                     for size in sizes]}
+
+            if server_context is not None:
+                transport["handshake"] = benchmark_handshake(server_context, client_context)
+
+            results["transports"][name] = transport
+
+    plain = {stream["frame_size"]: stream for stream in results["transports"]["plain"]["streams"]}
+    for transport in results["transports"].values():
+        for stream in transport["streams"]:
+            reference = plain[stream["frame_size"]]
+            cpu = stream["sender_cpu_us_per_frame"] + stream["receiver_cpu_us_per_frame"]
+            reference_cpu = reference["sender_cpu_us_per_frame"] + reference["receiver_cpu_us_per_frame"]
+            stream["cpu_overhead_us_per_frame"] = round(cpu - reference_cpu, 1)
+            stream["fps_ratio"] = round(stream["fps"] / reference["fps"], 3)
+
+    for name, transport in results["transports"].items():
+        print(f"== {name}")
+        for stream in transport["streams"]:
+            print(f"   {stream['frame_size']:>8} B  {stream['fps']:>9} fps  {stream['throughput_mbps']:>8} Mbit/s  "
+                  f"+{stream['cpu_overhead_us_per_frame']} us CPU/frame  x{stream['fps_ratio']} fps  "
+                  f"({stream['cipher'] or 'no encryption'})")
+        if "handshake" in transport:
+            handshake = transport["handshake"]
+            print(f"   handshake: full {handshake['full_handshake_ms']} ms, "
+                  f"resumed {handshake['resumed_handshake_ms']} ms ({handshake['resumed_ratio']:.0%} resumed)")
+
+    if args.json:
+        output = json.dumps(results, indent=2)
+        if args.json == "-":
+            print(output)
+        else:
+            with open(args.json, "w") as f:
+                f.write(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+    Merge a server and a viewer trace of the same session (remotexServer/tracing.py, remotex_viewer/remotex/tracing.py)
+    into a single Chrome trace (chrome://tracing, ui.perfetto.dev).
+
+    Viewer timestamps are moved to the server clock using the keepalive clock offset estimates saved with both traces
+    (their average when both ends measured it, --offset overrides them). Viewer tiles are keyed to the server frame
+    they were sent with by their tile sequence number, which also holds for datagram tiles completed out of order.
+    Each frame gets a flow arrow from its capture on the server to its first tile received and to the first refresh
+    after its last tile was composited on the viewer, and the capture to present latency of the frames is reported.
+
+    Usage:
+        python trace_merge.py <server.json> <viewer.json> [--output merged.json] [--offset ms]
+"""
+
+import argparse
+import json
+import statistics
+import sys
+from collections import deque
+
+
+def load_trace(path):
+    with open(path) as f:
+        trace = json.load(f)
+    if isinstance(trace, list): # JSON array format, no metadata
+        trace = {"traceEvents": trace}
+    return trace
+
+
+def clock_offset(server, viewer):
+    """Milliseconds to add to viewer timestamps to get server ones, None when neither end measured it"""
+    estimates = []
+    viewer_link = viewer.get("otherData", {}).get("Link") or {}
+    server_link = server.get("otherData", {}).get("Link") or {}
+    if viewer_link.get("Samples"):
+        estimates.append(viewer_link["ClockOffset"]) # Server clock minus viewer clock
+    if server_link.get("Samples"):
+        estimates.append(-server_link["ClockOffset"]) # Viewer clock minus server clock
+    return sum(estimates) / len(estimates) if estimates else None
+
+
+def spans(events, name):
+    return [event for event in events if event.get("ph") == "X" and event.get("name") == name]
+
+
+def frame_flows(server_events, viewer_events):
+    """Flow events capture -> first tile received -> first refresh presenting the frame, and per frame latencies"""
+    captures = {event["args"]["Frame"]: event for event in spans(server_events, "frame")}
+
+    received = {}
+    for event in sorted(spans(viewer_events, "receive"), key=lambda event: event["ts"]):
+        received.setdefault(event["args"]["Frame"], event)
+
+    # A frame is presented by the first refresh after its last tile was composited
+    last_tiles = {}
+    for event in spans(server_events, "send"):
+        frame = event["args"]["Frame"]
+        last_tiles[frame] = max(last_tiles.get(frame, 0), event["args"]["Tile"])
+
+    pending = deque(sorted(last_tiles.items(), key=lambda item: item[1]))
+    presented = {}
+    composited = 0
+    for event in sorted(spans(viewer_events, "present"), key=lambda event: event["ts"]):
+        composited = max(composited, event.get("args", {}).get("Tile", 0))
+        while pending and pending[0][1] <= composited:
+            presented[pending.popleft()[0]] = event
+
+    flows = []
+    latencies = []
+    for frame, capture in sorted(captures.items()):
+        steps = [step for step in (received.get(frame), presented.get(frame)) if step is not None]
+        if not steps:
+            continue
+
+        flows.append({"name": "frame", "cat": "frame", "ph": "s", "id": frame, "pid": capture["pid"],
+                      "tid": capture["tid"], "ts": capture["ts"]})
+        for index, step in enumerate(steps):
+            flows.append({"name": "frame", "cat": "frame", "ph": "f" if index == len(steps) - 1 else "t",
+                          "bp": "e", "id": frame, "pid": step["pid"], "tid": step["tid"], "ts": step["ts"]})
+
+        if frame in presented:
+            present = presented[frame]
+            latencies.append((present["ts"] + present["dur"] - capture["ts"]) / 1000)
+
+    return flows, latencies
+
+
+def percentile(values, ratio):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def merge(server, viewer, offset):
+    server_events = server.get("traceEvents", [])
+    viewer_events = viewer.get("traceEvents", [])
+
+    # Viewer frame numbers only follow the server ones while tiles arrive in order, tile numbers always do
+    frames_of_tiles = {
+        event["args"]["Tile"]: event["args"]["Frame"] for event in server_events if "Tile" in event.get("args", {})
+    }
+    rekeyed = 0
+    for event in viewer_events:
+        if "ts" in event:
+            event["ts"] = round(event["ts"] + offset * 1000, 1)
+
+        args = event.get("args", {})
+        frame = frames_of_tiles.get(args.get("Tile"))
+        if frame is not None and frame != args.get("Frame"):
+            args["Frame"] = frame
+            rekeyed += 1
+
+    flows, latencies = frame_flows(server_events, viewer_events)
+
+    merged = {
+        "traceEvents": server_events + viewer_events + flows,
+        "displayTimeUnit": "ms",
+        "otherData": {
+            "ClockOffset": offset,
+            "Server": server.get("otherData", {}),
+            "Viewer": viewer.get("otherData", {}),
+        },
+    }
+    report = {
+        "ClockOffset": round(offset, 3),
+        "Frames": len(spans(server_events, "frame")),
+        "FramesPresented": len(latencies),
+        "TilesRekeyed": rekeyed,
+    }
+    if latencies:
+        report["LatencyMedian"] = round(statistics.median(latencies), 2)
+        report["Latency95"] = round(percentile(latencies, 0.95), 2)
+        report["LatencyMax"] = round(max(latencies), 2)
+    return merged, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge a server and a viewer Remotex trace")
+    parser.add_argument("server")
+    parser.add_argument("viewer")
+    parser.add_argument("--output", default="merged.json")
+    parser.add_argument("--offset", type=float,
+                        help="Viewer to server clock offset in ms (default: keepalive estimate)")
+    args = parser.parse_args()
+
+    server = load_trace(args.server)
+    viewer = load_trace(args.viewer)
+    if server.get("otherData", {}).get("Side") == "Viewer" and viewer.get("otherData", {}).get("Side") == "Server":
+        server, viewer = viewer, server
+
+    offset = args.offset if args.offset is not None else clock_offset(server, viewer)
+    if offset is None:
+        print("No keepalive clock offset in either trace, assuming synchronized clocks (see --offset)", file=sys.stderr)
+        offset = 0.0
+
+    merged, report = merge(server, viewer, offset)
+    with open(args.output, "w") as f:
+        json.dump(merged, f)
+
+    print(json.dumps(report, indent=2))
+    print(f"Merged trace written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+    Exercise the UDP desktop tile transport (remotexServer/datagram.py) over loopback with injected loss.
+
+    Sender -> lossy proxy -> receiver, all on 127.0.0.1. The proxy drops datagrams following a Gilbert-Elliott model
+    (average loss rate and average burst length) and delays them by a fixed one-way latency. NACKs go back through a
+    reliable in-process queue with the same latency, as they would over the session TCP connection.
+
+    Synthetic frames dirty random regions of a block grid, regions are often dirtied again a few frames later so that
+    stale tile skipping is exercised too. Reported: tiles completed, repaired by parity, re-sent, skipped as stale,
+    abandoned, latency percentiles and observed datagram loss.
+
+    Usage:
+        python udp_loss_harness.py [--loss 0.05] [--burst 2] [--delay 20] [--frames 300] [--fps 30] [--fec 8]
+                                   [--rate 100] [--seed 1] [--json results.json]
+"""
+
+import argparse
+import heapq
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remotexServer"))
+
+import datagram  # noqa: E402
+
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+CHUNK_HEADER_SIZE = 13
+
+
+class LossyProxy:
+    """Forward datagrams from `listen` to `target`, dropping (Gilbert-Elliott) and delaying them"""
+
+    def __init__(self, target, loss, burst, delay, rng):
+        self.target = target
+        self.delay = delay
+        self.rng = rng
+
+        # Probability to enter the lossy state so that the long term loss rate is `loss` with bursts of `burst`
+        burst = max(burst, 1.0)
+        self.leave_bad = 1 / burst
+        self.enter_bad = loss * self.leave_bad / (1 - loss) if loss < 1 else 1.0
+        self.bad = False
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.005)
+        self.out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.forwarded = 0
+        self.dropped = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    def lost(self):
+        if self.bad:
+            self.bad = self.rng.random() >= self.leave_bad
+        else:
+            self.bad = self.rng.random() < self.enter_bad
+        return self.bad
+
+    def run(self):
+        queue = []
+        order = 0
+        while not self.stopped.is_set():
+            try:
+                data, _ = self.sock.recvfrom(datagram.DATAGRAM_BUFFER_SIZE)
+                if self.lost():
+                    self.dropped += 1
+                else:
+                    order += 1
+                    heapq.heappush(queue, (time.monotonic() + self.delay, order, data))
+            except socket.timeout:
+                pass
+
+            now = time.monotonic()
+            while queue and queue[0][0] <= now:
+                self.out.sendto(heapq.heappop(queue)[2], self.target)
+                self.forwarded += 1
+
+
+def synthetic_regions(rng, block_size, hot_regions):
+    """A few regions per frame, most of them picked among recently dirtied ones (typing, blinking caret...)"""
+    regions = []
+    for _ in range(rng.randint(1, 4)):
+        if hot_regions and rng.random() < 0.6:
+            regions.append(rng.choice(hot_regions))
+            continue
+
+        width = rng.randint(1, 8) * block_size
+        height = rng.randint(1, 3) * block_size
+        left = rng.randrange(0, SCREEN_WIDTH - width, block_size)
+        top = rng.randrange(0, SCREEN_HEIGHT - height, block_size)
+        region = (left, top, left + width, top + height)
+        regions.append(region)
+        hot_regions.append(region)
+
+    del hot_regions[:-16]
+    return regions
+
+
+def percentile(values, ratio):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def run(args):
+    rng = random.Random(args.seed)
+
+    receiver_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver_sock.bind(("127.0.0.1", 0))
+    receiver_sock.settimeout(0.005)
+
+    proxy = LossyProxy(receiver_sock.getsockname(), args.loss, args.burst, args.delay / 1000, rng)
+    proxy.thread.start()
+
+    sender_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = datagram.TileSender(sender_sock, proxy.address, args.block_size, pacing_rate=args.rate * 125000,
+                                 fec_group_size=args.fec)
+    assembler = datagram.TileAssembler(fec_group_size=args.fec, nack_delay=max(datagram.NACK_DELAY,
+                                                                              2 * args.delay / 1000))
+
+    sent_at = {}
+    latencies = []
+    stopped = threading.Event()
+    feedback = []
+    feedback_lock = threading.Lock()
+
+    def receive():
+        while not stopped.is_set():
+            try:
+                data, _ = receiver_sock.recvfrom(datagram.DATAGRAM_BUFFER_SIZE)
+                now = time.monotonic()
+                for tile_id, _chunk in assembler.feed(data, now):
+                    latencies.append(now - sent_at[tile_id])
+            except socket.timeout:
+                pass
+
+            nacks, _abandoned = assembler.poll()
+            with feedback_lock:
+                for nack in nacks:
+                    heapq.heappush(feedback, (time.monotonic() + args.delay / 1000, nack))
+
+    def answer_nacks():
+        while not stopped.is_set():
+            due = []
+            with feedback_lock:
+                while feedback and feedback[0][0] <= time.monotonic():
+                    due.append(heapq.heappop(feedback)[1])
+            for tile_id, indexes in due:
+                sender.resend(tile_id, indexes)
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=receive, daemon=True), threading.Thread(target=answer_nacks, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    hot_regions = []
+    started = time.monotonic()
+    for frame in range(args.frames):
+        for box in synthetic_regions(rng, args.block_size, hot_regions):
+            blocks = len(datagram.blocks_of(box, args.block_size))
+            chunk = os.urandom(CHUNK_HEADER_SIZE + blocks * rng.randint(600, 1800))
+
+            # Id the sender is about to use, recorded first since a tile may complete before `send_tile` returns
+            sent_at[sender.tile_id + 1] = time.monotonic()
+            sender.send_tile(chunk, box)
+
+        time.sleep(max(0.0, started + (frame + 1) / args.fps - time.monotonic()))
+
+    # Let late fragments, NACKs and resends settle
+    time.sleep(max(0.5, datagram.MAX_NACKS * 4 * args.delay / 1000 + 0.5))
+    stopped.set()
+    proxy.stopped.set()
+    for thread in threads + [proxy.thread]:
+        thread.join()
+
+    tiles = sender.tile_id
+    return {
+        "parameters": vars(args),
+        "tiles_sent": tiles,
+        "injected_loss": round(proxy.dropped / max(1, proxy.dropped + proxy.forwarded), 4),
+        "sender": sender.report(),
+        "receiver": assembler.report(),
+        "still_pending": len(assembler.pending),
+        "delivered_ratio": round(assembler.tiles_completed / max(1, tiles), 4),
+        "latency_ms": {
+            "p50": None if not latencies else round(percentile(latencies, 0.5) * 1000, 2),
+            "p95": None if not latencies else round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": None if not latencies else round(percentile(latencies, 0.99) * 1000, 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP tile transport over loopback with injected loss")
+    parser.add_argument("--loss", type=float, default=0.05, help="Average datagram loss rate")
+    parser.add_argument("--burst", type=float, default=2.0, help="Average loss burst length (datagrams)")
+    parser.add_argument("--delay", type=float, default=20.0, help="One-way delay (ms)")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--block-size", type=int, default=64)
+    parser.add_argument("--fec", type=int, default=datagram.FEC_GROUP_SIZE, help="Parity group size (0 disables)")
+    parser.add_argument("--rate", type=float, default=100.0, help="Pacing rate (Mbit/s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    receiver = results["receiver"]
+    sender = results["sender"]
+    print(f"tiles sent {results['tiles_sent']}, delivered {receiver['TilesCompleted']} "
+          f"({results['delivered_ratio']:.1%}), skipped as stale {receiver['TilesSkipped']}, "
+          f"abandoned {receiver['TilesAbandoned']}, pending {results['still_pending']}")
+    print(f"injected loss {results['injected_loss']:.2%}, observed {receiver['LossRate']:.2%}, "
+          f"repaired by parity {receiver['FragmentsRecovered']}, fragments re-sent {sender['FragmentsResent']}")
+    latency = results["latency_ms"]
+    print(f"tile latency p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms")
+
+    if args.json:
+        output = json.dumps(results, indent=2)
+        if args.json == "-":
+            print(output)
+        else:
+            with open(args.json, "w") as f:
+                f.write(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())